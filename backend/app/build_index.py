@@ -1,19 +1,137 @@
 import argparse
-from app.code_index import build_embeddings_only
+from app.code_index import build_embeddings_only, update_embeddings_incremental
+from app.lexical import build_bm25_index
+from app.retrieval import SYSTEMS, system_index_path, projection_path, load_projection, apply_projection
+from app.meta_store import load_meta, meta_exists, SYSTEM_IDS
 import numpy as np
 import faiss
 import os
 import json
+import time
+from typing import Optional, Sequence, Tuple
 
-def build_faiss_index(embeddings_path: str, out_path: str):
-    embs = np.load(embeddings_path)
-    d = embs.shape[1]
-    index = faiss.IndexFlatIP(d)      # cosine (embeddings already normalized)
-    index.add(embs)
+def _to_index_dim(x: np.ndarray, projection: Optional[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+    if projection is None:
+        return np.ascontiguousarray(x, dtype=np.float32)
+    return apply_projection(x, projection)
+
+def build_faiss_index(embeddings_path: str, out_path: str, ids: Optional[Sequence[int]] = None,
+                      chunk_rows: int = 65536, projection: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+    """Build an ID-mapped flat IP index. `ids` selects live rows (default: all);
+    FAISS ids equal embedding/meta row positions so they survive incremental updates.
+    With `projection`, vectors are reduced to its output dimension first."""
+    embs = np.load(embeddings_path, mmap_mode="r")
+    d = embs.shape[1] if projection is None else projection[1].shape[1]
+    ids = np.arange(len(embs), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(d))      # cosine (embeddings already normalized)
+    # Add from the memmap in slices so only one slice is copied at a time
+    for i in range(0, len(ids), chunk_rows):
+        part = ids[i:i + chunk_rows]
+        index.add_with_ids(_to_index_dim(embs[part], projection), part)
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
     faiss.write_index(index, out_path)
     return int(index.ntotal), d
 
+def update_faiss_index(embeddings_path: str, index_path: str, upsert_ids: Sequence[int],
+                       delete_ids: Sequence[int], live_ids: Sequence[int],
+                       projection: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+    """Apply an incremental update in place. A legacy (non ID-mapped) index is
+    converted once by rebuilding it from the live embedding rows."""
+    index = faiss.read_index(index_path) if os.path.exists(index_path) else None
+    if not isinstance(index, faiss.IndexIDMap2):
+        return build_faiss_index(embeddings_path, index_path, ids=live_ids, projection=projection)
+    embs = np.load(embeddings_path, mmap_mode="r")
+    if len(delete_ids):
+        index.remove_ids(np.asarray(delete_ids, dtype=np.int64))
+    if len(upsert_ids):
+        ids = np.asarray(upsert_ids, dtype=np.int64)
+        index.add_with_ids(_to_index_dim(embs[ids], projection), ids)
+    faiss.write_index(index, index_path)
+    return int(index.ntotal), int(index.d)
+
+def build_system_indexes(embeddings_path: str, meta_path: str, index_path: str,
+                         projection: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> dict:
+    """One sub-index per code system (ICD-10, CPT) holding that system's live rows
+    under their global ids, so filtered queries scan only that system."""
+    meta = load_meta(meta_path)
+    counts = {}
+    for system in SYSTEMS:
+        ids = np.flatnonzero(meta.system_ids == SYSTEM_IDS[system])
+        counts[system] = build_faiss_index(embeddings_path, system_index_path(index_path, system), ids=ids,
+                                           projection=projection)[0]
+    return counts
+
+def learn_projection(embeddings_path: str, dim: int, method: str = "pca",
+                     sample_rows: int = 50000, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Learn a (mean, matrix) projection from D to `dim` dimensions.
+      pca      -> top principal components of a row sample (centered)
+      truncate -> keep the first `dim` coordinates (Matryoshka-style; only meaningful
+                  for encoders trained with Matryoshka loss)
+    """
+    embs = np.load(embeddings_path, mmap_mode="r")
+    D = embs.shape[1]
+    if not 0 < dim < D:
+        raise ValueError(f"reduce_dim must be in (0, {D}), got {dim}")
+    if method == "truncate":
+        return np.zeros(D, dtype=np.float32), np.eye(D, dim, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(embs), size=min(sample_rows, len(embs)), replace=False))
+    x = np.asarray(embs[rows], dtype=np.float64)
+    x = x[np.linalg.norm(x, axis=1) > 0]  # skip tombstoned rows
+    mean = x.mean(axis=0)
+    cov = np.cov(x - mean, rowvar=False)
+    vals, vecs = np.linalg.eigh(cov)
+    top = np.argsort(vals)[::-1][:dim]
+    return mean.astype(np.float32), vecs[:, top].astype(np.float32)
+
+def evaluate_reduction(embeddings_path: str, projection: Tuple[np.ndarray, np.ndarray],
+                       n_queries: int = 200, k: int = 10, seed: int = 0) -> dict:
+    """
+    Compare a reduced index against the full-dimension baseline: index size, median
+    single-query latency and recall@k (overlap of reduced vs full top-k). Queries are
+    normalized midpoints of two random code embeddings (multi-concept, like notes).
+    """
+    embs = np.ascontiguousarray(np.load(embeddings_path, mmap_mode="r"), dtype=np.float32)
+    full = faiss.IndexFlatIP(embs.shape[1])
+    full.add(embs)
+    red = faiss.IndexFlatIP(projection[1].shape[1])
+    red.add(apply_projection(embs, projection))
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(embs), size=(n_queries, 2))
+    q = embs[pairs[:, 0]] + embs[pairs[:, 1]]
+    q /= np.clip(np.linalg.norm(q, axis=1, keepdims=True), 1e-12, None)
+    q_red = apply_projection(q, projection)
+
+    def _latency(index, queries) -> Tuple[float, np.ndarray]:
+        times, ids = [], []
+        for row in queries:
+            t0 = time.perf_counter()
+            _, I = index.search(row.reshape(1, -1), k)
+            times.append(time.perf_counter() - t0)
+            ids.append(I[0])
+        return float(np.median(times)) * 1000.0, np.stack(ids)
+
+    full_ms, full_ids = _latency(full, q)
+    red_ms, red_ids = _latency(red, q_red)
+    recall = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(full_ids, red_ids)]))
+    return {
+        "full_dim": int(full.d),
+        "reduced_dim": int(red.d),
+        "full_index_mb": round(full.ntotal * full.d * 4 / 1e6, 1),
+        "reduced_index_mb": round(red.ntotal * red.d * 4 / 1e6, 1),
+        "full_query_ms": round(full_ms, 3),
+        "reduced_query_ms": round(red_ms, 3),
+        f"recall@{k}": round(recall, 4),
+    }
+
+def _read_manifest(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, "manifest.json")) as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--icd_csv", required=True, help="CSV with columns Codes,Description")
@@ -22,22 +140,77 @@ if __name__ == "__main__":
     ap.add_argument("--embeddings_path", default="data/descriptions.npy")
     ap.add_argument("--meta_path", default="data/meta.npy")
     ap.add_argument("--faiss_path", default="data/faiss.index")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Diff CSVs against the existing code metadata and embed only added/changed codes")
+    ap.add_argument("--chunk_rows", type=int, default=4096, help="Rows encoded and checkpointed per chunk")
+    ap.add_argument("--workers", type=int, default=1, help="Encode worker processes (multi-process pool when > 1)")
+    ap.add_argument("--no_resume", action="store_true", help="Ignore an existing checkpoint and start over")
+    ap.add_argument("--reduce_dim", type=int, default=0, help="Reduce index vectors to this dimension (e.g. 256, 384); 0 = full")
+    ap.add_argument("--reduce_method", choices=("pca", "truncate"), default="pca")
+    ap.add_argument("--eval_reduction", action="store_true", help="Report size/latency/recall@10 vs full-dim baseline")
     args = ap.parse_args()
-    print('starting building embeddings...')
-    # 1) build embeddings + meta first (safe to re-run)
-    n_icd, n_cpt = build_embeddings_only(
-        icd_csv=args.icd_csv,
-        cpt_csv=args.cpt_csv,
-        out_dir=args.out_dir,
-        embeddings_path=args.embeddings_path,
-        meta_path=args.meta_path
-    )
-    print('Building FAISS Index....')
-    # 2) build FAISS
-    count, dim = build_faiss_index(args.embeddings_path, args.faiss_path)
-    print('FAISS indexing completed.')fa
-    # 3) manifest for sanity
+    generation = int(_read_manifest(args.out_dir).get("generation", 0)) + 1
+    extra = {}
+    if args.incremental and meta_exists(args.meta_path) and os.path.exists(args.embeddings_path):
+        print('starting incremental update...')
+        # Incremental updates keep the stored projection (if any) so ids and dims stay consistent
+        projection = load_projection(args.faiss_path)
+        stats = update_embeddings_incremental(
+            icd_csv=args.icd_csv,
+            cpt_csv=args.cpt_csv,
+            out_dir=args.out_dir,
+            embeddings_path=args.embeddings_path,
+            meta_path=args.meta_path
+        )
+        print(f"diff: +{stats['added']} ~{stats['changed']} -{stats['deleted']}")
+        count, dim = update_faiss_index(args.embeddings_path, args.faiss_path,
+                                        stats["upsert_ids"], stats["delete_ids"], stats["live_ids"],
+                                        projection=projection)
+        n_icd, n_cpt = stats["icd"], stats["cpt"]
+        extra = {"added": stats["added"], "changed": stats["changed"], "deleted": stats["deleted"]}
+    else:
+        if args.incremental:
+            print('no existing metadata/embeddings to update: falling back to a full build')
+        print('starting building embeddings...')
+        # 1) build embeddings + meta first (safe to re-run)
+        n_icd, n_cpt = build_embeddings_only(
+            icd_csv=args.icd_csv,
+            cpt_csv=args.cpt_csv,
+            out_dir=args.out_dir,
+            embeddings_path=args.embeddings_path,
+            meta_path=args.meta_path,
+            chunk_rows=args.chunk_rows,
+            workers=args.workers,
+            resume=not args.no_resume
+        )
+        # keep the build throughput/memory stats written by build_embeddings_only
+        extra = {k: v for k, v in _read_manifest(args.out_dir).items() if k in ("rows_per_sec", "peak_rss_mb")}
+        # Optional dimension reduction; the projection is stored next to the index
+        # (a full build decides from --reduce_dim alone, never from a previous build's projection)
+        proj_path = projection_path(args.faiss_path)
+        projection = None
+        if args.reduce_dim:
+            print(f'Learning {args.reduce_method} projection to {args.reduce_dim} dims....')
+            projection = learn_projection(args.embeddings_path, args.reduce_dim, method=args.reduce_method)
+            np.savez(proj_path, mean=projection[0], matrix=projection[1])
+            extra["projection"] = {"method": args.reduce_method, "dim": args.reduce_dim}
+        elif os.path.exists(proj_path):
+            os.remove(proj_path)
+        print('Building FAISS Index....')
+        # 2) build FAISS
+        count, dim = build_faiss_index(args.embeddings_path, args.faiss_path, projection=projection)
+        if projection is not None and args.eval_reduction:
+            extra["reduction"] = evaluate_reduction(args.embeddings_path, projection)
+            print(f"reduction vs full-dim baseline: {extra['reduction']}")
+    # Per-system sub-indexes for filtered / quota searches (rebuilt from the live rows)
+    extra["systems"] = build_system_indexes(args.embeddings_path, args.meta_path, args.faiss_path,
+                                            projection=projection)
+    print('FAISS indexing completed.')
+    # Lexical BM25 postings over the same ids (cheap; always rebuilt from meta)
+    n_docs, n_terms = build_bm25_index(args.meta_path, os.path.dirname(args.faiss_path) or ".")
+    print(f'BM25 index built: docs={n_docs} terms={n_terms}')
+    # 3) manifest for sanity (generation bumps on every build so caches can invalidate)
     with open(os.path.join(args.out_dir, "manifest.json"), "w") as f:
-        json.dump({"count": count, "dim": dim, "icd": n_icd, "cpt": n_cpt}, f)
+        json.dump({"count": count, "dim": dim, "icd": n_icd, "cpt": n_cpt, "generation": generation, **extra}, f)
 
     print(f"✅ FAISS index built at {args.faiss_path} | vectors: {count} dim: {dim} | ICD:{n_icd} CPT:{n_cpt}")
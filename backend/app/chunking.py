@@ -0,0 +1,139 @@
+# app/chunking.py
+import re
+from typing import List, Optional, Tuple
+
+from .config import env_int
+from .prompt_builder import count_tokens, token_budget
+from .tracing import annotate
+
+# Section header at the start of a line: "HISTORY OF PRESENT ILLNESS:", "Assessment/Plan:",
+# or a short all-caps line on its own ("IMPRESSION")
+_HEADER_RE = re.compile(r"^\s*([A-Z][A-Za-z0-9 /&(),'-]{1,60}):\s*(.*)$")
+_CAPS_RE = re.compile(r"^\s*([A-Z][A-Z0-9 /&(),'-]{2,60})\s*$")
+_SENT_RE = re.compile(r"(?<=[.;!?])\s+")
+_WS_RE = re.compile(r"\s+")
+
+
+def _sections(text: str) -> List[Tuple[str, List[str]]]:
+    """(header, sentence units) per section; text before the first header has header ""."""
+    out: List[Tuple[str, List[str]]] = [("", [])]
+    for line in str(text or "").splitlines():
+        m = _HEADER_RE.match(line)
+        if m and len(m.group(1).split()) <= 6:
+            out.append((m.group(1).strip() + ":", []))
+            line = m.group(2)
+        elif _CAPS_RE.match(line) and len(line.split()) <= 6:
+            out.append((line.strip() + ":", []))
+            continue
+        for s in _SENT_RE.split(line):
+            s = _WS_RE.sub(" ", s).strip()
+            if s:
+                out[-1][1].append(s)
+    return [(h, units) for h, units in out if h or units]
+
+
+def _split_long(unit: str, max_tokens: int) -> List[str]:
+    """Word-boundary pieces of a single over-long unit (e.g. a run-on OCR line)."""
+    pieces: List[str] = []
+    cur: List[str] = []
+    used = 0
+    for w in unit.split():
+        c = count_tokens(w)
+        if cur and used + c > max_tokens:
+            pieces.append(" ".join(cur))
+            cur, used = [], 0
+        cur.append(w)
+        used += c
+    if cur:
+        pieces.append(" ".join(cur))
+    return pieces
+
+
+def split_windows(text: str, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """Split a note into windows of at most ~max_tokens (count_tokens), section-aware.
+
+    Whole sections are packed together while they fit; a section that does not fit starts
+    a new window (unless the current one is still under a quarter full, e.g. only a short
+    header block, which is kept with it) and is cut at sentence boundaries, each
+    continuation repeating the section header and the last ~overlap_tokens of the previous
+    window, so a finding is never only seen half. Every sentence of the note is in at
+    least one window. Text that fits in one window comes back as [text]."""
+    text = str(text or "").strip()
+    if not text:
+        return []
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    windows: List[str] = []
+    cur: List[str] = []
+    used = 0
+
+    def _flush() -> None:
+        if cur:
+            windows.append(" ".join(cur))
+
+    for header, units in _sections(text):
+        h_cost = count_tokens(header)
+        room = max(8, max_tokens - h_cost)
+        pieces = [p for u in units for p in (_split_long(u, room) if count_tokens(u) > room else [u])]
+        costs = [count_tokens(p) for p in pieces]
+        first = h_cost + (costs[0] if costs else 0)
+        if cur and used + h_cost + sum(costs) > max_tokens and (used >= max_tokens // 4 or used + first > max_tokens):
+            _flush()
+            cur, used = [], 0
+        if header:
+            cur.append(header)
+            used += h_cost
+        tail: List[Tuple[str, int]] = []  # this section's pieces in the current window
+        for p, c in zip(pieces, costs):
+            if tail and used + c > max_tokens:
+                _flush()
+                carry: List[Tuple[str, int]] = []
+                for prev in reversed(tail):
+                    if sum(pc for _, pc in carry) + prev[1] > overlap_tokens:
+                        break
+                    carry.insert(0, prev)
+                cur = ([header] if header else []) + [s for s, _ in carry]
+                used = h_cost + sum(pc for _, pc in carry)
+                tail = list(carry)
+            cur.append(p)
+            used += c
+            tail.append((p, c))
+    _flush()
+    return windows
+
+
+def _capped(items: List[str], max_n: int, kind: str) -> List[str]:
+    """The first max_n items. Cutting any flags the request trace `partial` (with the
+    number dropped under `kind`), so the response says the note was not fully covered."""
+    if max_n <= 0 or len(items) <= max_n:
+        return items
+    annotate(partial=True, **{kind: len(items) - max_n})
+    return items[:max_n]
+
+
+def embedding_windows(text: str) -> List[str]:
+    """Query windows for dense retrieval. The sentence encoder truncates at 384 wordpieces
+    (all-mpnet-base-v2), so long notes are cut into EMBED_WINDOW_TOKENS windows (default 256,
+    estimated tokens, which leaves headroom) overlapping by EMBED_WINDOW_OVERLAP (48). All of
+    them are encoded (in one batch), up to EMBED_MAX_WINDOWS (128); past that the rest of the
+    note is not queried and the request is flagged partial."""
+    windows = split_windows(text, env_int("EMBED_WINDOW_TOKENS", 256), env_int("EMBED_WINDOW_OVERLAP", 48))
+    return _capped(windows, env_int("EMBED_MAX_WINDOWS", 128), "windows_dropped")
+
+
+def llm_chunks(text: str, max_chunks: Optional[int] = None) -> List[str]:
+    """Chunks for per-chunk LLM extraction: LLM_CHUNK_TOKENS each (default 60% of the prompt
+    budget) with LLM_CHUNK_OVERLAP (100) overlap. When that would take more than
+    LLM_MAX_CHUNKS (24) calls, the chunks grow up to LLM_CHUNK_MAX_TOKENS (default: the same
+    60% of the budget, so each prompt stays within PROMPT_TOKEN_BUDGET). All chunks are
+    returned, up to LLM_MAX_CHUNKS; past that the rest of the note is not coded and the
+    request is flagged partial."""
+    max_chunks = max(1, max_chunks or env_int("LLM_MAX_CHUNKS", 24))
+    size = env_int("LLM_CHUNK_TOKENS", int(token_budget() * 0.6))
+    max_size = max(size, env_int("LLM_CHUNK_MAX_TOKENS", int(token_budget() * 0.6)))
+    overlap = env_int("LLM_CHUNK_OVERLAP", 100)
+    chunks = split_windows(text, size, overlap)
+    while len(chunks) > max_chunks and size < max_size:
+        size = min(max_size, int(size * len(chunks) / max_chunks) + overlap)
+        chunks = split_windows(text, size, overlap)
+    return _capped(chunks, max_chunks, "chunks_dropped")
@@ -1,8 +1,6 @@
 from typing import List, Dict, Tuple
 import io
 import re
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 
 
 def parse_header_info(text: str) -> Dict[str, str]:
@@ -141,6 +139,30 @@ def parse_header_info(text: str) -> Dict[str, str]:
     return fields
 
 
+def resolve_cms1500_fields(payload: Dict) -> Dict:
+    """Merge explicit CMS-1500 request fields with values derived from the note text.
+    `payload` is a plain dict shaped like CMS1500Request (approved codes as dicts).
+    Returns keyword arguments for generate_cms1500_pdf.
+    """
+    derived = parse_header_info(payload.get("text") or "")
+    fields = {}
+    for key in ("patient_name", "patient_id", "provider_name", "date_of_service",
+                "patient_dob", "patient_sex", "patient_address", "place_of_service",
+                "referring_npi"):
+        fields[key] = payload.get(key) or derived.get(key, "")
+    # Split codes into ICD diagnoses and CPT procedures
+    diagnoses, procedures = split_codes(payload.get("approved") or [])
+    fields["diagnoses"] = diagnoses
+    fields["procedures"] = procedures
+    fields["diag_pointers"] = payload.get("diag_pointers") or None
+    return fields
+
+
+def render_cms1500(payload: Dict) -> bytes:
+    """Render one CMS-1500 PDF from a plain-dict request (picklable for process pools)."""
+    return generate_cms1500_pdf(**resolve_cms1500_fields(payload))
+
+
 def split_codes(approved: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
     """Return (diagnoses, procedures)
     - diagnoses: list of {code, description}
@@ -180,6 +202,8 @@ def generate_cms1500_pdf(patient_name: str,
     with labeled boxes and a table for services.
     """
     from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
 
     buf = io.BytesIO()
     c = canvas.Canvas(buf, pagesize=letter)
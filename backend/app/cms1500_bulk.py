@@ -0,0 +1,213 @@
+# app/cms1500_bulk.py
+import io
+import os
+import json
+import zipfile
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Iterator, Iterable, Tuple, Optional
+
+from .cms1500 import render_cms1500
+
+
+# Lazy, shared process pool (sized by CMS1500_BULK_WORKERS, default: CPU count)
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _workers() -> int:
+    try:
+        n = int(os.environ.get("CMS1500_BULK_WORKERS", "0"))
+    except ValueError:
+        n = 0
+    return n if n > 0 else (os.cpu_count() or 1)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=_workers())
+    return _pool
+
+
+def pdf_concat_available() -> bool:
+    # Optional: pypdf is only needed to concatenate forms into one multi-page PDF
+    import importlib.util
+    return importlib.util.find_spec("pypdf") is not None
+
+
+def _form_filename(i: int) -> str:
+    return f"cms1500_{i + 1:05d}.pdf"
+
+
+def _reset_pool(pool: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    """Replace a broken shared pool (unless another caller already did) and return the new one."""
+    global _pool
+    if _pool is pool:
+        pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+    return _get_pool()
+
+
+def render_many(payloads: Iterable[Dict]) -> Iterator[Tuple[int, Optional[bytes], str]]:
+    """Render CMS-1500 payloads across the process pool, yielding (index, pdf_bytes, error)
+    in input order. At most ~2x workers forms are in flight, so memory stays bounded
+    regardless of batch size. A failed form yields (index, None, error). If a worker
+    process dies, every in-flight form that did not finish is re-rendered alone on a
+    fresh pool, so only the form that really crashes a worker is reported as failed.
+    """
+    pool = _get_pool()
+    window = max(1, _workers() * 2)
+    items = iter(enumerate(payloads))
+    pending: deque = deque()  # (index, payload, future)
+
+    def _submit_next() -> None:
+        nxt = next(items, None)
+        if nxt is not None:
+            pending.append((nxt[0], nxt[1], pool.submit(render_cms1500, nxt[1])))
+
+    for _ in range(window):
+        _submit_next()
+    while pending:
+        i, payload, fut = pending.popleft()
+        try:
+            yield i, fut.result(), ""
+        except BrokenProcessPool:
+            # A worker died and took every unfinished future with it; any of those forms
+            # may be the culprit. Isolate: render each one alone, in order, on a fresh pool.
+            suspects = [(i, payload, fut)] + list(pending)
+            pending.clear()
+            pool = _reset_pool(pool)
+            for j, pl, f in suspects:
+                if f.done() and not f.cancelled() and f.exception() is None:
+                    yield j, f.result(), ""
+                    continue
+                try:
+                    yield j, pool.submit(render_cms1500, pl).result(), ""
+                except BrokenProcessPool:
+                    pool = _reset_pool(pool)
+                    yield j, None, "BrokenProcessPool: the worker process crashed rendering this form"
+                except Exception as e:
+                    yield j, None, f"{type(e).__name__}: {e}"
+            for _ in range(window):
+                _submit_next()
+            continue
+        except Exception as e:
+            yield i, None, f"{type(e).__name__}: {e}"
+        _submit_next()
+
+
+def pdf_max_forms() -> int:
+    """Largest batch served as one concatenated PDF (CMS1500_BULK_PDF_MAX_FORMS, default 500)."""
+    try:
+        return max(1, int(os.environ.get("CMS1500_BULK_PDF_MAX_FORMS", "500")))
+    except ValueError:
+        return 500
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable buffer that the ZIP writer appends to; drained after each entry."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        out = b"".join(self._chunks)
+        self._chunks = []
+        return out
+
+
+def _report_entry(i: int, data: Optional[bytes], err: str) -> Dict:
+    # No PHI here: only positions, sizes and error messages
+    return {
+        "index": i,
+        "filename": _form_filename(i) if data is not None else "",
+        "ok": data is not None,
+        "bytes": len(data) if data is not None else 0,
+        "error": err,
+    }
+
+
+def stream_cms1500_zip(payloads: List[Dict]) -> Iterator[bytes]:
+    """Stream a ZIP archive with one PDF per form plus report.json (per-form status)."""
+    sink = _ChunkSink()
+    report: List[Dict] = []
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for i, data, err in render_many(payloads):
+            report.append(_report_entry(i, data, err))
+            if data is not None:
+                zf.writestr(_form_filename(i), data)
+                yield sink.drain()
+        zf.writestr("report.json", json.dumps({
+            "total": len(report),
+            "ok": sum(1 for r in report if r["ok"]),
+            "failed": sum(1 for r in report if not r["ok"]),
+            "forms": report,
+        }, indent=2))
+    yield sink.drain()
+
+
+def _error_report_page(report: List[Dict]) -> bytes:
+    """Single-page PDF summarising failed forms (appended to the concatenated PDF)."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=letter)
+    _, height = letter
+    failed = [r for r in report if not r["ok"]]
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(36, height - 48, f"CMS-1500 bulk report: {len(report) - len(failed)} rendered, {len(failed)} failed")
+    c.setFont("Helvetica", 8)
+    y = height - 70
+    for r in failed:
+        if y < 42:
+            c.showPage()
+            c.setFont("Helvetica", 8)
+            y = height - 48
+        c.drawString(36, y, f"Form #{r['index'] + 1}: {r['error'][:140]}")
+        y -= 12
+    c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def stream_cms1500_pdf(payloads: List[Dict], chunk_size: int = 1 << 16) -> Iterator[bytes]:
+    """One concatenated multi-page PDF. Forms are rendered in parallel and appended in
+    order; if any form fails, a report page listing the failures is added at the end.
+    Unlike the ZIP output this is not streamed while rendering: pypdf assembles the whole
+    document in memory before the first byte is sent (then served from a temp file in
+    chunks), so batches are limited to pdf_max_forms(). Requires pypdf (see
+    pdf_concat_available).
+    """
+    if not pdf_concat_available():
+        raise RuntimeError("pypdf is not installed")
+    if len(payloads) > pdf_max_forms():
+        raise ValueError(f"{len(payloads)} forms exceed CMS1500_BULK_PDF_MAX_FORMS={pdf_max_forms()}")
+    from pypdf import PdfWriter, PdfReader  # type: ignore
+
+    writer = PdfWriter()
+    report: List[Dict] = []
+    for i, data, err in render_many(payloads):
+        report.append(_report_entry(i, data, err))
+        if data is not None:
+            writer.append(PdfReader(io.BytesIO(data)))
+    if any(not r["ok"] for r in report):
+        writer.append(PdfReader(io.BytesIO(_error_report_page(report))))
+    with tempfile.TemporaryFile() as f:
+        writer.write(f)
+        writer.close()
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,119 @@
+# app/code_catalog.py
+import os
+import bisect
+import threading
+from typing import List, Dict, Tuple, Optional, Any
+from .meta_store import MetaStore, load_meta, meta_exists, meta_stamp
+
+# Lazy, shared catalogue keyed by meta path; rebuilt when the metadata files change
+_catalogs: Dict[str, "CodeCatalog"] = {}
+_catalogs_lock = threading.Lock()
+_failed_stamps: Dict[str, Tuple[int, ...]] = {}
+
+
+def normalize_code(code: Any) -> str:
+    """Lookup key for a code: upper-case, no whitespace and no dots (M23.21 == M2321)."""
+    return "".join(str(code or "").split()).upper().replace(".", "")
+
+
+def normalize_system(system: Any) -> str:
+    return "CPT" if str(system or "").upper().startswith("CPT") else "ICD-10"
+
+
+class CodeCatalog:
+    """In-memory ICD-10/CPT catalogue built from the code metadata (meta_store).
+
+    - exact lookups: hash map (code key, system) -> meta row, O(1)
+    - prefix queries: sorted array of code keys + bisect, O(log N + k)
+    Meta rows are referenced, not copied (descriptions are decoded only for returned
+    rows); deleted (tombstoned) rows are skipped.
+    """
+
+    def __init__(self, meta: MetaStore):
+        self.meta = meta
+        # meta_stamp of the files this catalogue was built from (set by get_catalog)
+        self.stamp: Tuple[int, ...] = ()
+        self._by_key: Dict[Tuple[str, str], int] = {}
+        self._by_code: Dict[str, int] = {}
+        keyed: Dict[str, List[Tuple[str, int]]] = {"": []}
+        for i, (code, system) in enumerate(meta.iter_code_system()):
+            if not code:
+                continue
+            k = normalize_code(code)
+            self._by_key.setdefault((k, str(system)), i)
+            self._by_code.setdefault(k, i)
+            keyed[""].append((k, i))
+            keyed.setdefault(str(system), []).append((k, i))
+        # Sorted (key, row) arrays per system plus "" for all systems
+        self._sorted: Dict[str, Tuple[List[str], List[int]]] = {}
+        for sys_name, pairs in keyed.items():
+            pairs.sort()
+            self._sorted[sys_name] = ([k for k, _ in pairs], [i for _, i in pairs])
+
+    def __len__(self) -> int:
+        return len(self._sorted[""][0])
+
+    def _row(self, i: int) -> Dict[str, str]:
+        code, system, desc = self.meta[i]
+        return {"code": str(code), "system": str(system), "description": str(desc)}
+
+    def lookup(self, code: Any, system: Optional[str] = None) -> Optional[Dict[str, str]]:
+        """Exact match on the normalized code (within `system` when given, else any system)."""
+        k = normalize_code(code)
+        if not k:
+            return None
+        i = self._by_key.get((k, normalize_system(system))) if system else None
+        if i is None:
+            i = self._by_code.get(k)
+        return self._row(i) if i is not None else None
+
+    def prefix(self, prefix: str, limit: int = 20, system: Optional[str] = None) -> List[Dict[str, str]]:
+        """Codes whose normalized key starts with `prefix`, in code order."""
+        p = normalize_code(prefix)
+        keys, rows = self._sorted.get(normalize_system(system) if system else "", ([], []))
+        out: List[Dict[str, str]] = []
+        pos = bisect.bisect_left(keys, p)
+        while pos < len(keys) and len(out) < limit and keys[pos].startswith(p):
+            out.append(self._row(rows[pos]))
+            pos += 1
+        return out
+
+    def canonicalize(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return a copy of an LLM-produced code dict with catalogue code/system/description,
+        or None when the code is not in the catalogue."""
+        hit = self.lookup(item.get("code", ""), item.get("system"))
+        if hit is None:
+            return None
+        return {**item, **hit}
+
+
+def get_catalog(meta_path: str = os.path.join("data", "meta.npy")) -> Optional[CodeCatalog]:
+    """Returns a cached catalogue, or None when the code metadata is missing/unreadable.
+    Rebuilt when the metadata (or the index manifest) changes on disk, e.g. after an
+    incremental index update; if that fails the previous catalogue keeps serving, and the
+    rebuild is not retried until the files change again."""
+    cat = _catalogs.get(meta_path)
+    stamp = meta_stamp(meta_path)
+    if cat is not None and (stamp == cat.stamp or stamp == _failed_stamps.get(meta_path)):
+        return cat
+    if cat is not None and not _catalogs_lock.acquire(blocking=False):
+        return cat  # another request is rebuilding
+    if cat is None:
+        _catalogs_lock.acquire()
+    try:
+        cat = _catalogs.get(meta_path)
+        if cat is not None and cat.stamp == stamp:
+            return cat
+        if not meta_exists(meta_path):
+            return cat
+        try:
+            new = CodeCatalog(load_meta(meta_path))
+        except Exception:
+            _failed_stamps[meta_path] = stamp
+            return cat
+        new.stamp = stamp
+        _catalogs[meta_path] = new
+        _failed_stamps.pop(meta_path, None)
+        return new
+    finally:
+        _catalogs_lock.release()
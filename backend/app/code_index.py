@@ -2,12 +2,17 @@
 import os
 import re
 import json
+import time
+import hashlib
 import numpy as np
 import pandas as pd
-from typing import Tuple
-from .embeddings import embed_texts
+from typing import Tuple, List, Dict, Iterator
+from .embeddings import embed_texts, embedding_dim, start_encode_pool, stop_encode_pool
+from .meta_store import MetaStore, load_meta
 
 REQ_COLS = ("Codes", "Description")
+# Meta row left behind by a deleted code; its id is never reused or searched
+TOMBSTONE = ("", "", "")
 
 def _normalize_colnames(df: pd.DataFrame) -> pd.DataFrame:
     cols = {c.lower(): c for c in df.columns}
@@ -22,12 +27,7 @@ def _clean_text(s: str) -> str:
     s = re.sub(r"\s+", " ", s)
     return s
 
-def load_codes_from_csv(path: str, system_name: str) -> pd.DataFrame:
-    """
-    Load a code file with columns Codes,Description (any case), and return:
-      columns -> [code, description, system, text]
-    """
-    df = pd.read_csv(path)
+def _clean_frame(df: pd.DataFrame, system_name: str) -> pd.DataFrame:
     df = _normalize_colnames(df)
     # Clean
     df["code"] = df["code"].astype(str).map(_clean_text)
@@ -40,39 +40,217 @@ def load_codes_from_csv(path: str, system_name: str) -> pd.DataFrame:
     df["text"] = df["code"] + " " + df["description"]
     return df[["code", "description", "system", "text"]]
 
+def iter_codes_from_csv(path: str, system_name: str, chunksize: int = 50_000) -> Iterator[pd.DataFrame]:
+    """
+    Stream a code file in chunks of cleaned rows (same columns as load_codes_from_csv).
+    Duplicate codes are dropped across chunks (first occurrence wins).
+    """
+    seen = set()
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        df = _clean_frame(chunk, system_name)
+        df = df[~df["code"].isin(seen)]
+        seen.update(df["code"].tolist())
+        if len(df):
+            yield df
+
+def load_codes_from_csv(path: str, system_name: str) -> pd.DataFrame:
+    """
+    Load a code file with columns Codes,Description (any case), and return:
+      columns -> [code, description, system, text]
+    """
+    return _clean_frame(pd.read_csv(path), system_name)
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except Exception:
+        return 0.0
+
+def _write_json_atomic(path: str, obj: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
 def build_embeddings_only(
     icd_csv: str,
     cpt_csv: str,
     out_dir: str = "data",
     embeddings_path: str = "data/descriptions.npy",
     meta_path: str = "data/meta.npy",
+    chunk_rows: int = 4096,
+    workers: int = 1,
+    resume: bool = True,
 ) -> Tuple[int, int]:
     """
     Create and save embeddings + meta for both ICD & CPT (no FAISS yet).
+    CSVs are streamed in chunks; embeddings are encoded `chunk_rows` at a time
+    (across `workers` processes when > 1) straight into a preallocated memmapped
+    .npy, with a checkpoint after every chunk so an interrupted build resumes
+    where it stopped (resume=True) instead of starting over.
     Saves:
       - descriptions.npy  (float32 embeddings, shape (N, D))
-      - meta.npy          (object array of (code, system, description))
+      - meta_*.npy        (columnar (code, system, description) rows, see meta_store)
     Returns: (num_icd, num_cpt)
     """
     os.makedirs(out_dir, exist_ok=True)
 
-    icd_df = load_codes_from_csv(icd_csv, "ICD-10")
-    cpt_df = load_codes_from_csv(cpt_csv, "CPT")
-    all_df = pd.concat([icd_df, cpt_df], ignore_index=True)
+    # Pass 1: stream both CSVs into compact meta rows (no text list, no full frames)
+    rows: List[Tuple[str, str, str]] = []
+    counts = {"ICD-10": 0, "CPT": 0}
+    fp = hashlib.sha1()
+    for path, system in ((icd_csv, "ICD-10"), (cpt_csv, "CPT")):
+        for df in iter_codes_from_csv(path, system):
+            for code, desc in zip(df["code"].tolist(), df["description"].tolist()):
+                rows.append((code, system, desc))
+                fp.update(f"{code}\t{system}\t{desc}\n".encode("utf-8"))
+            counts[system] += len(df)
+    n = len(rows)
+    fingerprint = fp.hexdigest()
 
-    # Embed
-    embs = embed_texts(all_df["text"].tolist())  # (N,D) float32, normalized
-    np.save(embeddings_path, embs)
+    # Pass 2: encode chunks into a preallocated memmap, checkpointing progress
+    partial_path = embeddings_path + ".partial"
+    ckpt_path = embeddings_path + ".ckpt.json"
+    dim = embedding_dim()
+    done = 0
+    embs = None
+    if resume and os.path.exists(ckpt_path) and os.path.exists(partial_path):
+        try:
+            with open(ckpt_path) as f:
+                ckpt = json.load(f)
+            if ckpt.get("fingerprint") == fingerprint and ckpt.get("count") == n and ckpt.get("dim") == dim:
+                embs = np.lib.format.open_memmap(partial_path, mode="r+")
+                done = int(ckpt.get("done", 0))
+                print(f"resuming embedding build at row {done}/{n}")
+        except Exception:
+            embs, done = None, 0
+    if embs is None:
+        embs = np.lib.format.open_memmap(partial_path, mode="w+", dtype=np.float32, shape=(n, dim))
+
+    pool = start_encode_pool(workers) if workers > 1 else None
+    t0 = time.perf_counter()
+    start_row = done
+    try:
+        while done < n:
+            end = min(n, done + chunk_rows)
+            texts = [f"{code} {desc}" for code, _, desc in rows[done:end]]
+            embs[done:end] = embed_texts(texts, pool=pool)
+            embs.flush()
+            done = end
+            _write_json_atomic(ckpt_path, {"fingerprint": fingerprint, "count": n, "dim": dim, "done": done})
+            elapsed = max(time.perf_counter() - t0, 1e-9)
+            print(f"embedded {done}/{n} rows | {(done - start_row) / elapsed:.1f} rows/s | peak RSS {_peak_rss_mb():.0f} MB")
+    finally:
+        stop_encode_pool(pool)
+    del embs
+    os.replace(partial_path, embeddings_path)
+    if os.path.exists(ckpt_path):
+        os.remove(ckpt_path)
 
     # Meta aligned to embeddings row order
-    meta = np.array(
-        list(zip(all_df["code"].tolist(), all_df["system"].tolist(), all_df["description"].tolist())),
-        dtype=object
-    )
-    np.save(meta_path, meta)
+    MetaStore.from_rows(rows).save(meta_path)
 
     # Drop a tiny manifest for sanity
+    elapsed = max(time.perf_counter() - t0, 1e-9)
     with open(os.path.join(out_dir, "manifest.json"), "w") as f:
-        json.dump({"count": int(len(all_df)), "dim": int(embs.shape[1])}, f)
+        json.dump({"count": n, "dim": dim, "rows_per_sec": round((n - start_row) / elapsed, 1),
+                   "peak_rss_mb": round(_peak_rss_mb(), 1)}, f)
+
+    return counts["ICD-10"], counts["CPT"]
+
+def _desc_hash(desc: str) -> str:
+    return hashlib.sha1(str(desc).encode("utf-8")).hexdigest()
+
+
+def diff_codes(meta: List[Tuple[str, str, str]], new_df: pd.DataFrame) -> Tuple[List[int], List[Tuple[int, int]], List[int]]:
+    """
+    Diff a freshly loaded code frame against existing meta rows by
+    (code, system, description hash). Meta row position == FAISS id.
+    Returns:
+      added    -> new_df row positions not present in meta
+      changed  -> (new_df row position, existing id) whose description changed
+      deleted  -> existing ids no longer present in new_df
+    """
+    existing: Dict[Tuple[str, str], Tuple[int, str]] = {}
+    for i, (code, system, desc) in enumerate(meta):
+        if (code, system, desc) == TOMBSTONE:
+            continue
+        existing[(str(code), str(system))] = (i, _desc_hash(desc))
+
+    added: List[int] = []
+    changed: List[Tuple[int, int]] = []
+    seen = set()
+    for pos, (code, system, desc) in enumerate(zip(new_df["code"], new_df["system"], new_df["description"])):
+        key = (str(code), str(system))
+        seen.add(key)
+        if key not in existing:
+            added.append(pos)
+        elif existing[key][1] != _desc_hash(desc):
+            changed.append((pos, existing[key][0]))
+    deleted = [i for key, (i, _) in existing.items() if key not in seen]
+    return added, changed, deleted
+
+
+def update_embeddings_incremental(
+    icd_csv: str,
+    cpt_csv: str,
+    out_dir: str = "data",
+    embeddings_path: str = "data/descriptions.npy",
+    meta_path: str = "data/meta.npy",
+) -> Dict[str, object]:
+    """
+    Incrementally update embeddings + meta from new CSVs, embedding only added or
+    changed rows. Ids stay stable: changed rows are overwritten in place, added rows
+    are appended and deleted rows become TOMBSTONE (zero vector) so existing FAISS
+    ids never shift.
+    Returns: {icd, cpt, upsert_ids, delete_ids, live_ids, added, changed, deleted}
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    icd_df = load_codes_from_csv(icd_csv, "ICD-10")
+    cpt_df = load_codes_from_csv(cpt_csv, "CPT")
+    all_df = pd.concat([icd_df, cpt_df], ignore_index=True)
+
+    meta = list(load_meta(meta_path, mmap=False))
+    embs = np.load(embeddings_path)
+    if len(meta) != len(embs):
+        raise ValueError(f"meta ({len(meta)}) and embeddings ({len(embs)}) are out of sync; run a full build")
+
+    added, changed, deleted = diff_codes(meta, all_df)
+
+    # Embed only what is new or changed
+    todo = added + [pos for pos, _ in changed]
+    new_vecs = embed_texts(all_df["text"].iloc[todo].tolist()) if todo else np.zeros((0, embs.shape[1]), dtype=np.float32)
+
+    n_old = len(meta)
+    add_ids = list(range(n_old, n_old + len(added)))
+    chg_ids = [i for _, i in changed]
+    if added:
+        embs = np.concatenate([embs, new_vecs[: len(added)]], axis=0)
+        for pos in added:
+            meta.append((all_df["code"].iat[pos], all_df["system"].iat[pos], all_df["description"].iat[pos]))
+    for r, (pos, i) in enumerate(changed):
+        embs[i] = new_vecs[len(added) + r]
+        meta[i] = (all_df["code"].iat[pos], all_df["system"].iat[pos], all_df["description"].iat[pos])
+    for i in deleted:
+        embs[i] = 0.0
+        meta[i] = TOMBSTONE
+
+    np.save(embeddings_path, embs)
+    MetaStore.from_rows(meta).save(meta_path)
 
-    return len(icd_df), len(cpt_df)
+    live_ids = [i for i, row in enumerate(meta) if tuple(row) != TOMBSTONE]
+    return {
+        "icd": len(icd_df),
+        "cpt": len(cpt_df),
+        "upsert_ids": add_ids + chg_ids,
+        "delete_ids": chg_ids + deleted,
+        "live_ids": live_ids,
+        "added": len(added),
+        "changed": len(changed),
+        "deleted": len(deleted),
+    }
@@ -0,0 +1,18 @@
+# app/config.py
+import os
+
+
+def env_float(name: str, default: float) -> float:
+    """Float setting from the environment; `default` when unset or not a number."""
+    try:
+        return float(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+
+def env_int(name: str, default: int) -> int:
+    """Integer setting from the environment; `default` when unset or not an integer."""
+    try:
+        return int(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
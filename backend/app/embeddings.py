@@ -1,26 +1,70 @@
 # app/embeddings.py
+import os
 import numpy as np
-from typing import List, Iterable, Optional
-from sentence_transformers import SentenceTransformer
+from typing import Iterable, Optional, Any
+from .metrics import timed
 
 # Lazy, shared model
-_model: Optional[SentenceTransformer] = None
+_model: Optional[Any] = None
 
-def get_encoder(model_name: str = "all-mpnet-base-v2") -> SentenceTransformer:
-    """Returns a cached sentence-transformers encoder."""
+def _use_onnx() -> bool:
+    return os.environ.get("EMBED_BACKEND", "torch").lower() == "onnx"
+
+def get_encoder(model_name: str = "all-mpnet-base-v2") -> Any:
+    """Returns a cached encoder: sentence-transformers (default) or, with
+    EMBED_BACKEND=onnx, the int8 ONNX Runtime export in ONNX_MODEL_DIR."""
     global _model
     if _model is None:
-        _model = SentenceTransformer(model_name)
+        if _use_onnx():
+            from .onnx_encoder import OnnxEncoder
+            _model = OnnxEncoder(
+                os.environ.get("ONNX_MODEL_DIR", os.path.join("data", "encoder-onnx")),
+                intra_op_threads=int(os.environ.get("ONNX_INTRA_OP_THREADS", "0")),
+            )
+        else:
+            # torch/sentence-transformers are imported here, not at app import time
+            from sentence_transformers import SentenceTransformer
+            _model = SentenceTransformer(model_name)
     return _model
 
-def embed_texts(texts: Iterable[str], batch_size: int = 256, normalize: bool = True) -> np.ndarray:
+def embedding_dim() -> int:
+    """Output dimension of the shared encoder."""
+    return int(get_encoder().get_sentence_embedding_dimension())
+
+def start_encode_pool(workers: int) -> Any:
+    """Start a multi-process encode pool (one CPU worker process per slot).
+    Pass the result as `pool=` to embed_texts and release it with stop_encode_pool.
+    The ONNX backend threads internally, so it gets no pool (None)."""
+    if _use_onnx():
+        return None
+    return get_encoder().start_multi_process_pool(target_devices=["cpu"] * max(1, int(workers)))
+
+def stop_encode_pool(pool: Any) -> None:
+    if pool is not None:
+        from sentence_transformers import SentenceTransformer
+        SentenceTransformer.stop_multi_process_pool(pool)
+
+def embed_texts(texts: Iterable[str], batch_size: int = 256, normalize: bool = True, pool: Any = None) -> np.ndarray:
     """
     Encode an iterable of texts to a float32 numpy array (N, D).
     Normalized so cosine similarity == inner product if normalize=True.
+    When `pool` (from start_encode_pool) is given, batches are spread across its processes.
     """
     print('loading the model')
     model = get_encoder()
     print('\nEncoding..')
+    with timed("encode"):
+        return _encode(model, texts, batch_size, normalize, pool)
+
+def _encode(model: Any, texts: Iterable[str], batch_size: int, normalize: bool, pool: Any) -> np.ndarray:
+    if pool is not None:
+        vecs = model.encode_multi_process(
+            list(texts),
+            pool,
+            batch_size=batch_size,
+            normalize_embeddings=normalize
+        )
+        return np.asarray(vecs, dtype=np.float32)
     vecs = model.encode(
         list(texts),
         batch_size=batch_size,
@@ -0,0 +1,113 @@
+# app/json_stream.py
+import json
+from typing import List, Dict, Any
+
+# Keys under which models sometimes nest the array ({"codes": [...]}), as in llm_refine._extract_json
+_WRAPPER_KEYS = ("items", "codes", "suggestions", "results")
+
+
+class JsonArrayStream:
+    """Incremental parser for a model's JSON array of code objects.
+
+    feed() text chunks as they stream in; each call returns the objects whose
+    closing brace arrived in that chunk. Leading/trailing prose and ``` fences are
+    skipped (only text inside brackets/braces is considered), and a truncated
+    stream still yields every object that completed before the cut.
+
+    Objects are emitted when they are elements of the top-level array, or of an
+    array inside a top-level wrapper object ({"codes": [...]}). A lone top-level
+    object with no such elements is emitted by close().
+    """
+
+    def __init__(self):
+        self._stack: List[str] = []   # open containers: "[" or "{"
+        self._in_string = False
+        self._escape = False
+        self._item: List[str] = []    # text of the array element being captured
+        self._top: List[str] = []     # text of a top-level object (wrapper or bare item)
+        self._item_open = False
+        self._top_open = False
+        self._top_object = ""
+        self._emitted = 0
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        for ch in chunk or "":
+            if self._top_open:
+                self._top.append(ch)
+            if self._item_open:
+                self._item.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if not self._stack:
+                # Outside any container: prose, fences and whitespace are ignored
+                if ch in "[{":
+                    self._open(ch)
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                self._open(ch)
+            elif ch in "]}":
+                self._close(ch, out)
+        return out
+
+    def close(self) -> List[Dict[str, Any]]:
+        """Call at end of stream: a bare top-level object (no array elements) counts as one item."""
+        if self._emitted or not self._top_object:
+            return []
+        obj = self._loads(self._top_object)
+        self._top_object = ""
+        if obj is None or any(isinstance(obj.get(k), list) for k in _WRAPPER_KEYS):
+            # Unparseable, or a wrapper whose list held no complete objects
+            return []
+        self._emitted += 1
+        return [obj]
+
+    def _open(self, ch: str) -> None:
+        if ch == "{":
+            if not self._stack:
+                self._top_open, self._top = True, ["{"]
+            elif self._is_item_parent() and not self._item_open:
+                self._item_open, self._item = True, ["{"]
+        self._stack.append(ch)
+
+    def _close(self, ch: str, out: List[Dict[str, Any]]) -> None:
+        want = "[" if ch == "]" else "{"
+        # Tolerate mismatched brackets by unwinding to the matching opener
+        while self._stack and self._stack[-1] != want:
+            self._stack.pop()
+        if not self._stack:
+            return
+        self._stack.pop()
+        if ch != "}":
+            return
+        if not self._stack and self._top_open:
+            self._top_open = False
+            self._top_object = "".join(self._top)
+            self._top = []
+        elif self._item_open and self._is_item_parent():
+            self._item_open = False
+            obj = self._loads("".join(self._item))
+            self._item = []
+            if obj is not None:
+                self._emitted += 1
+                out.append(obj)
+
+    def _is_item_parent(self) -> bool:
+        # Elements of [ ... ] or of { "key": [ ... ] } at the top level
+        return self._stack == ["["] or self._stack == ["{", "["]
+
+    @staticmethod
+    def _loads(text: str):
+        try:
+            obj = json.loads(text)
+        except Exception:
+            return None
+        return obj if isinstance(obj, dict) else None
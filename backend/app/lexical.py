@@ -0,0 +1,170 @@
+# app/lexical.py
+import os
+import re
+import threading
+import numpy as np
+from typing import List, Dict, Tuple, Optional
+from .meta_store import load_meta
+
+# BM25 parameters (standard Okapi defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Array files written next to the FAISS index; postings for term t live in
+# docs[offsets[t]:offsets[t+1]] / tfs[offsets[t]:offsets[t+1]]
+_FILES = ("bm25_terms.npy", "bm25_offsets.npy", "bm25_docs.npy", "bm25_tfs.npy", "bm25_doclen.npy")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Lazy, shared indexes keyed by directory; reloaded when the files change (see get_bm25_index)
+_indexes: Dict[str, "Bm25Index"] = {}
+_load_lock = threading.Lock()
+_failed_stamps: Dict[str, Tuple[int, ...]] = {}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased alphanumeric tokens. No stop-word removal: terms such as
+    'without', 'left' or 'right' are exactly what dense retrieval misses."""
+    return _TOKEN_RE.findall(str(text or "").lower())
+
+
+def build_bm25_index(meta_path: str, out_dir: str) -> Tuple[int, int]:
+    """
+    Build an array-backed inverted index over "code description" for every meta row.
+    Doc ids are meta row positions (same id space as FAISS); tombstoned rows get no postings.
+    Saves bm25_{terms,offsets,docs,tfs,doclen}.npy into out_dir.
+    Returns: (num_docs, num_terms)
+    """
+    meta = load_meta(meta_path)
+    n = len(meta)
+    vocab: Dict[str, int] = {}
+    term_ids: List[np.ndarray] = []
+    doc_ids: List[np.ndarray] = []
+    doclen = np.zeros(n, dtype=np.float32)
+    for i, (code, _system, desc) in enumerate(meta):
+        if not code:
+            continue
+        toks = tokenize(f"{code} {desc}")
+        doclen[i] = len(toks)
+        ids = np.fromiter((vocab.setdefault(t, len(vocab)) for t in toks), dtype=np.int32, count=len(toks))
+        term_ids.append(ids)
+        doc_ids.append(np.full(len(ids), i, dtype=np.int32))
+
+    t_all = np.concatenate(term_ids) if term_ids else np.zeros(0, dtype=np.int32)
+    d_all = np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int32)
+    # Collapse (term, doc) pairs into term frequencies, grouped by term then doc
+    pairs = t_all.astype(np.int64) * n + d_all
+    uniq, tfs = np.unique(pairs, return_counts=True)
+    p_terms = (uniq // n).astype(np.int32)
+    p_docs = (uniq % n).astype(np.int32)
+
+    # Re-number terms alphabetically so the terms array is sorted (binary-searchable)
+    terms = np.array(sorted(vocab, key=vocab.get), dtype=str)
+    order = np.argsort(terms)
+    remap = np.empty(len(terms), dtype=np.int32)
+    remap[order] = np.arange(len(terms), dtype=np.int32)
+    p_terms = remap[p_terms]
+    srt = np.lexsort((p_docs, p_terms))
+    p_terms, p_docs, tfs = p_terms[srt], p_docs[srt], tfs[srt]
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(p_terms, minlength=len(terms)), out=offsets[1:])
+
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = (terms[order], offsets, p_docs, tfs.astype(np.uint16), doclen)
+    # Write everything to temp files first, then swap them in: running processes keep
+    # reading the old (memmapped) files until they reload on the new stamp
+    tmps = []
+    for name, arr in zip(_FILES, arrays):
+        tmp = os.path.join(out_dir, name + ".tmp.npy")
+        np.save(tmp, arr)
+        tmps.append((tmp, os.path.join(out_dir, name)))
+    for tmp, path in tmps:
+        os.replace(tmp, path)
+    return n, len(terms)
+
+
+def bm25_stamp(index_dir: str) -> Tuple[int, ...]:
+    """mtimes (ns) of the BM25 files (0 for a missing one); changes on every rebuild."""
+    def _mtime(p: str) -> int:
+        try:
+            return os.stat(p).st_mtime_ns
+        except OSError:
+            return 0
+    return tuple(_mtime(os.path.join(index_dir, f)) for f in _FILES)
+
+
+class Bm25Index:
+    def __init__(self, index_dir: str):
+        paths = [os.path.join(index_dir, f) for f in _FILES]
+        for p in paths:
+            if not os.path.exists(p):
+                raise FileNotFoundError(f"BM25 file not found: {p}")
+        terms, self.offsets, self.docs, self.tfs, self.doclen = (
+            np.load(p, mmap_mode=None if p.endswith("bm25_terms.npy") else "r") for p in paths
+        )
+        if not (len(self.offsets) == len(terms) + 1 and int(self.offsets[-1]) == len(self.docs) == len(self.tfs)):
+            # Caught between two files of a rebuild being swapped in; retried on the next stamp
+            raise ValueError(f"BM25 files in {index_dir} are inconsistent")
+        self.terms = {t: i for i, t in enumerate(terms.tolist())}
+        self.stamp: Tuple[int, ...] = ()
+        live = self.doclen > 0
+        self.n_docs = int(live.sum())
+        self.avgdl = float(self.doclen[live].mean()) if self.n_docs else 1.0
+        df = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # Per-doc BM25 length normalisation, precomputed once
+        self._norm = (BM25_K1 * (1.0 - BM25_B + BM25_B * np.asarray(self.doclen) / self.avgdl)).astype(np.float32)
+
+    def search(self, query: str, top_k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (doc_ids, scores) sorted by descending BM25 score (at most top_k)."""
+        tids = sorted({self.terms[t] for t in tokenize(query) if t in self.terms})
+        if not tids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        docs_parts, score_parts = [], []
+        for t in tids:
+            lo, hi = int(self.offsets[t]), int(self.offsets[t + 1])
+            d = np.asarray(self.docs[lo:hi])
+            tf = np.asarray(self.tfs[lo:hi], dtype=np.float32)
+            docs_parts.append(d)
+            score_parts.append(self.idf[t] * tf * (BM25_K1 + 1.0) / (tf + self._norm[d]))
+        docs = np.concatenate(docs_parts)
+        scores = np.concatenate(score_parts)
+        # Sum per doc over matched terms
+        uniq, inv = np.unique(docs, return_inverse=True)
+        totals = np.zeros(len(uniq), dtype=np.float32)
+        np.add.at(totals, inv, scores)
+        k = min(top_k, len(uniq))
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top])]
+        return uniq[top].astype(np.int64), totals[top]
+
+
+def get_bm25_index(index_dir: str = "data") -> Optional[Bm25Index]:
+    """Returns a cached BM25 index, or None when its files are missing/unreadable.
+    Reloaded when the files change on disk (a rebuild), like retrieval.get_index: the term
+    map of the old build must never be applied to new postings. While one request
+    reloads, others keep using the loaded index; a failed reload is not retried until the
+    files change again."""
+    idx = _indexes.get(index_dir)
+    stamp = bm25_stamp(index_dir)
+    if idx is not None and (stamp == idx.stamp or stamp == _failed_stamps.get(index_dir)):
+        return idx
+    if idx is not None and not _load_lock.acquire(blocking=False):
+        return idx  # another request is reloading
+    if idx is None:
+        _load_lock.acquire()
+    try:
+        idx = _indexes.get(index_dir)
+        if idx is not None and idx.stamp == stamp:
+            return idx
+        try:
+            new = Bm25Index(index_dir)
+        except Exception:
+            _failed_stamps[index_dir] = stamp
+            return idx
+        new.stamp = stamp
+        _indexes[index_dir] = new
+        _failed_stamps.pop(index_dir, None)
+        return new
+    finally:
+        _load_lock.release()
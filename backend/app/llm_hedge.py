@@ -0,0 +1,140 @@
+# app/llm_hedge.py
+import os
+import time
+import queue
+import threading
+import contextvars
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Any
+
+_DONE = object()
+
+
+class LatencyWindow:
+    """Rolling window of recent LLM latencies (seconds) for percentile-based hedging."""
+
+    def __init__(self, maxlen: int = 200):
+        self._values = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            vals = sorted(self._values)
+        if not vals:
+            return None
+        i = min(len(vals) - 1, max(0, int(round(p / 100.0 * (len(vals) - 1)))))
+        return vals[i]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+# Time to first streamed item, across all calls in this process
+FIRST_ITEM = LatencyWindow()
+
+
+def hedge_delay() -> Optional[float]:
+    """Seconds to wait for the first item before sending a hedged duplicate request:
+    the LLM_HEDGE_PERCENTILE (default p95) of recent first-item latencies once
+    LLM_HEDGE_MIN_SAMPLES have been seen, else LLM_HEDGE_DEFAULT_MS. None = hedging off."""
+    if os.environ.get("LLM_HEDGE", "1").lower() in ("0", "false", "no"):
+        return None
+    try:
+        pct = float(os.environ.get("LLM_HEDGE_PERCENTILE", "95"))
+        min_samples = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+        default_s = float(os.environ.get("LLM_HEDGE_DEFAULT_MS", "3000")) / 1000.0
+    except ValueError:
+        pct, min_samples, default_s = 95.0, 20, 3.0
+    if len(FIRST_ITEM) >= min_samples:
+        return FIRST_ITEM.percentile(pct)
+    return default_s
+
+
+def deadline_from_env(var: str = "SUGGEST_DEADLINE_MS", default_ms: str = "12000") -> Optional[float]:
+    """Absolute time.perf_counter() deadline for a request; None when the budget is 0/off."""
+    try:
+        ms = float(os.environ.get(var, default_ms))
+    except ValueError:
+        ms = float(default_ms)
+    return time.perf_counter() + ms / 1000.0 if ms > 0 else None
+
+
+def race(attempts: List[Callable[[], Iterator[Dict[str, Any]]]], deadline: Optional[float] = None,
+         hedge_after: Optional[float] = None, state: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """Yield items from the first attempt that produces one.
+
+    attempts[0] starts immediately. The next attempt starts when `hedge_after` seconds
+    pass with no item yet (a hedged request), or as soon as the running attempts all
+    finished without items (a retry). The first attempt to yield an item wins; the
+    others are abandoned. Iteration stops at `deadline` (perf_counter time);
+    state["timed_out"] / state["hedged"] / state["winner"] describe what happened.
+    """
+    state = state if state is not None else {}
+    state.update({"timed_out": False, "hedged": False, "winner": None, "attempts": 0})
+    q: "queue.Queue" = queue.Queue()
+    cancelled = threading.Event()  # a winner exists: losers stop reading
+    stop = threading.Event()       # the consumer is gone: everyone stops
+    started: List[float] = []
+    running = set()
+    winner: Optional[int] = None
+
+    def _run(aid: int, factory: Callable[[], Iterator[Dict[str, Any]]]) -> None:
+        try:
+            for it in factory():
+                if stop.is_set() or (cancelled.is_set() and winner != aid):
+                    break
+                q.put((aid, it))
+        except Exception:
+            pass
+        finally:
+            q.put((aid, _DONE))
+
+    def _start(aid: int) -> None:
+        started.append(time.perf_counter())
+        state["attempts"] = len(started)
+        running.add(aid)
+        # Copy the context so the attempt's spans/sizes land on this request's trace
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(_run, aid, attempts[aid]), daemon=True).start()
+
+    _start(0)
+    try:
+        while True:
+            now = time.perf_counter()
+            wake = deadline
+            if winner is None and hedge_after is not None and len(started) < len(attempts):
+                hedge_at = started[-1] + hedge_after
+                wake = hedge_at if wake is None else min(wake, hedge_at)
+            try:
+                aid, it = q.get(timeout=None if wake is None else max(0.0, wake - now))
+            except queue.Empty:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    state["timed_out"] = True
+                    cancelled.set()
+                    return
+                state["hedged"] = True
+                _start(len(started))
+                continue
+            if it is _DONE:
+                running.discard(aid)
+                if winner == aid:
+                    return
+                if winner is None and not running:
+                    if len(started) < len(attempts):
+                        _start(len(started))  # everything so far came back empty: retry now
+                        continue
+                    return
+                continue
+            if winner is None:
+                winner = aid
+                state["winner"] = aid
+                FIRST_ITEM.add(time.perf_counter() - started[aid])
+                cancelled.set()
+            if aid == winner:
+                yield it
+    finally:
+        stop.set()
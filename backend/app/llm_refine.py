@@ -1,15 +1,37 @@
 import os
 import json
-from typing import List, Dict, Any, Optional
-
-try:
-    # Use the official google-genai import style
-    from google import genai  # type: ignore
-except Exception:
-    genai = None  # type: ignore
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterator, Callable
+from .metrics import timed, observe_stage, FALLBACKS, JSON_RETRIES, PROMPT_TOKENS, HEDGES, LLM_CODES
+from .json_stream import JsonArrayStream
+from .prompt_builder import build_prompt
+from .chunking import llm_chunks
+from .config import env_int
+from .llm_hedge import race, hedge_delay
+from .tracing import add_size, annotate
+
+# google-genai is imported on first call (keeps app startup fast); False = not importable
+_genai = None
+
+
+def _get_genai():
+    global _genai
+    if _genai is None:
+        try:
+            # Use the official google-genai import style
+            from google import genai  # type: ignore
+            _genai = genai
+        except Exception:
+            _genai = False
+    return _genai or None
 
 GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash-exp")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+# Optional endpoint override, e.g. the local stub used by benchmarks/loadtest.py
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "")
 
 
 def _dbg(msg: str) -> None:
@@ -62,10 +84,10 @@ GUIDANCE:
 ClinicalText:
 {clinical_text}
 
-Entities:
+Entities (deduplicated, most relevant first):
 {entities}
 
-Candidates:
+Candidates (one per line: code | system | description; best retrieval match first):
 {candidates}
 
 Return up to {limit} items.
@@ -97,7 +119,7 @@ OUTPUT FORMAT (VERY IMPORTANT):
 ClinicalText:
 {clinical_text}
 
-Entities (optional):
+Entities (optional; deduplicated, most relevant first):
 {entities}
 
 Return JSON array ONLY.
@@ -113,6 +135,7 @@ def _fallback_refine(
     """Extremely simple fallback: if Gemini is not available or parsing fails,
     just return the top_k candidates as-is with a generic reason. No clinical logic.
     """
+    FALLBACKS.inc("refine")
     out: List[Dict[str, Any]] = []
     for c in candidates[:top_k]:
         out.append(
@@ -127,6 +150,45 @@ def _fallback_refine(
     return out
 
 
+def _validate_codes(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Check LLM-returned codes against the code catalogue (data/meta.npy).
+
+    CODE_VALIDATION=canonicalize (default): known codes get the catalogue's code,
+    system and description; unknown codes are kept as returned.
+    CODE_VALIDATION=strict: unknown codes are dropped. CODE_VALIDATION=off: no-op.
+    Duplicates that collapse to the same canonical code are removed.
+    """
+    mode = os.environ.get("CODE_VALIDATION", "canonicalize").lower()
+    if mode == "off" or not items:
+        return items
+    try:
+        from .code_catalog import get_catalog
+        catalog = get_catalog()
+    except Exception:
+        catalog = None
+    if catalog is None:
+        return items
+    out: List[Dict[str, Any]] = []
+    seen = set()
+    for it in items:
+        hit = catalog.canonicalize(it)
+        if hit is None:
+            if mode == "strict":
+                LLM_CODES.inc("dropped")
+                _dbg(f"validate: dropped unknown code {it.get('code')!r}")
+                continue
+            LLM_CODES.inc("unknown")
+            hit = it
+        else:
+            LLM_CODES.inc("valid")
+        key = (hit.get("code"), hit.get("system"))
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append(hit)
+    return out
+
+
 def _extract_json(text: str) -> Optional[List[Dict[str, Any]]]:
     if not text:
         return None
@@ -141,6 +203,8 @@ def _extract_json(text: str) -> Optional[List[Dict[str, Any]]]:
             return [loaded]
     except Exception:
         pass
+    # Whole-string parse failed; the slicing attempts below count as retries
+    JSON_RETRIES.inc("extract")
     t = text.strip()
     if t.startswith("```"):
         t = t.strip("`").strip()
@@ -165,10 +229,17 @@ def _extract_json(text: str) -> Optional[List[Dict[str, Any]]]:
     return None
 
 
+def _client(genai):
+    if GEMINI_BASE_URL:
+        return genai.Client(api_key=GEMINI_API_KEY, http_options={"base_url": GEMINI_BASE_URL})
+    return genai.Client(api_key=GEMINI_API_KEY)
+
+
 def _call_gemini(prompt: str) -> Optional[str]:
     """Call Gemini using google-genai.
     Uses a single env var GEMINI_API_KEY; we pass it explicitly to the client.
     """
+    genai = _get_genai()
     if genai is None:
         _dbg("google.genai not importable; is google-genai installed in this env?")
         return None
@@ -176,9 +247,12 @@ def _call_gemini(prompt: str) -> Optional[str]:
         _dbg("GEMINI_API_KEY missing in environment")
         return None
     try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
+        add_size("llm_calls", 1)
+        add_size("prompt_chars", len(prompt))
+        client = _client(genai)
         _dbg(f"call: model={GEMINI_MODEL} prompt_chars={len(prompt)} (models.generate_content)")
-        resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
+        with timed("llm_call"):
+            resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
         if getattr(resp, "text", None):
             txt = resp.text
             _dbg(f"call: got text len={len(txt)} head={txt[:120]!r}")
@@ -189,51 +263,157 @@ def _call_gemini(prompt: str) -> Optional[str]:
         return None
 
 
+def _stream_enabled() -> bool:
+    return os.environ.get("LLM_STREAM", "1").lower() not in ("0", "false", "no")
+
+
+def _stream_gemini(prompt: str) -> Iterator[str]:
+    """Text chunks from models.generate_content_stream. Stops quietly on errors, so a
+    stream cut off mid-way still delivers what arrived before the cut."""
+    genai = _get_genai()
+    if genai is None:
+        _dbg("google.genai not importable; is google-genai installed in this env?")
+        return
+    if not GEMINI_API_KEY:
+        _dbg("GEMINI_API_KEY missing in environment")
+        return
+    try:
+        add_size("llm_calls", 1)
+        add_size("prompt_chars", len(prompt))
+        client = _client(genai)
+        _dbg(f"stream: model={GEMINI_MODEL} prompt_chars={len(prompt)} (models.generate_content_stream)")
+        with timed("llm_call"):
+            for chunk in client.models.generate_content_stream(model=GEMINI_MODEL, contents=prompt):
+                txt = getattr(chunk, "text", None)
+                if txt:
+                    yield txt
+    except Exception as e:
+        _dbg(f"stream: exception: {e}")
+
+
+def _llm_items(prompt: str) -> Iterator[Dict[str, Any]]:
+    """Code objects from the model, each yielded as soon as its closing brace arrives
+    (LLM_STREAM=0 falls back to one blocking call + _extract_json)."""
+    if not _stream_enabled():
+        text = _call_gemini(prompt)
+        for it in (_extract_json(text) or []) if text else []:
+            if isinstance(it, dict):
+                yield it
+        return
+    parser = JsonArrayStream()
+    chunks: List[str] = []
+    n = 0
+    t0 = time.perf_counter()
+    for chunk in _stream_gemini(prompt):
+        chunks.append(chunk)
+        for it in parser.feed(chunk):
+            if n == 0:
+                observe_stage("llm_first_item", t0, time.perf_counter() - t0)
+            n += 1
+            yield it
+    for it in parser.close():
+        n += 1
+        yield it
+    if n == 0 and chunks:
+        # Nothing parsed incrementally; salvage whatever the whole-text parser finds
+        _dbg(f"stream: no items from {sum(len(c) for c in chunks)} chars, trying _extract_json")
+        for it in _extract_json("".join(chunks)) or []:
+            if isinstance(it, dict):
+                yield it
+
+
+def _normalize_item(it: Dict[str, Any], default_score: float = 0.0) -> Dict[str, Any]:
+    raw_score = it.get("score", None)
+    return {
+        "code": str(it.get("code", "")),
+        "system": "CPT" if str(it.get("system", "")).upper().startswith("CPT") else "ICD-10",
+        "description": str(it.get("description", "")),
+        "score": max(0.0, min(1.0, float(raw_score))) if isinstance(raw_score, (int, float)) else default_score,
+        "reason": str(it.get("reason", "")),
+    }
+
+
+def _collect(items: Iterator[Dict[str, Any]], limit: int,
+             on_item: Optional[Callable[[Dict[str, Any]], None]] = None,
+             default_score: Callable[[int], float] = lambda i: 0.0) -> List[Dict[str, Any]]:
+    """Normalize and validate streamed items one by one, calling on_item for each kept
+    item; stops reading (closing the stream) once `limit` items are kept."""
+    out: List[Dict[str, Any]] = []
+    seen = set()
+    for idx, it in enumerate(items):
+        for v in _validate_codes([_normalize_item(it, default_score(idx))]):
+            key = (v["code"], v["system"])
+            if key in seen:
+                continue
+            seen.add(key)
+            out.append(v)
+            if on_item is not None:
+                on_item(v)
+        if len(out) >= limit:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+            break
+    return out
+
+
+def _build_prompt(call: str, template: str, clinical_text: str, entities: List[Dict[str, Any]],
+                  candidates: Optional[List[Dict[str, Any]]] = None, limit: int = 5) -> str:
+    """Token-budgeted prompt (PROMPT_TOKEN_BUDGET); the count goes to metrics and the request trace."""
+    prompt, stats = build_prompt(template, str(clinical_text or ""), entities or [], candidates, limit=limit)
+    PROMPT_TOKENS.inc(call, stats["prompt_tokens"])
+    add_size("prompt_tokens", stats["prompt_tokens"])
+    _dbg(f"{call}: prompt {stats}")
+    return prompt
+
+
+def _raced_items(call: str, prompts: List[str], deadline: Optional[float]) -> Iterator[Dict[str, Any]]:
+    """Items from prompts[0], with prompts[1] sent as a hedge when the first item is late
+    (hedge_delay) or as a retry when the first attempt returns nothing; bounded by `deadline`.
+    When the stream ends or is closed, the race outcome is counted under `call`
+    (claimpilot_llm_hedges_total{outcome="<call>:sent|won"}, JSON retries, deadline fallbacks)."""
+    state: Dict[str, Any] = {}
+    try:
+        yield from race([lambda p=p: _llm_items(p) for p in prompts], deadline=deadline,
+                        hedge_after=hedge_delay(), state=state)
+    finally:
+        if state.get("attempts", 0) > 1:
+            if state.get("hedged"):
+                HEDGES.inc(f"{call}:sent")
+                if state.get("winner") == 1:
+                    HEDGES.inc(f"{call}:won")
+            else:
+                JSON_RETRIES.inc(call)
+        if state.get("timed_out"):
+            FALLBACKS.inc("deadline")
+            annotate(degraded=True)
+        _dbg(f"{call}: race {state}")
+
+
 def refine(
     entities: List[Dict[str, Any]],
     candidates: List[Dict[str, Any]],
     clinical_text: str = "",
     top_k: int = 5,
+    on_item: Optional[Callable[[Dict[str, Any]], None]] = None,
+    deadline: Optional[float] = None,
 ) -> List[Dict[str, Any]]:
     """Refine a list of candidate ICD-10/CPT codes using Gemini if available.
 
     Returns a list of dicts with keys: code, system, description, score, reason.
+    on_item, if given, is called with each validated code as it streams in
+    (not for fallback results). At `deadline` (time.perf_counter() value) the
+    codes received so far are returned, or the retrieval candidates via
+    _fallback_refine; either way the request trace is flagged degraded.
     """
     limit = int(max(1, top_k))
-    try:
-        prompt = PROMPT_TEMPLATE.format(
-            clinical_text=str(clinical_text or "")[:4000],
-            entities=json.dumps(entities or [], ensure_ascii=False)[:4000],
-            candidates=json.dumps(candidates[:50], ensure_ascii=False)[:6000],
-            limit=limit,
-        )
-    except Exception:
-        prompt = (
-            "You are a clinical coding assistant.\n\n"
-            "ClinicalText:\n" + str(clinical_text or "")[:4000] + "\n\n"
-            "Entities:\n" + json.dumps(entities or [], ensure_ascii=False)[:4000] + "\n\n"
-            "Candidates:\n" + json.dumps(candidates[:50], ensure_ascii=False)[:6000] + "\n\n"
-            "Return ONLY a JSON array of objects with keys: code, system, description, score, reason."
-        )
+    prompt = _build_prompt("refine", PROMPT_TEMPLATE, clinical_text, entities, candidates[:50], limit)
 
     _dbg(f"refine: top_k={top_k} ents={len(entities)} cands={len(candidates)}")
-    text: Optional[str] = _call_gemini(prompt)
-    if text:
-        parsed = _extract_json(text) or []
-        _dbg(f"refine: parsed={len(parsed)}")
-        out: List[Dict[str, Any]] = []
-        for it in parsed:
-            out.append(
-                {
-                    "code": str(it.get("code", "")),
-                    "system": "CPT" if str(it.get("system", "")).upper().startswith("CPT") else "ICD-10",
-                    "description": str(it.get("description", "")),
-                    "score": float(it.get("score", 0.0)) if isinstance(it.get("score", None), (int, float)) else 0.0,
-                    "reason": str(it.get("reason", "")),
-                }
-            )
-        if out:
-            return out[:limit]
+    out = _collect(_raced_items("refine", [prompt, prompt], deadline), limit, on_item)
+    _dbg(f"refine: parsed={len(out)}")
+    if out:
+        return out[:limit]
 
     # If Gemini unavailable or parsing failed, trivial non-clinical fallback
     return _fallback_refine(entities, candidates, clinical_text, top_k=limit)
@@ -243,57 +423,113 @@ def generate_codes_from_text(
     entities: List[Dict[str, Any]],
     clinical_text: str,
     top_k: int = 5,
+    on_item: Optional[Callable[[Dict[str, Any]], None]] = None,
+    deadline: Optional[float] = None,
 ) -> List[Dict[str, Any]]:
     """Directly generate ICD-10 and CPT codes from raw clinical text using Gemini.
 
     Returns a list of dicts with keys: code, system, description, score, reason.
     If Gemini is not available or parsing fails, returns an empty list (no hard-coded guesses).
+    on_item, if given, is called with each validated code as it streams in.
+    The stricter retry prompt doubles as the hedged request; at `deadline` whatever
+    arrived so far is returned and the request trace is flagged degraded.
+    Notes longer than one prompt's text budget are split (chunking.llm_chunks) and
+    every chunk is coded by its own call, LLM_CHUNK_WORKERS (6) at a time; the results
+    are merged, keeping each code's best score. on_item then sees the first top_k
+    distinct codes as any chunk returns them, and all of those are in the returned list.
+    A chunk whose turn comes after `deadline` is not sent; the request trace is then
+    flagged partial (and degraded), as it is when llm_chunks had to drop chunks.
     """
-    try:
-        prompt = DIRECT_PROMPT_TEMPLATE.format(
-            clinical_text=str(clinical_text or "")[:6000],
-            entities=json.dumps(entities or [], ensure_ascii=False)[:4000],
-        )
-    except Exception:
-        prompt = (
-            "You are a senior clinical coding specialist. Return ONLY a JSON array of ICD-10 and CPT codes.\n\n"
-            "ClinicalText:\n" + str(clinical_text or "")[:6000] + "\n\n"
-            "Entities:\n" + json.dumps(entities or [], ensure_ascii=False)[:4000]
-        )
+    chunks = llm_chunks(clinical_text)
+    if len(chunks) <= 1:
+        return _generate_direct("direct", entities, clinical_text, top_k, on_item, deadline)
+
+    limit = max(1, int(top_k or 5))
+    annotate(llm_chunks=len(chunks))
+    _dbg(f"direct: {len(chunks)} chunks, text_chars={len(clinical_text or '')}")
+    streamed: Dict[tuple, bool] = {}
+    lock = threading.Lock()
+
+    def _forward(it: Dict[str, Any]) -> None:
+        # Dedupe across chunks; stream at most `limit` codes
+        with lock:
+            if _code_key(it) in streamed or len(streamed) >= limit:
+                return
+            streamed[_code_key(it)] = True
+        on_item(it)
+
+    def _map(chunk: str) -> Optional[List[Dict[str, Any]]]:
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None  # no time left to code this chunk
+        low = chunk.lower()
+        ents = [e for e in entities or [] if str(e.get("text", "")).strip().lower() in low]
+        return _generate_direct("direct_chunk", ents, chunk, limit, _forward if on_item is not None else None, deadline)
+
+    # One context copy per call so each chunk's spans land on this request's trace
+    workers = max(1, min(len(chunks), env_int("LLM_CHUNK_WORKERS", 6)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, _map, c) for c in chunks]
+        with timed("direct_chunks"):
+            results = [f.result() for f in futures]
+    skipped = sum(1 for r in results if r is None)
+    if skipped:
+        FALLBACKS.inc("deadline")
+        annotate(partial=True, degraded=True, chunks_skipped=skipped)
+    merged = _merge_chunk_codes([r for r in results if r is not None])
+    # Codes already streamed stay in the answer; the best of the rest fill it up
+    out = [it for it in merged if _code_key(it) in streamed]
+    out += [it for it in merged if _code_key(it) not in streamed][:limit - len(out)]
+    out.sort(key=lambda it: float(it.get("score", 0.0)), reverse=True)
+    _dbg(f"direct: merged {sum(len(r or []) for r in results)} chunk codes -> {len(out)}, {skipped} chunks skipped")
+    if not out:
+        FALLBACKS.inc("direct_empty")
+    return out
 
-    _dbg(f"direct: top_k={top_k} ents={len(entities)} text_chars={len(clinical_text or '')}")
-    text = _call_gemini(prompt) or "[]"
-    parsed = _extract_json(text) or []
-    if not parsed:
-        # Second attempt: stricter instruction and explicit minimum count
-        min_items = max(1, min(5, int(top_k or 5)))
-        strict_prompt = (
-            prompt
-            + f"\n\nIMPORTANT: Return a JSON array ONLY with at least {min_items} items when applicable. "
-              "No comments, no code fences."
-        )
-        text2 = _call_gemini(strict_prompt) or "[]"
-        parsed = _extract_json(text2) or []
-    _dbg(f"direct: parsed={len(parsed)}")
 
-    if not parsed:
-        return []
+def _code_key(it: Dict[str, Any]) -> tuple:
+    return str(it.get("code", "")).upper(), str(it.get("system", ""))
 
-    out: List[Dict[str, Any]] = []
-    for idx, it in enumerate(parsed[: max(1, top_k)]):
-        raw_score = it.get("score", None)
-        if isinstance(raw_score, (int, float)):
-            score = max(0.0, min(1.0, float(raw_score)))
-        else:
-            # Reasonable fallback: descending scores when LLM omits them
-            score = max(0.5, 0.9 - 0.1 * idx)
-        out.append(
-            {
-                "code": str(it.get("code", "")),
-                "system": "CPT" if str(it.get("system", "")).upper().startswith("CPT") else "ICD-10",
-                "description": str(it.get("description", "")),
-                "score": score,
-                "reason": str(it.get("reason", "")),
-            }
-        )
+
+def _merge_chunk_codes(results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Dedupe per-chunk codes by (code, system), keeping the best-scored entry; a code
+    found in several chunks ranks ahead of an equally scored one found once."""
+    best: Dict[tuple, Dict[str, Any]] = {}
+    hits: Dict[tuple, int] = {}
+    for items in results:
+        for it in items:
+            key = _code_key(it)
+            hits[key] = hits.get(key, 0) + 1
+            if key not in best or float(it.get("score", 0.0)) > float(best[key].get("score", 0.0)):
+                best[key] = it
+    return sorted(best.values(), key=lambda it: (float(it.get("score", 0.0)), hits[_code_key(it)]), reverse=True)
+
+
+def _generate_direct(
+    call: str,
+    entities: List[Dict[str, Any]],
+    clinical_text: str,
+    top_k: int,
+    on_item: Optional[Callable[[Dict[str, Any]], None]],
+    deadline: Optional[float],
+) -> List[Dict[str, Any]]:
+    """One direct-generation call (hedged/retried, bounded by `deadline`) for `clinical_text`."""
+    prompt = _build_prompt(call, DIRECT_PROMPT_TEMPLATE, clinical_text, entities)
+
+    _dbg(f"{call}: top_k={top_k} ents={len(entities)} text_chars={len(clinical_text or '')}")
+    limit = max(1, int(top_k or 5))
+    # Reasonable fallback: descending scores when LLM omits them
+    default_score = lambda idx: max(0.5, 0.9 - 0.1 * idx)
+    # Second attempt: stricter instruction and explicit minimum count. It goes out when the
+    # first returns nothing usable, or earlier as a hedge when the first is slow.
+    min_items = max(1, min(5, limit))
+    strict_prompt = (
+        prompt
+        + f"\n\nIMPORTANT: Return a JSON array ONLY with at least {min_items} items when applicable. "
+          "No comments, no code fences."
+    )
+    out = _collect(_raced_items(call, [prompt, strict_prompt], deadline), limit, on_item, default_score)
+    _dbg(f"{call}: parsed={len(out)}")
+
+    if not out and call == "direct":
+        FALLBACKS.inc("direct_empty")
     return out
@@ -0,0 +1,110 @@
+# app/load_control.py
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from .config import env_float
+from .metrics import LOAD_TRANSITIONS
+
+# Service levels, best first: full pipeline, retrieval + refine on a smaller pool,
+# retrieval only (no LLM), reject with 503 + Retry-After
+MODES = ("full", "reduced", "retrieval_only", "shed")
+
+
+class LoadController:
+    """Load-adaptive degradation with hysteresis.
+
+    Pressure is the worst of these ratios, over samples from the last LOAD_WINDOW_S
+    seconds: p90 queue delay (request arrival to its first pipeline stage) over
+    LOAD_QUEUE_P90_MS, p90 LLM latency (first streamed item, or the whole call) over
+    LOAD_LLM_P90_MS, p90 ocr_page time over LOAD_OCR_P90_MS, and in-flight pipeline
+    requests over LOAD_MAX_INFLIGHT. At pressure
+    >= LOAD_HIGH the mode steps one level down, at <= LOAD_LOW one level up, and at
+    most one step per LOAD_DWELL_S. Per worker process.
+    """
+
+    def __init__(self):
+        self._samples: Dict[str, deque] = {}  # signal -> (time, ms)
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.level = 0
+        self.changed_at = time.monotonic()
+
+    @staticmethod
+    def enabled() -> bool:
+        return os.environ.get("LOAD_CONTROL", "1").lower() not in ("0", "false", "no")
+
+    def observe(self, signal: str, ms: float) -> None:
+        with self._lock:
+            self._samples.setdefault(signal, deque(maxlen=500)).append((time.monotonic(), ms))
+
+    def enter(self) -> None:
+        with self._lock:
+            self.inflight += 1
+
+    def exit(self) -> None:
+        with self._lock:
+            self.inflight = max(0, self.inflight - 1)
+
+    def _p90(self, signal: str, now: float, window: float) -> Optional[float]:
+        q = self._samples.get(signal)
+        if not q:
+            return None
+        while q and now - q[0][0] > window:
+            q.popleft()
+        vals = sorted(ms for _, ms in q)
+        return vals[int(0.9 * (len(vals) - 1))] if vals else None
+
+    def pressure(self) -> Dict[str, float]:
+        now = time.monotonic()
+        window = env_float("LOAD_WINDOW_S", 30.0)
+        targets = {
+            "queue": env_float("LOAD_QUEUE_P90_MS", 1000.0),
+            "llm": env_float("LOAD_LLM_P90_MS", 8000.0),
+            "ocr_page": env_float("LOAD_OCR_P90_MS", 5000.0),
+        }
+        out: Dict[str, float] = {}
+        with self._lock:
+            for signal, target in targets.items():
+                p90 = self._p90(signal, now, window)
+                out[signal] = round(p90 / target, 3) if p90 is not None and target > 0 else 0.0
+            max_inflight = env_float("LOAD_MAX_INFLIGHT", 32.0)
+            out["inflight"] = round(self.inflight / max_inflight, 3) if max_inflight > 0 else 0.0
+        return out
+
+    def mode(self) -> str:
+        """Current mode, after applying at most one step of the hysteresis rule."""
+        if not self.enabled():
+            return MODES[0]
+        p = max(self.pressure().values())
+        now = time.monotonic()
+        with self._lock:
+            if now - self.changed_at >= env_float("LOAD_DWELL_S", 5.0):
+                step = 0
+                if p >= env_float("LOAD_HIGH", 1.0) and self.level < len(MODES) - 1:
+                    step = 1
+                elif p <= env_float("LOAD_LOW", 0.6) and self.level > 0:
+                    step = -1
+                if step:
+                    self.level += step
+                    self.changed_at = now
+                    LOAD_TRANSITIONS.inc(MODES[self.level])
+            return MODES[self.level]
+
+    def snapshot(self) -> Dict:
+        return {
+            "enabled": self.enabled(),
+            "mode": MODES[self.level] if self.enabled() else MODES[0],
+            "pressure": self.pressure(),
+            "inflight": self.inflight,
+            "since_s": round(time.monotonic() - self.changed_at, 1),
+        }
+
+
+_controller = LoadController()
+
+
+def get_controller() -> LoadController:
+    return _controller
@@ -1,30 +1,97 @@
+import time
+_IMPORT_T0 = time.perf_counter()
 from fastapi import FastAPI, UploadFile, File, Form, Request
 from dotenv import load_dotenv
 from pathlib import Path
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from app.schemas import UploadRequest, SuggestRequest, SuggestResponse, ClaimRequest, ClaimResponse, Entity, CodeSuggestion, CMS1500Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.schemas import SuggestResponse, ClaimRequest, ClaimResponse, Entity, CodeSuggestion, CMS1500Request, CMS1500BulkRequest
 from app.ocr import extract_text_from_image_bytes, extract_text_from_pdf_bytes
 from app.ner import extract_entities
 from app.embeddings import embed_texts
-from app.retrieval import FaissIndexWrapper
+from app.retrieval import get_index, reciprocal_rank_fusion, parse_quotas, search_cache_stats
+from app.lexical import get_bm25_index
+from app.code_catalog import get_catalog
+from app.meta_store import meta_exists
+from app.chunking import embedding_windows
 from app.pdfgen import generate_claim_pdf
-from app.cms1500 import parse_header_info, split_codes, generate_cms1500_pdf
+from app.cms1500 import parse_header_info, render_cms1500
+from app.cms1500_bulk import stream_cms1500_zip, stream_cms1500_pdf, pdf_concat_available, pdf_max_forms
 from app.blockchain import compute_claim_hash, create_mock_tx
+from app.metrics import timed, render_prometheus, PIPELINE
+from app.tracing import start_trace, current_trace, annotate, server_timing_header, slow_threshold_ms, write_slow_log
 import os
 import uuid
+import hashlib
 from typing import List, Dict, Tuple, Optional
+import re
 import json
-import time
+import numpy as np
+import asyncio
+from contextlib import asynccontextmanager
 
 # Ensure we load env from backend/.env even when running uvicorn from repo root
 _ENV_PATH = Path(__file__).resolve().parents[1] / ".env"
 load_dotenv(_ENV_PATH)
 
 # Import LLM after env is loaded so keys are visible
-from app.llm_refine import refine, generate_codes_from_text
-app = FastAPI(title="ClaimPilot Coding Agent - Skeleton")
+from app.llm_refine import refine, generate_codes_from_text, _fallback_refine
+from app.llm_hedge import deadline_from_env
+from app.singleflight import SingleFlight, request_key, normalize_text
+from app.load_control import get_controller
+from app.rerank import rerank_pool
+_IMPORT_MS = (time.perf_counter() - _IMPORT_T0) * 1000.0
+
+# Startup state: /ready reports ready only once the warm-up phase has finished
+_startup: Dict = {"ready": False, "phases_ms": {"imports": round(_IMPORT_MS, 1)}, "errors": {}}
+
+
+def _warmup() -> None:
+    """Preload the heavy pieces so the first request doesn't pay for them.
+    WARMUP_COMPONENTS (comma-separated) picks from ner, catalog, encoder, index;
+    the default depends on SUGGEST_MODE (encoder/index only matter in hybrid mode)."""
+    hybrid = os.environ.get("SUGGEST_MODE", "llm").lower() != "llm"
+    default = "ner,catalog,encoder,index" if hybrid else "ner,catalog"
+    components = [c.strip().lower() for c in os.environ.get("WARMUP_COMPONENTS", default).split(",") if c.strip()]
+
+    def _timed(name: str, fn) -> None:
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            _startup["errors"][name] = f"{type(e).__name__}: {e}"
+        _startup["phases_ms"][name] = round((time.perf_counter() - t0) * 1000.0, 1)
+
+    t0 = time.perf_counter()
+    if "ner" in components:
+        _timed("ner", lambda: extract_entities("Warm-up: MRI of the right knee without contrast."))
+    if "catalog" in components:
+        _timed("catalog", get_catalog)
+    if "encoder" in components:
+        _timed("encoder", lambda: embed_texts(["warm-up"]))
+    if "index" in components:
+        _timed("index", lambda: (get_index(), get_bm25_index("data")))
+        if "encoder" in components and "index" not in _startup["errors"]:
+            # One dummy end-to-end retrieval so FAISS/BLAS code paths are hot too
+            _timed("dummy_query", lambda: get_index().search(embed_texts(["knee pain follow-up visit"]), top_k=5))
+    _startup["phases_ms"]["warmup_total"] = round((time.perf_counter() - t0) * 1000.0, 1)
+    _startup["ready"] = True
+    print(f"[backend] warm-up complete: phases_ms={_startup['phases_ms']} errors={_startup['errors'] or None}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print(f"[backend] startup: imports took {_IMPORT_MS:.0f} ms")
+    if os.environ.get("WARMUP", "1").lower() in ("0", "false", "no"):
+        _startup["ready"] = True
+    else:
+        # Run in the background so /health answers while models load
+        _startup["task"] = asyncio.create_task(asyncio.to_thread(_warmup))
+    yield
+
+
+app = FastAPI(title="ClaimPilot Coding Agent - Skeleton", lifespan=lifespan)
 
 # Debug helper (enabled when LLM_DEBUG=1/true)
 def _dbg(msg: str) -> None:
@@ -62,9 +129,117 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser devtools/frontends read per-request stage timings
+    expose_headers=["Server-Timing", "X-Request-ID", "X-Coalesced"],
 )
 
 
+# Retrieval helper: up to max_n long, distinct entity phrases (no keyword hacks)
+def _pick_entity_phrases(items: List[Dict], max_n: int = 3) -> List[str]:
+    seen = set()
+    # prefer longer, meaningful snippets
+    texts = sorted([str(e.get("text", "")) for e in items if e.get("text")], key=len, reverse=True)
+    out = []
+    for t in texts:
+        t2 = t.strip()
+        if len(t2) < 3:
+            continue
+        key = t2.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append(t2)
+        if len(out) >= max_n:
+            break
+    return out
+
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Endpoints that run the coding pipeline: watched and, under overload, shed by the load controller
+_PIPELINE_PATHS = ("/suggest", "/suggest/stream", "/upload")
+
+
+def _after_body(response, fn) -> None:
+    """Run fn once the response body has been fully sent (or the stream was abandoned).
+    Responses from call_next stream their body after the middleware returned, so
+    per-request bookkeeping placed after `await call_next(...)` would miss all work done
+    inside streaming bodies (/suggest/stream, /cms1500/bulk)."""
+    body = response.body_iterator
+
+    async def _wrapped():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            fn()
+
+    response.body_iterator = _wrapped()
+
+
+@app.middleware("http")
+async def load_shedding(request: Request, call_next):
+    """Feed the load controller (queue delay, LLM/OCR stage times, in-flight count) and
+    reject pipeline requests with 503 + Retry-After while it is in `shed` mode. A request
+    counts as in flight, and its stage times are observed, until its body has been sent."""
+    if request.method != "POST" or request.url.path not in _PIPELINE_PATHS:
+        return await call_next(request)
+    controller = get_controller()
+    load_mode = controller.mode()
+    annotate(load_mode=load_mode)
+    if load_mode == "shed":
+        retry_after = os.environ.get("LOAD_RETRY_AFTER_S", "5")
+        return JSONResponse(status_code=503, content={"detail": "Overloaded, retry later", "load_mode": load_mode},
+                            headers={"Retry-After": retry_after})
+    trace = current_trace()
+    controller.enter()
+
+    def _done() -> None:
+        controller.exit()
+        if trace is not None and trace.spans:
+            with trace._lock:
+                spans = list(trace.spans)
+            controller.observe("queue", min(start for _, start, _ in spans))
+            for stage, _, dur in spans:
+                if stage in ("llm_first_item", "llm_call"):
+                    controller.observe("llm", dur)
+                elif stage == "ocr_page":
+                    controller.observe(stage, dur)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        _done()
+        raise
+    _after_body(response, _done)
+    return response
+
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Attach a per-request trace: stage spans recorded via metrics.timed become a
+    Server-Timing header, and requests slower than SLOW_REQUEST_MS go to the slow log.
+    Headers are sent before a streaming body runs, so for streaming responses the
+    header only covers the work done up to then (/suggest/stream sends its full stage
+    timings in the final `done` event); the slow-log check runs once the body finished."""
+    rid = request.headers.get("x-request-id", "")
+    trace = start_trace(rid if _REQUEST_ID_RE.match(rid) else uuid.uuid4().hex)
+    response = await call_next(request)
+    response.headers["Server-Timing"] = server_timing_header(trace, trace.elapsed_ms())
+    response.headers["X-Request-ID"] = trace.request_id
+    if trace.mode.get("coalesced"):
+        # leader / joined / grace, so clients (and the load test) can tell shared results apart
+        response.headers["X-Coalesced"] = trace.mode["coalesced"]
+
+    def _done() -> None:
+        total_ms = trace.elapsed_ms()
+        if total_ms >= slow_threshold_ms():
+            write_slow_log(trace, request.method, request.url.path, response.status_code, total_ms)
+
+    _after_body(response, _done)
+    return response
+
+
 @app.post("/upload")
 async def upload(
     request: Request,
@@ -74,13 +249,12 @@ async def upload(
     auto_suggest: bool = Form(False),
 ):
     """Accept a file (PDF/image) or plain text. Return extracted text and entities."""
-    extracted = ""
+    content = b""
+    is_pdf = False
     if file is not None:
         content = await file.read()
-        if file.filename.lower().endswith('.pdf'):
-            extracted = extract_text_from_pdf_bytes(content)
-        else:
-            extracted = extract_text_from_image_bytes(content)
+        is_pdf = file.filename.lower().endswith('.pdf')
+        annotate(input="pdf" if is_pdf else "image", file_bytes=len(content))
     # Accept JSON body with text as well
     if not text:
         ct = request.headers.get("content-type", "").lower()
@@ -95,6 +269,26 @@ async def upload(
             except Exception:
                 pass
 
+    key = request_key(
+        "upload",
+        hashlib.sha256(content).hexdigest() if file is not None else None,
+        is_pdf,
+        normalize_text(text) if text else None,
+        bool(clinical_only),
+        bool(auto_suggest),
+        os.environ.get("SUGGEST_MODE", "llm").lower() if auto_suggest else None,
+    )
+    return await _UPLOAD_FLIGHTS.do(key, lambda: _upload(file is not None, content, is_pdf, text, clinical_only, auto_suggest))
+
+
+async def _upload(has_file: bool, content: bytes, is_pdf: bool, text: Optional[str], clinical_only: bool, auto_suggest: bool) -> Dict:
+    extracted = ""
+    if has_file:
+        if is_pdf:
+            extracted = extract_text_from_pdf_bytes(content)
+        else:
+            extracted = extract_text_from_image_bytes(content)
+
     if text:
         # prefer provided text if present
         extracted = text
@@ -103,17 +297,25 @@ async def upload(
     if clinical_only:
         try:
             from app.ocr import extract_clinical_note_section
-            extracted = extract_clinical_note_section(extracted)
+            with timed("section_extraction"):
+                extracted = extract_clinical_note_section(extracted)
         except Exception:
             pass
 
+    if text:
+        annotate(input="text")
+    annotate(text_chars=len(extracted or ""), auto_suggest=bool(auto_suggest))
     ents = extract_entities(extracted)
 
     # Optional: immediately run suggestions to streamline front-end flow
     if auto_suggest:
         try:
-            from app.llm_refine import generate_codes_from_text
-            sugg = generate_codes_from_text(ents, extracted, top_k=10)
+            if _load_mode() == "retrieval_only" and _retrieval_available():
+                annotate(degraded=True)
+                sugg = await _retrieval_only(extracted, ents, 10, {})
+            else:
+                from app.llm_refine import generate_codes_from_text
+                sugg = generate_codes_from_text(ents, extracted, top_k=10)
         except Exception:
             sugg = []
         return {"text": extracted, "entities": ents, "suggestions": sugg}
@@ -125,26 +327,27 @@ async def upload(
 def config():
     mode = os.environ.get("SUGGEST_MODE", "llm").lower()
     gem_model = os.environ.get("GEMINI_MODEL", "gemini-1.5-flash")
-    # Basic check for FAISS files
-    faiss_present = all(os.path.exists(p) for p in [
-        os.path.join("data", "faiss.index"),
-        os.path.join("data", "meta.npy"),
-    ])
     return {
         "mode": mode,
         "llm_provider": "gemini",
         "llm_model": gem_model,
-        "retrieval_enabled": bool(faiss_present),
+        "retrieval_enabled": _retrieval_available(),
+        "load": get_controller().snapshot(),
+        "search_cache": search_cache_stats(),
         "version": "0.1",
     }
 
 
-@app.post("/suggest", response_model=SuggestResponse)
-async def suggest(
-    request: Request,
-    text: Optional[str] = Form(None),
-    top_k: Optional[int] = Form(None),
-):
+@app.get("/codes")
+def codes(prefix: str = "", system: Optional[str] = None, limit: int = 20):
+    """Autocomplete ICD-10/CPT codes by prefix from the in-memory code catalogue."""
+    catalog = get_catalog()
+    if catalog is None or not prefix.strip():
+        return {"prefix": prefix, "items": []}
+    return {"prefix": prefix, "items": catalog.prefix(prefix, limit=max(1, min(int(limit), 100)), system=system)}
+
+
+async def _suggest_params(request: Request, text: Optional[str], top_k: Optional[int]) -> Tuple[str, int]:
     # Accept both JSON and form-data; JSON wins when present
     ct = request.headers.get("content-type", "").lower()
     if "application/json" in ct:
@@ -155,112 +358,363 @@ async def suggest(
                 top_k = data.get("top_k", top_k)
         except Exception:
             pass
-    text = text or ""
-    top_k = top_k if top_k is not None else 5
-    _dbg(f"/suggest: mode={os.environ.get('SUGGEST_MODE','llm')} text_chars={len(text)} top_k={top_k}")
-    # 1) Extract entities
-    ents: List[Dict] = extract_entities(text)
-    _dbg(f"/suggest: ents={len(ents)}")
+    return text or "", int(top_k) if top_k is not None else 5
+
+
+def _suggestion_models(items: List[Dict]) -> List[CodeSuggestion]:
+    return [CodeSuggestion(
+        code=str(r.get('code','')),
+        system=str(r.get('system','ICD-10')),
+        description=str(r.get('description','')),
+        score=float(r.get('score',0.0)),
+        reason=str(r.get('reason',''))
+    ) for r in items]
 
-    # LLM-only medical coding is the default and recommended flow
-    suggest_mode = os.environ.get("SUGGEST_MODE", "llm").lower()
-    if suggest_mode == "llm":
-        direct = generate_codes_from_text(ents, text, top_k=top_k)
-        ents_models = [Entity(text=e.get('text',''), label=e.get('label',''), start=e.get('start',0), end=e.get('end',0)) for e in ents]
-        suggestions: List[CodeSuggestion] = []
-        for r in direct:
-            suggestions.append(CodeSuggestion(
-                code=str(r.get('code','')),
-                system=str(r.get('system','ICD-10')),
-                description=str(r.get('description','')),
-                score=float(r.get('score',0.0)),
-                reason=str(r.get('reason',''))
-            ))
-        _dbg(f"/suggest: LLM suggestions={len(suggestions)}")
-        return SuggestResponse(entities=ents_models, suggestions=suggestions)
 
-    # 2) Optional retrieval (no hardcoding/heuristics). If FAISS files are present
-    # and SUGGEST_MODE != 'llm', do a simple text-based retrieval to supply
-    # candidates to the LLM for refinement.
-    idx = FaissIndexWrapper(
+def _entity_models(ents: List[Dict]) -> List[Entity]:
+    return [Entity(text=e.get('text',''), label=e.get('label',''), start=e.get('start',0), end=e.get('end',0)) for e in ents]
+
+
+async def _retrieve_candidates(text: str, ents: List[Dict], top_k: int, timings: Dict[str, float]) -> Tuple[List[Dict], int, bool]:
+    """Hybrid retrieval: dense FAISS (+ BM25 fused by RRF when available).
+    Returns (aggregated candidates, LLM pool size, lexical used); fills `timings`."""
+    # If FAISS files are present and SUGGEST_MODE != 'llm', do a simple text-based
+    # retrieval to supply candidates to the LLM for refinement (no hardcoding/heuristics).
+    idx = get_index(
         index_path="data/faiss.index",
         desc_path="data/descriptions.npy",
         meta_path="data/meta.npy",
     )
+    # Lexical BM25 half runs when its arrays were built (LEXICAL_RETRIEVAL=0 disables)
+    bm25 = get_bm25_index("data") if os.environ.get("LEXICAL_RETRIEVAL", "1").lower() not in ("0", "false", "no") else None
+
+    # Retrieval: full text + up to 3 long entity phrases (no keyword hacks)
+    phrases = _pick_entity_phrases(ents, max_n=3)
+    k_ret = max(top_k, 10)
+    # Optional guaranteed ICD/CPT mix, e.g. RETRIEVAL_QUOTAS="ICD-10:6,CPT:4"
+    quotas = parse_quotas(os.environ.get("RETRIEVAL_QUOTAS", ""))
+    # The encoder only reads the first ~384 tokens: long notes are queried as overlapping,
+    # section-aware windows instead (a short note is its own single window)
+    windows = embedding_windows(text) or [text]
+    annotate(windows=len(windows))
+
+    def _dense() -> Tuple[np.ndarray, np.ndarray]:
+        """(scores, ids), one ranked row per query: each text window, then each entity phrase."""
+        t0 = time.perf_counter()
+        try:
+            # Window + entity phrase queries (no keyword expansions), encoded in one batch;
+            # repeated ones come from the search cache without encoding
+            D, I = idx.search_texts(windows + phrases, top_k=k_ret, quotas=quotas)
+        except Exception:
+            D, I = np.empty((0, 0), dtype=np.float32), np.empty((0, 0), dtype=np.int64)
+        timings["dense"] = (time.perf_counter() - t0) * 1000.0
+        return D, I
+
+    def _lexical() -> List[List[Dict]]:
+        t0 = time.perf_counter()
+        lists: List[List[Dict]] = []
+        try:
+            for q in [text] + phrases:
+                ids, scores = bm25.search(q, top_k=k_ret)
+                lists.append(idx.rows(ids, scores))
+        except Exception:
+            lists = []
+        timings["lexical"] = (time.perf_counter() - t0) * 1000.0
+        return lists
+
+    if bm25 is not None:
+        # Dense and lexical halves in parallel, merged by reciprocal rank fusion
+        (D, I), lexical_lists = await asyncio.gather(asyncio.to_thread(_dense), asyncio.to_thread(_lexical))
+        # Windows are max-pooled into one ranked list first, so a long note counts once in RRF
+        nw = len(windows) if len(windows) > 1 and len(D) >= len(windows) else 0
+        dense_lists = [idx.aggregate(D[:nw], I[:nw], top_k=k_ret)] if nw else []
+        dense_lists += [idx.rows(row_ids, row_scores) for row_scores, row_ids in zip(D[nw:], I[nw:])]
+        with timed("aggregation"):
+            aggregated = reciprocal_rank_fusion(dense_lists + lexical_lists)
+        # Fused candidates are more precise, so a smaller pool goes to the LLM
+        pool_size = int(os.environ.get("LLM_POOL_SIZE", "12"))
+    else:
+        # Aggregate only (no heuristic boosts): dedupe/top-k on the id/score arrays (max over
+        # windows and phrases), and only the rows that can be used (LLM pool or top_k
+        # fallback) become dicts
+        pool_size = int(os.environ.get("LLM_POOL_SIZE", "20"))
+        D, I = _dense()
+        with timed("aggregation"):
+            aggregated = idx.aggregate(D, I, top_k=max(pool_size, top_k))
+    _dbg(f"/suggest: retrieval timings={ {k: round(v, 1) for k, v in timings.items()} } candidates={len(aggregated)}")
+    return aggregated, pool_size, bm25 is not None
+
+
+def _load_mode() -> str:
+    """Load-controller mode recorded for this request by the load_shedding middleware."""
+    trace = current_trace()
+    return trace.mode.get("load_mode", "full") if trace else "full"
+
+
+def _retrieval_available() -> bool:
+    # Basic check for FAISS files
+    return os.path.exists(os.path.join("data", "faiss.index")) and meta_exists(os.path.join("data", "meta.npy"))
+
+
+def _degraded() -> bool:
+    """True when an LLM call of this request hit its deadline (see llm_refine._raced_items)."""
+    trace = current_trace()
+    return bool(trace and trace.mode.get("degraded") == "true")
+
+
+def _partial() -> bool:
+    """True when part of a long note was not queried/coded (chunk caps or the deadline,
+    see chunking.llm_chunks / embedding_windows and llm_refine.generate_codes_from_text)."""
+    trace = current_trace()
+    return bool(trace and trace.mode.get("partial") == "true")
 
-    # 3) Retrieval: full text + up to 3 long entity phrases (no keyword hacks)
-    def _pick_entity_phrases(items: List[Dict], max_n: int = 3) -> List[str]:
-        seen = set()
-        # prefer longer, meaningful snippets
-        texts = sorted([str(e.get("text", "")) for e in items if e.get("text")], key=len, reverse=True)
-        out = []
-        for t in texts:
-            t2 = t.strip()
-            if len(t2) < 3:
-                continue
-            key = t2.lower()
-            if key in seen:
-                continue
-            seen.add(key)
-            out.append(t2)
-            if len(out) >= max_n:
-                break
-        return out
-
-    all_candidates: List[Dict] = []
+
+async def _retrieval_only(text: str, ents: List[Dict], top_k: int, timings: Dict[str, float]) -> List[Dict]:
+    """Degraded llm-mode answer: top FAISS/BM25 candidates via _fallback_refine ([] without an index)."""
     try:
-        # Full text query
-        q_full = embed_texts([text])
-        all_candidates.extend(idx.search(q_full, top_k=max(top_k, 10)))
-
-        # Entity phrase queries (no keyword expansions)
-        phrases = _pick_entity_phrases(ents, max_n=3)
-        if phrases:
-            q_ents = embed_texts(phrases)
-            all_candidates.extend(idx.search(q_ents, top_k=max(top_k, 10)))
-    except Exception:
-        all_candidates = []
-
-    # 4) Aggregate only (no heuristic boosts)
-    def _aggregate(cands: List[Dict]) -> List[Dict]:
-        agg: Dict[Tuple[str, str], Dict] = {}
-        for c in cands:
-            code = str(c.get("code", ""))
-            system = str(c.get("system", ""))
-            desc = str(c.get("description", ""))
-            score = float(c.get("score", 0.0))
-            key = (code, system)
-            if key not in agg or score > agg[key]["score"]:
-                agg[key] = {"code": code, "system": system, "description": desc, "score": score}
-        out = []
-        for v in agg.values():
-            out.append({**v, "score": float(v.get("score", 0.0))})
-        out.sort(key=lambda x: x.get("score", 0.0), reverse=True)
-        return out
-
-    aggregated = _aggregate(all_candidates)
-
-    # 5) Use LLM refine on a broader pool; keep up to 20
-    pool_for_llm = aggregated[:20] if aggregated else []
-    refined = refine(ents, pool_for_llm, clinical_text=text, top_k=top_k)
+        aggregated, _, _ = await _retrieve_candidates(text, ents, top_k, timings)
+    except Exception as e:
+        _dbg(f"/suggest: retrieval fallback unavailable: {e}")
+        return []
+    return _fallback_refine(ents, aggregated, text, top_k=top_k)
+
+
+def _cross_check(direct: List[Dict], pool: List[Dict], top_k: int) -> Tuple[List[Dict], List[Dict], float]:
+    """Split direct LLM codes into (in the retrieved pool, not in it) and return the agreement
+    ratio: the share of direct codes that retrieval also found."""
+    keys = {(str(c.get("code", "")).upper(), str(c.get("system", "")).upper()) for c in pool}
+    confirmed, unconfirmed = [], []
+    for d in direct[:max(1, top_k)]:
+        key = (str(d.get("code", "")).upper(), str(d.get("system", "")).upper())
+        (confirmed if key in keys else unconfirmed).append(d)
+    agreement = len(confirmed) / len(direct[:max(1, top_k)]) if direct else 0.0
+    return confirmed, unconfirmed, agreement
+
+
+# Identical concurrent requests (double-clicks, client retries) share one computation
+_SUGGEST_FLIGHTS = SingleFlight("suggest")
+_UPLOAD_FLIGHTS = SingleFlight("upload")
+
+
+@app.post("/suggest", response_model=SuggestResponse)
+async def suggest(
+    request: Request,
+    text: Optional[str] = Form(None),
+    top_k: Optional[int] = Form(None),
+):
+    text, top_k = await _suggest_params(request, text, top_k)
+    # LLM-only medical coding is the default and recommended flow
+    suggest_mode = os.environ.get("SUGGEST_MODE", "llm").lower()
+    key = request_key("suggest", suggest_mode, normalize_text(text), top_k)
+    return await _SUGGEST_FLIGHTS.do(key, lambda: _suggest(text, top_k, suggest_mode))
+
+
+async def _suggest(text: str, top_k: int, suggest_mode: str) -> SuggestResponse:
+    # Overall latency budget (SUGGEST_DEADLINE_MS); LLM calls stop waiting at this point
+    deadline = deadline_from_env()
+    load_mode = _load_mode()
+    if load_mode != "full" and suggest_mode != "hybrid" and _retrieval_available():
+        # Under load the LLM-first flows step down to retrieval (+ refine)
+        suggest_mode = "hybrid"
+    _dbg(f"/suggest: mode={suggest_mode} load_mode={load_mode} text_chars={len(text)} top_k={top_k}")
+    direct_task = None
+    if suggest_mode == "pipeline":
+        # Direct generation from the raw text starts now and overlaps NER + retrieval
+        # (no entities yet; the clinical text carries the same information)
+        direct_task = asyncio.ensure_future(
+            asyncio.to_thread(generate_codes_from_text, [], text, top_k=top_k, deadline=deadline)
+        )
+
+    # 1) Extract entities
+    ents: List[Dict] = await asyncio.to_thread(extract_entities, text) if direct_task else extract_entities(text)
+    _dbg(f"/suggest: ents={len(ents)}")
+
+    annotate(mode=suggest_mode, text_chars=len(text), entities=len(ents), top_k=int(top_k))
+    if suggest_mode == "llm":
+        direct = await asyncio.to_thread(generate_codes_from_text, ents, text, top_k=top_k, deadline=deadline)
+        if not direct and _degraded():
+            direct = await _retrieval_only(text, ents, top_k, {})
+        suggestions = _suggestion_models(direct)
+        _dbg(f"/suggest: LLM suggestions={len(suggestions)}")
+        return SuggestResponse(entities=_entity_models(ents), suggestions=suggestions, metadata={
+            "mode": "llm",
+            "degraded": _degraded(),
+            "partial": _partial(),
+            "load_mode": load_mode,
+        })
+
+    # 2-4) Retrieval + aggregation
+    timings: Dict[str, float] = {}
+    try:
+        aggregated, pool_size, lexical = await _retrieve_candidates(text, ents, top_k, timings)
+    except BaseException:
+        if direct_task is not None:
+            direct_task.cancel()
+        raise
+
+    # 5) Use LLM refine on a broader pool
+    pool_for_llm = aggregated[:pool_size] if aggregated else []
+    if load_mode == "reduced":
+        pool_for_llm = pool_for_llm[:int(os.environ.get("LOAD_REDUCED_POOL", "6"))]
+    annotate(candidates=len(pool_for_llm))
+    refined = None
+    if load_mode == "retrieval_only":
+        annotate(degraded=True)
+        refined = _fallback_refine(ents, pool_for_llm, text, top_k=top_k)
+    agreement = None
+    if direct_task is not None:
+        # Pipeline mode: cross-check the direct codes against the candidates. When enough of
+        # them were also retrieved the refine round-trip is skipped; otherwise the codes
+        # retrieval missed join the pool refine chooses from.
+        direct = await direct_task
+        confirmed, unconfirmed, agreement = _cross_check(direct, pool_for_llm, top_k)
+        min_agreement = float(os.environ.get("PIPELINE_AGREEMENT", "0.6"))
+        annotate(agreement=round(agreement, 3), direct=len(direct))
+        if direct and agreement >= min_agreement:
+            PIPELINE.inc("agree")
+            refined = confirmed + unconfirmed
+        elif _degraded():
+            # Deadline already spent on the direct call: no second LLM round-trip
+            PIPELINE.inc("degraded")
+            refined = _fallback_refine(ents, pool_for_llm, text, top_k=top_k)
+        else:
+            PIPELINE.inc("refine")
+            pool_for_llm = pool_for_llm + unconfirmed
+        annotate(refine_skipped=refined is not None)
+    if refined is None and load_mode == "full":
+        # Optional cross-encoder pass: a shorter, better-ordered pool for the LLM, or no LLM
+        # call at all when the top candidates are confident enough (RERANK_ACCEPT)
+        pool_for_llm, refined = await asyncio.to_thread(rerank_pool, text, pool_for_llm, top_k, deadline)
+    if refined is None:
+        refined = await asyncio.to_thread(refine, ents, pool_for_llm, clinical_text=text, top_k=top_k, deadline=deadline)
 
     # 6) Use refined results as-is (no enforced mix)
     final_suggestions = refined[:max(1, top_k)] if refined else aggregated[:max(1, top_k)]
-
-    # map to response models
-    ents_models = [Entity(text=e.get('text',''), label=e.get('label',''), start=e.get('start',0), end=e.get('end',0)) for e in ents]
-    suggestions: List[CodeSuggestion] = []
-    for r in final_suggestions:
-        suggestions.append(CodeSuggestion(
-            code=str(r.get('code','')),
-            system=str(r.get('system','ICD-10')),
-            description=str(r.get('description','')),
-            score=float(r.get('score',0.0)),
-            reason=str(r.get('reason',''))
-        ))
+    suggestions = _suggestion_models(final_suggestions)
 
     _dbg(f"/suggest: hybrid suggestions={len(suggestions)}")
-    return SuggestResponse(entities=ents_models, suggestions=suggestions)
+    trace = current_trace()
+    return SuggestResponse(entities=_entity_models(ents), suggestions=suggestions, metadata={
+        "mode": suggest_mode if direct_task is not None else "hybrid",
+        "degraded": _degraded(),
+        "partial": _partial(),
+        "load_mode": load_mode,
+        "agreement": round(agreement, 3) if agreement is not None else None,
+        "lexical": lexical,
+        "timings_ms": {k: round(v, 2) for k, v in timings.items()},
+        "prompt_tokens": int(trace.sizes.get("prompt_tokens", 0)) if trace else None,
+    })
+
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/suggest/stream")
+async def suggest_stream(
+    request: Request,
+    text: Optional[str] = Form(None),
+    top_k: Optional[int] = Form(None),
+):
+    """Server-sent-events variant of /suggest. Events, in order:
+    `entities` (right after NER), `candidates` (hybrid mode, after retrieval/aggregation),
+    one `suggestion` per code as the LLM streams it (fallback codes after the LLM call),
+    then `done` with timings; `error` if the pipeline fails."""
+    text, top_k = await _suggest_params(request, text, top_k)
+    deadline = deadline_from_env()
+    suggest_mode = os.environ.get("SUGGEST_MODE", "llm").lower()
+    load_mode = _load_mode()
+    if load_mode != "full" and suggest_mode != "hybrid" and _retrieval_available():
+        suggest_mode = "hybrid"
+    annotate(mode=suggest_mode, text_chars=len(text), top_k=int(top_k), stream=True)
+
+    async def events():
+        t0 = time.perf_counter()
+        marks: Dict[str, float] = {}
+        timings: Dict[str, float] = {}
+
+        def _mark(name: str) -> None:
+            marks[name] = round((time.perf_counter() - t0) * 1000.0, 1)
+
+        try:
+            # Blocking stages run in worker threads so other requests keep being served
+            ents: List[Dict] = await asyncio.to_thread(extract_entities, text)
+            _mark("entities")
+            yield _sse("entities", {"entities": [_to_dict(e) for e in _entity_models(ents)]})
+
+            # LLM codes are pushed from the worker thread as they stream in
+            loop = asyncio.get_running_loop()
+            queue: asyncio.Queue = asyncio.Queue()
+            sent = set()
+
+            def _push(item: Dict) -> None:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+
+            def _run(fn, *args):
+                try:
+                    return fn(*args, on_item=_push, deadline=deadline)
+                finally:
+                    loop.call_soon_threadsafe(queue.put_nowait, None)
+
+            if suggest_mode == "llm":
+                task = asyncio.ensure_future(asyncio.to_thread(_run, generate_codes_from_text, ents, text, top_k))
+            else:
+                aggregated, pool_size, lexical = await _retrieve_candidates(text, ents, top_k, timings)
+                pool_for_llm = aggregated[:pool_size] if aggregated else []
+                if load_mode == "reduced":
+                    pool_for_llm = pool_for_llm[:int(os.environ.get("LOAD_REDUCED_POOL", "6"))]
+                accepted = None
+                if load_mode == "full":
+                    pool_for_llm, accepted = await asyncio.to_thread(rerank_pool, text, pool_for_llm, top_k, deadline)
+                _mark("candidates")
+                yield _sse("candidates", {"candidates": pool_for_llm, "lexical": lexical})
+                if accepted is not None:
+                    queue.put_nowait(None)  # re-ranker was confident: no LLM call
+                    task = asyncio.ensure_future(asyncio.sleep(0, result=accepted))
+                elif load_mode == "retrieval_only":
+                    annotate(degraded=True)
+                    queue.put_nowait(None)  # nothing streams: fallback codes are sent below
+                    task = asyncio.ensure_future(asyncio.to_thread(_fallback_refine, ents, pool_for_llm, text, top_k))
+                else:
+                    task = asyncio.ensure_future(asyncio.to_thread(_run, refine, ents, pool_for_llm, text, top_k))
+
+            while (item := await queue.get()) is not None:
+                if not sent:
+                    _mark("first_suggestion")
+                sent.add((item.get("code"), item.get("system")))
+                yield _sse("suggestion", _to_dict(_suggestion_models([item])[0]))
+            final = await task
+            if suggest_mode == "llm" and not final and _degraded():
+                final = await _retrieval_only(text, ents, top_k, timings)
+            elif suggest_mode != "llm":
+                final = final[:max(1, top_k)] if final else aggregated[:max(1, top_k)]
+            # Fallback results (LLM unavailable/unparseable) were not streamed; send them now
+            for s in _suggestion_models([r for r in final if (r.get("code"), r.get("system")) not in sent]):
+                if not sent:
+                    _mark("first_suggestion")
+                sent.add((s.code, s.system))
+                yield _sse("suggestion", _to_dict(s))
+            _mark("total")
+            trace = current_trace()
+            stages = {k: round(ms, 1) for k, (ms, _) in trace.stage_totals().items()} if trace else {}
+            yield _sse("done", {
+                "mode": suggest_mode,
+                "count": len(final),
+                "degraded": _degraded(),
+                "partial": _partial(),
+                "load_mode": load_mode,
+                "marks_ms": marks,  # elapsed time at which each event was ready
+                "stages_ms": stages,
+                "timings_ms": {k: round(v, 2) for k, v in timings.items()},
+            })
+        except Exception as e:
+            _dbg(f"/suggest/stream: error {e}")
+            yield _sse("error", {"message": type(e).__name__})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # don't let reverse proxies buffer the stream
+    })
 
 
 @app.post("/generate_claim", response_model=ClaimResponse)
@@ -309,7 +763,8 @@ def generate_claim(req: ClaimRequest):
 def claim_pdf(req: ClaimRequest):
     # Generate a transient claim id for the PDF header
     cid = str(uuid.uuid4())
-    pdf_bytes = generate_claim_pdf(cid, [_to_dict(c) for c in req.approved])
+    with timed("pdf_render"):
+        pdf_bytes = generate_claim_pdf(cid, [_to_dict(c) for c in req.approved])
     return StreamingResponse(iter([pdf_bytes]), media_type="application/pdf", headers={
         "Content-Disposition": f"attachment; filename=claim_{cid}.pdf"
     })
@@ -317,41 +772,39 @@ def claim_pdf(req: ClaimRequest):
 
 @app.post("/cms1500")
 def cms1500(req: CMS1500Request):
-    # Derive header fields from text if present
-    derived = parse_header_info(req.text or "")
-    patient_name = req.patient_name or derived.get("patient_name", "")
-    patient_id = req.patient_id or derived.get("patient_id", "")
-    provider_name = req.provider_name or derived.get("provider_name", "")
-    date_of_service = req.date_of_service or derived.get("date_of_service", "")
-    patient_dob = req.patient_dob or derived.get("patient_dob", "")
-    patient_sex = req.patient_sex or derived.get("patient_sex", "")
-    patient_address = req.patient_address or derived.get("patient_address", "")
-    place_of_service = req.place_of_service or derived.get("place_of_service", "")
-    referring_npi = req.referring_npi or derived.get("referring_npi", "")
-
-    # Split codes into ICD diagnoses and CPT procedures
-    approved_list = [_to_dict(c) for c in req.approved]
-    diagnoses, procedures = split_codes(approved_list)
-
-    pdf_bytes = generate_cms1500_pdf(
-        patient_name=patient_name,
-        patient_id=patient_id,
-        provider_name=provider_name,
-        date_of_service=date_of_service,
-        patient_dob=patient_dob,
-        patient_sex=patient_sex,
-        patient_address=patient_address,
-        place_of_service=place_of_service,
-        referring_npi=referring_npi,
-        diagnoses=diagnoses,
-        procedures=procedures,
-        diag_pointers=req.diag_pointers or None,
-    )
+    # Derive header fields from text if present, then split ICD/CPT codes
+    with timed("pdf_render"):
+        pdf_bytes = render_cms1500(_to_dict(req))
     return StreamingResponse(iter([pdf_bytes]), media_type="application/pdf", headers={
         "Content-Disposition": f"attachment; filename=cms1500.pdf"
     })
 
 
+@app.post("/cms1500/bulk")
+def cms1500_bulk(req: CMS1500BulkRequest):
+    """Render many CMS-1500 forms in a process pool and stream them back as a
+    ZIP archive (one PDF per form + report.json) or a single multi-page PDF.
+    The PDF is assembled in memory, so it is limited to CMS1500_BULK_PDF_MAX_FORMS
+    forms; larger batches must use 'zip'."""
+    fmt = (req.format or "zip").lower()
+    if fmt not in ("zip", "pdf"):
+        return JSONResponse({"error": f"unsupported format: {req.format!r} (use 'zip' or 'pdf')"}, status_code=400)
+    if fmt == "pdf" and not pdf_concat_available():
+        return JSONResponse({"error": "format 'pdf' requires pypdf; install it or use format 'zip'"}, status_code=400)
+    if fmt == "pdf" and len(req.forms) > pdf_max_forms():
+        return JSONResponse({"error": f"format 'pdf' is limited to {pdf_max_forms()} forms "
+                                      "(CMS1500_BULK_PDF_MAX_FORMS); use format 'zip' for larger batches"}, status_code=400)
+    payloads = [_to_dict(f) for f in req.forms]
+    annotate(forms=len(payloads), format=fmt)
+    if fmt == "pdf":
+        return StreamingResponse(stream_cms1500_pdf(payloads), media_type="application/pdf", headers={
+            "Content-Disposition": "attachment; filename=cms1500_bulk.pdf"
+        })
+    return StreamingResponse(stream_cms1500_zip(payloads), media_type="application/zip", headers={
+        "Content-Disposition": "attachment; filename=cms1500_bulk.zip"
+    })
+
+
 @app.post("/cms1500/derive")
 def cms1500_derive(request: dict):
     """Derive CMS-1500 header fields from raw text (used to prefill the dialog)."""
@@ -419,3 +872,20 @@ def cms1500_derive(request: dict):
 @app.get("/health")
 def health():
     return {"status": "ok"}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text-format metrics (stage latency histograms, cache/fallback/retry counters)."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+def ready():
+    """Readiness: 200 once the startup warm-up has finished, 503 before."""
+    body = {
+        "ready": bool(_startup["ready"]),
+        "phases_ms": _startup["phases_ms"],
+        "errors": _startup["errors"],
+    }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
@@ -0,0 +1,203 @@
+# app/meta_store.py
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# uint8 system column; rows without a system (tombstones) use _NO_SYSTEM
+SYSTEM_NAMES = ("ICD-10", "CPT")
+SYSTEM_IDS = {name: i for i, name in enumerate(SYSTEM_NAMES)}
+_NO_SYSTEM = 255
+_PARTS = ("blob", "code_off", "desc_off", "system")
+
+
+def columnar_paths(meta_path: str) -> Dict[str, str]:
+    """Columnar files next to the logical meta path, e.g. data/meta.npy -> data/meta_blob.npy,
+    data/meta_code_off.npy, data/meta_desc_off.npy, data/meta_system.npy."""
+    root, _ = os.path.splitext(meta_path)
+    return {part: f"{root}_{part}.npy" for part in _PARTS}
+
+
+def meta_exists(meta_path: str) -> bool:
+    """True when code metadata exists in either format (columnar or legacy pickled meta.npy)."""
+    return all(os.path.exists(p) for p in columnar_paths(meta_path).values()) or os.path.exists(meta_path)
+
+
+def meta_stamp(meta_path: str) -> Tuple[int, ...]:
+    """mtimes (ns) of the metadata files in both formats plus the index manifest.json; changes
+    whenever build_index / code_index rewrite the metadata (0 for a missing file)."""
+    def _mtime(p: str) -> int:
+        try:
+            return os.stat(p).st_mtime_ns
+        except OSError:
+            return 0
+    paths = list(columnar_paths(meta_path).values()) + [meta_path, os.path.join(os.path.dirname(meta_path) or ".", "manifest.json")]
+    return tuple(_mtime(p) for p in paths)
+
+
+class MetaStore:
+    """Code metadata as columns: one UTF-8 blob holding every code then every description,
+    int64 offset arrays (n + 1) into it for codes and descriptions, and a uint8 system
+    column. Loaded with mmap the arrays are zero-copy; strings are decoded only for the
+    rows actually read. Rows index like the old meta array: store[i] -> (code, system, description).
+    """
+
+    def __init__(self, blob: np.ndarray, code_off: np.ndarray, desc_off: np.ndarray, system_ids: np.ndarray):
+        self.blob = blob
+        self.code_off = code_off
+        self.desc_off = desc_off
+        self.system_ids = system_ids
+        # Plain views for per-row reads (slicing np.memmap objects is comparatively slow)
+        self._buf = memoryview(np.asarray(blob))
+        self._code_off = np.asarray(code_off)
+        self._desc_off = np.asarray(desc_off)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str, str]]) -> "MetaStore":
+        codes: List[bytes] = []
+        descs: List[bytes] = []
+        systems: List[int] = []
+        for code, system, desc in rows:
+            codes.append(str(code).encode("utf-8"))
+            descs.append(str(desc).encode("utf-8"))
+            systems.append(SYSTEM_IDS.get(str(system), _NO_SYSTEM))
+        code_off = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum([len(c) for c in codes], out=code_off[1:])
+        desc_off = np.zeros(len(descs) + 1, dtype=np.int64)
+        np.cumsum([len(d) for d in descs], out=desc_off[1:])
+        desc_off += code_off[-1]
+        blob = np.frombuffer(b"".join(codes) + b"".join(descs), dtype=np.uint8)
+        return cls(blob, code_off, desc_off, np.asarray(systems, dtype=np.uint8))
+
+    @classmethod
+    def load(cls, meta_path: str, mmap: bool = True) -> "MetaStore":
+        paths = columnar_paths(meta_path)
+        mode = "r" if mmap else None
+        return cls(*(np.load(paths[part], mmap_mode=mode) for part in _PARTS))
+
+    def save(self, meta_path: str) -> None:
+        """Write the four column files (each atomically via a temp file)."""
+        arrays = (self.blob, self.code_off, self.desc_off, self.system_ids)
+        for (part, path), arr in zip(columnar_paths(meta_path).items(), arrays):
+            tmp = path + ".tmp.npy"
+            np.save(tmp, np.ascontiguousarray(arr))
+            os.replace(tmp, path)
+
+    def __len__(self) -> int:
+        return len(self.system_ids)
+
+    def _str(self, off: np.ndarray, i: int) -> str:
+        return str(self._buf[off[i]:off[i + 1]], "utf-8")
+
+    def code(self, i: int) -> str:
+        return self._str(self._code_off, i)
+
+    def description(self, i: int) -> str:
+        return self._str(self._desc_off, i)
+
+    def system(self, i: int) -> str:
+        s = int(self.system_ids[i])
+        return SYSTEM_NAMES[s] if s < len(SYSTEM_NAMES) else ""
+
+    def __getitem__(self, i: int) -> Tuple[str, str, str]:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.code(i), self.system(i), self.description(i)
+
+    def __iter__(self) -> Iterator[Tuple[str, str, str]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def iter_code_system(self) -> Iterator[Tuple[str, str]]:
+        """(code, system) per row without decoding descriptions."""
+        for i in range(len(self)):
+            yield self.code(i), self.system(i)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(int(a.nbytes) for a in (self.blob, self.code_off, self.desc_off, self.system_ids))
+
+
+def load_meta(meta_path: str, mmap: bool = True) -> MetaStore:
+    """Columnar metadata when present; otherwise the legacy pickled meta.npy, converted in
+    memory (run `python -m app.meta_store --convert` once to skip that)."""
+    if all(os.path.exists(p) for p in columnar_paths(meta_path).values()):
+        return MetaStore.load(meta_path, mmap=mmap)
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"Meta file not found: {meta_path}")
+    return MetaStore.from_rows(np.load(meta_path, allow_pickle=True))
+
+
+def convert(meta_path: str) -> MetaStore:
+    """Write the columnar files for an existing pickled meta.npy (which is left in place)."""
+    store = MetaStore.from_rows(np.load(meta_path, allow_pickle=True))
+    store.save(meta_path)
+    return store
+
+
+def _rss_mb(private: bool = False) -> float:
+    """Resident MB of this process (Linux); private=True excludes file-backed shared pages,
+    which is what each extra worker process really costs for a memmapped file."""
+    try:
+        with open("/proc/self/statm") as f:
+            fields = [int(x) for x in f.read().split()]
+        pages = fields[1] - fields[2] if private else fields[1]
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except Exception:
+        return 0.0
+
+
+def _measure(fmt: str, meta_path: str, lookups: int = 1000) -> Dict[str, float]:
+    """Load one format in this (fresh) process and read `lookups` random rows."""
+    rss0, priv0 = _rss_mb(), _rss_mb(private=True)
+    t0 = time.perf_counter()
+    meta = np.load(meta_path, allow_pickle=True) if fmt == "pickle" else MetaStore.load(meta_path)
+    load_ms = (time.perf_counter() - t0) * 1000.0
+    rss_load = _rss_mb()
+    ids = np.random.default_rng(0).integers(0, len(meta), size=lookups)
+    t0 = time.perf_counter()
+    for i in ids:
+        code, system, desc = meta[i]
+        str(code), str(system), str(desc)
+    lookup_us = (time.perf_counter() - t0) * 1e6 / lookups
+    return {"rows": len(meta), "load_ms": round(load_ms, 2), "rss_after_load_mb": round(rss_load - rss0, 1),
+            "rss_after_lookups_mb": round(_rss_mb() - rss0, 1),
+            "private_after_lookups_mb": round(_rss_mb(private=True) - priv0, 1), "lookup_us": round(lookup_us, 2)}
+
+
+def compare(meta_path: str) -> Dict[str, Dict[str, float]]:
+    """Load time and RSS growth of pickled vs columnar metadata, each in a fresh interpreter."""
+    out = {}
+    for fmt in ("pickle", "columnar"):
+        res = subprocess.run([sys.executable, "-m", "app.meta_store", "--measure", fmt, "--meta_path", meta_path],
+                             capture_output=True, text=True, check=True)
+        out[fmt] = json.loads(res.stdout.strip().splitlines()[-1])
+    return out
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Columnar code metadata: convert meta.npy and compare formats")
+    ap.add_argument("--meta_path", default="data/meta.npy")
+    ap.add_argument("--convert", action="store_true", help="Write meta_*.npy columns from the pickled meta.npy")
+    ap.add_argument("--compare", action="store_true", help="Report load time / RSS for both formats")
+    ap.add_argument("--measure", choices=("pickle", "columnar"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.measure:
+        print(json.dumps(_measure(args.measure, args.meta_path)))
+        raise SystemExit(0)
+    if args.convert:
+        t0 = time.perf_counter()
+        store = convert(args.meta_path)
+        print(f"converted {len(store)} rows -> {', '.join(columnar_paths(args.meta_path).values())} "
+              f"({store.nbytes / 1e6:.1f} MB, {time.perf_counter() - t0:.1f}s)")
+    if args.compare:
+        for fmt, stats in compare(args.meta_path).items():
+            print(f"{fmt:<9} {stats}")
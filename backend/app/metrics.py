@@ -0,0 +1,140 @@
+# app/metrics.py
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Iterator
+from .tracing import record_span
+
+# Recording is a lock + a couple of additions per event; METRICS=0 turns it into a no-op
+_ENABLED = os.environ.get("METRICS", "1").lower() not in ("0", "false", "no")
+
+# Seconds; spans sub-millisecond steps (aggregation, FAISS) up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label: str):
+        super().__init__(name, help_text, label)
+        self._values: Dict[str, float] = {}
+
+    def inc(self, label_value: str, n: float = 1.0) -> None:
+        if not _ENABLED:
+            return
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0.0) + n
+
+    def value(self, label_value: str) -> float:
+        return self._values.get(label_value, 0.0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted(self._values.items())
+        for lv, v in items:
+            lines.append(f'{self.name}{{{self.label}="{_escape(lv)}"}} {v:g}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label)
+        self.buckets = tuple(sorted(buckets))
+        # label value -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[str, list] = {}
+
+    def observe(self, label_value: str, seconds: float) -> None:
+        if not _ENABLED:
+            return
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            v = self._values.get(label_value)
+            if v is None:
+                v = self._values[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            v[0][i] += 1
+            v[1] += seconds
+            v[2] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted((lv, (list(v[0]), v[1], v[2])) for lv, v in self._values.items())
+        for lv, (counts, total, count) in items:
+            lab = f'{self.label}="{_escape(lv)}"'
+            acc = 0
+            for le, c in zip(self.buckets, counts):
+                acc += c
+                lines.append(f'{self.name}_bucket{{{lab},le="{le:g}"}} {acc}')
+            lines.append(f'{self.name}_bucket{{{lab},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{lab}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{lab}}} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "claimpilot_stage_duration_seconds",
+    "Duration of coding-pipeline stages (ocr_page, pdfminer, section_extraction, ner, encode, "
+    "faiss_search, aggregation, rerank, llm_call, llm_first_item, pdf_render).",
+    "stage",
+)
+CACHE_HITS = Counter("claimpilot_cache_hits_total", "Cache hits by cache name.", "cache")
+CACHE_MISSES = Counter("claimpilot_cache_misses_total", "Cache misses by cache name.", "cache")
+FALLBACKS = Counter("claimpilot_fallbacks_total", "Degraded results (e.g. _fallback_refine) by kind.", "kind")
+PROMPT_TOKENS = Counter("claimpilot_prompt_tokens_total", "LLM input tokens (local count) by call.", "call")
+HEDGES = Counter("claimpilot_llm_hedges_total", "Hedged LLM requests sent / won (answered first), as call:outcome.", "outcome")
+PIPELINE = Counter("claimpilot_pipeline_total", "Pipeline-mode outcomes (agree = refine skipped, refine, degraded).", "outcome")
+COALESCED = Counter("claimpilot_coalesced_requests_total", "Single-flight outcomes by endpoint:leader/joined/grace.", "outcome")
+LOAD_TRANSITIONS = Counter("claimpilot_load_mode_changes_total", "Load-controller mode changes by new mode.", "mode")
+RERANKS = Counter("claimpilot_rerank_total", "Cross-encoder re-ranking: pools reranked / LLM calls skipped / skipped_deadline.", "outcome")
+LLM_CODES = Counter("claimpilot_llm_codes_total", "LLM-returned codes checked against the code catalogue (valid / unknown / dropped).", "outcome")
+JSON_RETRIES = Counter("claimpilot_json_parse_retries_total", "Extra parse attempts/LLM re-asks for model JSON.", "call")
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record the duration of the enclosed block in STAGE_SECONDS and as a span
+    on the current request trace (Server-Timing / slow log)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, t0, time.perf_counter() - t0)
+
+
+def observe_stage(stage: str, start: float, seconds: float) -> None:
+    """Record a duration measured outside a `timed` block (e.g. time to first streamed item)."""
+    STAGE_SECONDS.observe(stage, seconds)
+    record_span(stage, start, seconds)
+
+
+def render_prometheus() -> str:
+    """All registered metrics in Prometheus text exposition format (0.0.4)."""
+    lines: List[str] = []
+    for m in _registry:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
@@ -1,5 +1,6 @@
 from typing import List, Dict
 import re
+from .metrics import timed
 
 _nlp = None
 
@@ -71,6 +72,11 @@ def extract_entities(text: str) -> List[Dict]:
     - Otherwise uses robust regex-based heuristics
     Returns [{text,label,start,end}]
     """
+    with timed("ner"):
+        return _extract_entities(text)
+
+
+def _extract_entities(text: str) -> List[Dict]:
     nlp = _init_nlp()
     ents: List[Dict] = []
     if nlp is not None:
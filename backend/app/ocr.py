@@ -1,24 +1,37 @@
 from typing import Optional
 import io
-from PIL import Image
-try:
-    import pytesseract
-except Exception:
-    pytesseract = None
+from .metrics import timed
+from .tracing import annotate
+
+
+# Heavy/optional OCR deps are imported on first use so app startup stays fast
+def _pytesseract():
+    try:
+        import pytesseract
+        return pytesseract
+    except Exception:
+        return None
+
 
 # Optional: use pdf2image to OCR scanned PDFs when text extraction fails
-try:
-    from pdf2image import convert_from_bytes  # type: ignore
-except Exception:
-    convert_from_bytes = None  # type: ignore
+def _convert_from_bytes():
+    try:
+        from pdf2image import convert_from_bytes  # type: ignore
+        return convert_from_bytes
+    except Exception:
+        return None
 
 
 def extract_text_from_image_bytes(image_bytes: bytes) -> str:
     """Return extracted text from image bytes. If pytesseract not installed, return empty string."""
+    pytesseract = _pytesseract()
     if not pytesseract:
         return ""  # fallback empty; pipeline should accept raw text input too
+    from PIL import Image
     img = Image.open(io.BytesIO(image_bytes))
-    text = pytesseract.image_to_string(img)
+    annotate(extraction="image_ocr", pages=1)
+    with timed("ocr_page"):
+        text = pytesseract.image_to_string(img)
     return text
 
 
@@ -37,19 +50,25 @@ def extract_text_from_pdf_bytes(pdf_bytes: bytes) -> str:
         with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
             f.write(pdf_bytes)
             path = f.name
-        text = extract_text(path) or ""
+        with timed("pdfminer"):
+            text = extract_text(path) or ""
     except Exception:
         text = ""
+    annotate(extraction="text_layer")
 
     # Fallback to OCR for scanned PDFs
+    pytesseract = _pytesseract()
+    convert_from_bytes = _convert_from_bytes()
     if (not text or len(text.strip()) < 20) and convert_from_bytes and pytesseract:
         try:
             # Render pages at a reasonable DPI for OCR quality/speed tradeoff
             pages = convert_from_bytes(pdf_bytes, dpi=200)
+            annotate(extraction="ocr", pages=len(pages))
             ocr_chunks = []
             for pg in pages:
                 try:
-                    ocr_chunks.append(pytesseract.image_to_string(pg))
+                    with timed("ocr_page"):
+                        ocr_chunks.append(pytesseract.image_to_string(pg))
                 except Exception:
                     continue
             text = "\n".join([t for t in ocr_chunks if t and t.strip()])
@@ -0,0 +1,178 @@
+# app/onnx_encoder.py
+"""ONNX Runtime encoder backend (int8 dynamic quantization) for embeddings.py.
+
+Export once, then select it with EMBED_BACKEND=onnx:
+  python -m app.onnx_encoder --export --out_dir data/encoder-onnx
+  python -m app.onnx_encoder --check --bench --out_dir data/encoder-onnx
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+from typing import List, Iterable, Dict
+
+try:
+    import onnxruntime as ort  # type: ignore
+except Exception:
+    ort = None  # type: ignore
+
+MODEL_FILE = "model-int8.onnx"
+CONFIG_FILE = "encoder_config.json"
+
+
+class OnnxEncoder:
+    """Drop-in for the subset of SentenceTransformer used by embeddings.py:
+    mean pooling over the transformer's last hidden state, optional L2 normalization."""
+
+    def __init__(self, model_dir: str, intra_op_threads: int = 0):
+        if ort is None:
+            raise RuntimeError("onnxruntime is not installed; pip install onnxruntime or use EMBED_BACKEND=torch")
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        opts = ort.SessionOptions()
+        if intra_op_threads > 0:
+            opts.intra_op_num_threads = intra_op_threads
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, self.config.get("model_file", MODEL_FILE)),
+            sess_options=opts,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = int(self.config.get("max_seq_length", 384))
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return int(self.config["dim"])
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np")
+        feeds = {k: np.asarray(v, dtype=np.int64) for k, v in enc.items() if k in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+        mask = np.asarray(enc["attention_mask"], dtype=np.float32)[..., None]
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences: Iterable[str], batch_size: int = 32, show_progress_bar: bool = False,
+               normalize_embeddings: bool = False, **_kw) -> np.ndarray:
+        texts = list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        # Length-sorted batches keep padding (and wasted FLOPs) low, as sentence-transformers does
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        out = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for i in range(0, len(texts), batch_size):
+            idx = order[i:i + batch_size]
+            out[idx] = self._encode_batch([texts[j] for j in idx])
+        if normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out
+
+
+def export_onnx(model_name: str, out_dir: str, opset: int = 14) -> str:
+    """Export the sentence-transformers transformer to ONNX and quantize weights to int8."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import quantize_dynamic, QuantType  # type: ignore
+
+    os.makedirs(out_dir, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    hf = st[0].auto_model.eval()
+    tok = st[0].tokenizer
+    sample = tok(["export sample text"], return_tensors="pt", padding=True)
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    fp32_path = os.path.join(out_dir, "model-fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            hf,
+            tuple(sample[n] for n in names),
+            fp32_path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={**{n: {0: "batch", 1: "seq"} for n in names}, "last_hidden_state": {0: "batch", 1: "seq"}},
+            opset_version=opset,
+        )
+    int8_path = os.path.join(out_dir, MODEL_FILE)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    tok.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, CONFIG_FILE), "w") as f:
+        json.dump({
+            "source_model": model_name,
+            "model_file": MODEL_FILE,
+            "dim": int(st.get_sentence_embedding_dimension()),
+            "max_seq_length": int(st.max_seq_length),
+        }, f)
+    return int8_path
+
+
+def _sample_texts(n: int) -> List[str]:
+    base = [
+        "MRI of the right knee without contrast showing a medial meniscal tear",
+        "Type 2 diabetes mellitus without complications",
+        "Office visit for an established patient, moderate complexity",
+        "Arthroscopy, knee, surgical; with meniscectomy (medial OR lateral)",
+        "Chest pain on exertion, rule out acute coronary syndrome",
+        "Therapeutic exercises to develop strength and range of motion",
+        "Patient presents with persistent cough and low grade fever for two weeks",
+        "Essential (primary) hypertension",
+    ]
+    return [f"{base[i % len(base)]} ({i})" for i in range(n)]
+
+
+def parity_check(onnx_enc: "OnnxEncoder", model_name: str, n: int = 64) -> Dict[str, float]:
+    """Cosine similarity between ONNX int8 and PyTorch embeddings for the same texts."""
+    from sentence_transformers import SentenceTransformer
+
+    texts = _sample_texts(n)
+    ref = SentenceTransformer(model_name, device="cpu").encode(texts, normalize_embeddings=True)
+    got = onnx_enc.encode(texts, normalize_embeddings=True)
+    cos = np.sum(np.asarray(ref, dtype=np.float32) * got, axis=1)
+    return {"min_cosine": float(cos.min()), "mean_cosine": float(cos.mean())}
+
+
+def benchmark(encoder, batch_sizes=(1, 8, 64), repeats: int = 5) -> List[Dict[str, float]]:
+    """Latency per call and throughput (texts/s) for each batch size."""
+    rows = []
+    for bs in batch_sizes:
+        texts = _sample_texts(bs)
+        encoder.encode(texts, batch_size=bs)  # warm-up
+        times = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            encoder.encode(texts, batch_size=bs)
+            times.append(time.perf_counter() - t0)
+        med = float(np.median(times))
+        rows.append({"batch_size": bs, "latency_ms": med * 1000.0, "texts_per_sec": bs / med})
+    return rows
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_name", default="all-mpnet-base-v2")
+    ap.add_argument("--out_dir", default=os.path.join("data", "encoder-onnx"))
+    ap.add_argument("--export", action="store_true", help="Export + int8-quantize the encoder")
+    ap.add_argument("--check", action="store_true", help="Cosine parity check against PyTorch")
+    ap.add_argument("--bench", action="store_true", help="Latency/throughput at batch sizes 1, 8, 64")
+    ap.add_argument("--min_cosine", type=float, default=0.98)
+    ap.add_argument("--threads", type=int, default=int(os.environ.get("ONNX_INTRA_OP_THREADS", "0")))
+    args = ap.parse_args()
+
+    if args.export:
+        print(f"exported: {export_onnx(args.model_name, args.out_dir)}")
+    status = 0
+    if args.check or args.bench:
+        enc = OnnxEncoder(args.out_dir, intra_op_threads=args.threads)
+    if args.check:
+        res = parity_check(enc, args.model_name)
+        ok = res["min_cosine"] >= args.min_cosine
+        print(f"parity: min_cosine={res['min_cosine']:.4f} mean_cosine={res['mean_cosine']:.4f} -> {'OK' if ok else 'FAIL'}")
+        status = 0 if ok else 1
+    if args.bench:
+        from sentence_transformers import SentenceTransformer
+        torch_enc = SentenceTransformer(args.model_name, device="cpu")
+        for name, e in (("torch", torch_enc), ("onnx-int8", enc)):
+            for row in benchmark(e):
+                print(f"{name:>9} bs={row['batch_size']:>3} latency={row['latency_ms']:.1f} ms throughput={row['texts_per_sec']:.1f} texts/s")
+    raise SystemExit(status)
@@ -1,9 +1,10 @@
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 import io
 
 
 def generate_claim_pdf(claim_id: str, approved_codes: list) -> bytes:
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
     buf = io.BytesIO()
     c = canvas.Canvas(buf, pagesize=letter)
     c.drawString(72, 720, f"Claim ID: {claim_id}")
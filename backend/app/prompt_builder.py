@@ -0,0 +1,171 @@
+# app/prompt_builder.py
+import os
+import re
+from typing import List, Dict, Any, Tuple, Optional
+
+# Default input budget for one LLM prompt, in tokens (PROMPT_TOKEN_BUDGET overrides)
+DEFAULT_TOKEN_BUDGET = 2500
+
+# Entity labels in the order they matter for coding; unknown labels rank before CLINICAL_TEXT
+# (whole header lines, mostly repeated in the clinical text itself)
+_LABEL_RANK = {"DIAGNOSIS": 0, "PROCEDURE": 1, "IMAGING": 2, "THERAPY": 3, "SYMPTOM": 4, "VISIT": 5, "CLINICAL_TEXT": 99}
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+_WS_RE = re.compile(r"\s+")
+
+# Lazy HF tokenizer (PROMPT_TOKENIZER); False = not configured / not loadable
+_tokenizer = None
+
+
+def _get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        name = os.environ.get("PROMPT_TOKENIZER", "")
+        _tokenizer = False
+        if name:
+            try:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(name)
+            except Exception:
+                _tokenizer = False
+    return _tokenizer or None
+
+
+def count_tokens(text: str) -> int:
+    """Local token count. Uses the HF tokenizer named by PROMPT_TOKENIZER when set;
+    otherwise a subword estimate (one token per word/punctuation mark, long words
+    one per ~4 characters), which tracks SentencePiece-style counts closely enough
+    for budgeting."""
+    if not text:
+        return 0
+    tok = _get_tokenizer()
+    if tok is not None:
+        return len(tok.encode(text, add_special_tokens=False))
+    n = 0
+    for m in _WORD_RE.finditer(text):
+        w = m.group()
+        n += 1 if len(w) <= 4 else (len(w) + 3) // 4
+    return n
+
+
+def token_budget() -> int:
+    try:
+        return max(256, int(os.environ.get("PROMPT_TOKEN_BUDGET", str(DEFAULT_TOKEN_BUDGET))))
+    except ValueError:
+        return DEFAULT_TOKEN_BUDGET
+
+
+def rank_entities(entities: List[Dict[str, Any]]) -> List[Tuple[str, str, int]]:
+    """Deduplicate entities by normalized text and drop ones contained in a longer
+    entity of the same label. Returns (label, text, mentions) ranked by label
+    importance, then mention count, then specificity (length)."""
+    merged: Dict[Tuple[str, str], List] = {}
+    for e in entities or []:
+        text = _WS_RE.sub(" ", str(e.get("text", ""))).strip()
+        if len(text) < 3:
+            continue
+        label = str(e.get("label", "")).upper() or "ENTITY"
+        key = (label, text.lower())
+        if key in merged:
+            merged[key][2] += 1
+        else:
+            merged[key] = [label, text, 1]
+    rows = list(merged.values())
+    kept = []
+    for label, text, n in rows:
+        low = text.lower()
+        if any(l2 == label and len(t2) > len(text) and low in t2.lower() for l2, t2, _ in rows):
+            continue
+        kept.append((label, text, n))
+    kept.sort(key=lambda r: (_LABEL_RANK.get(r[0], 50), -r[2], -len(r[1])))
+    return kept
+
+
+def _short(text: str, max_chars: int) -> str:
+    text = _WS_RE.sub(" ", str(text or "")).strip()
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[:cut if cut > 0 else max_chars] + "…"
+
+
+def _fit_lines(lines: List[str], budget: int, min_lines: int = 0) -> List[str]:
+    """Leading lines whose tokens (plus one per newline) fit `budget`; at least min_lines."""
+    out: List[str] = []
+    used = 0
+    for ln in lines:
+        cost = count_tokens(ln) + 1
+        if used + cost > budget and len(out) >= min_lines:
+            break
+        out.append(ln)
+        used += cost
+    return out
+
+
+def _fit_text(text: str, budget: int) -> Tuple[str, bool]:
+    """Longest prefix (cut at a word boundary) within `budget` tokens; (text, truncated)."""
+    text = str(text or "").strip()
+    if budget <= 0:
+        return "", bool(text)
+    if count_tokens(text) <= budget:
+        return text, False
+    cuts = [m.start() for m in _WS_RE.finditer(text)]
+    lo, hi = 0, len(cuts) - 1
+    best = 0
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if count_tokens(text[:cuts[mid]]) + 1 <= budget:
+            best = cuts[mid]
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return text[:best].rstrip() + " …", True
+
+
+def build_prompt(
+    template: str,
+    clinical_text: str,
+    entities: List[Dict[str, Any]],
+    candidates: Optional[List[Dict[str, Any]]] = None,
+    limit: int = 5,
+    budget: Optional[int] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """Fill `template` ({clinical_text}, {entities}, optional {candidates}, {limit}) within
+    a token budget. Candidates (the selection set) are fitted first as a compact
+    `code | system | description` table, best first; then ranked, deduplicated entities;
+    the clinical text gets whatever remains. Returns (prompt, stats)."""
+    budget = budget or token_budget()
+    remaining = budget - count_tokens(template.format(clinical_text="", entities="", candidates="", limit=limit))
+
+    cand_lines: List[str] = []
+    if candidates is not None:
+        rows, seen = [], set()
+        for c in candidates:
+            key = (str(c.get("code", "")), str(c.get("system", "")))
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append(f"{key[0]} | {key[1]} | {_short(c.get('description', ''), 90)}")
+        cand_lines = _fit_lines(rows, int(remaining * 0.45), min_lines=min(len(rows), limit))
+        remaining -= sum(count_tokens(ln) + 1 for ln in cand_lines)
+
+    ranked = rank_entities(entities)
+    ent_rows = [f"- {label}: {_short(text, 120)}" + (f" (x{n})" if n > 1 else "") for label, text, n in ranked]
+    ent_lines = _fit_lines(ent_rows, int(remaining * 0.3))
+    remaining -= sum(count_tokens(ln) + 1 for ln in ent_lines)
+
+    text, truncated = _fit_text(clinical_text, remaining)
+    prompt = template.format(
+        clinical_text=text,
+        entities="\n".join(ent_lines) or "(none)",
+        candidates="\n".join(cand_lines) or "(none)",
+        limit=limit,
+    )
+    stats = {
+        "prompt_tokens": count_tokens(prompt),
+        "budget": budget,
+        "entities": f"{len(ent_lines)}/{len(entities or [])}",
+        "candidates": f"{len(cand_lines)}/{len(candidates)}" if candidates is not None else None,
+        "text_truncated": truncated,
+    }
+    return prompt, stats
@@ -0,0 +1,119 @@
+# app/rerank.py
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from .config import env_float
+from .metrics import timed, CACHE_HITS, CACHE_MISSES, RERANKS
+from .tracing import annotate
+
+# Lazy, shared cross-encoder; False = not configured / failed to load
+_model: Any = None
+_model_lock = threading.Lock()
+
+
+def get_reranker() -> Optional[Any]:
+    """Cached sentence-transformers CrossEncoder named by RERANKER (e.g.
+    cross-encoder/ms-marco-MiniLM-L-6-v2), on CPU; None when unset or not loadable."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                name = os.environ.get("RERANKER", "")
+                _model = False
+                if name:
+                    try:
+                        from sentence_transformers import CrossEncoder
+                        _model = CrossEncoder(name, device="cpu", max_length=512)
+                    except Exception as e:
+                        print(f"[backend] reranker {name!r} unavailable: {type(e).__name__}: {e}")
+                        _model = False
+    return _model or None
+
+
+class _ScoreCache:
+    """LRU of cross-encoder scores keyed by (note hash, code, system)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(0, maxsize)
+        self._data: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[float]:
+        with self._lock:
+            v = self._data.get(key)
+            if v is not None:
+                self._data.move_to_end(key)
+        (CACHE_HITS if v is not None else CACHE_MISSES).inc("rerank")
+        return v
+
+    def put(self, key: Tuple[str, str, str], score: float) -> None:
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._data[key] = score
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+_cache = _ScoreCache(int(env_float("RERANK_CACHE_SIZE", 20000)))
+
+
+def rerank(text: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Score (note, "code description") pairs with the cross-encoder and return the
+    candidates sorted by that score (sigmoid, 0-1, in "score"; the retrieval score is
+    kept as "retrieval_score"). Uncached pairs go through one batched forward pass.
+    Returns the input unchanged when no reranker is configured."""
+    model = get_reranker()
+    if model is None or not candidates:
+        return candidates
+    # Cross-encoders read at most max_length tokens; the head of the note is what fits
+    note = " ".join(str(text or "").split())[: int(env_float("RERANK_MAX_CHARS", 2000))]
+    h = hashlib.sha1(note.encode("utf-8")).hexdigest()
+    keys = [(h, str(c.get("code", "")), str(c.get("system", ""))) for c in candidates]
+    scores = [_cache.get(k) for k in keys]
+    todo = [i for i, s in enumerate(scores) if s is None]
+    if todo:
+        pairs = [(note, f"{candidates[i].get('code', '')} {candidates[i].get('description', '')}") for i in todo]
+        with timed("rerank"):
+            logits = np.asarray(model.predict(pairs, batch_size=len(pairs), show_progress_bar=False), dtype=np.float32)
+        probs = 1.0 / (1.0 + np.exp(-logits.reshape(-1)))
+        for i, p in zip(todo, probs):
+            scores[i] = float(p)
+            _cache.put(keys[i], float(p))
+    out = [{**c, "retrieval_score": float(c.get("score", 0.0)), "score": s} for c, s in zip(candidates, scores)]
+    out.sort(key=lambda c: c["score"], reverse=True)
+    return out
+
+
+def rerank_pool(text: str, pool: List[Dict[str, Any]], top_k: int,
+                deadline: Optional[float] = None) -> Tuple[List[Dict[str, Any]], Optional[List[Dict[str, Any]]]]:
+    """Re-rank the LLM candidate pool and cut it to RERANK_KEEP (default 8) candidates
+    scoring at least RERANK_MIN_SCORE. Returns (pool, accepted): `accepted` is the final
+    top_k when every one of them scores >= RERANK_ACCEPT (unset/invalid = never), in which
+    case the LLM refine call can be skipped; otherwise None. Skipped (pool returned as is)
+    when less than RERANK_MIN_REMAINING_MS (default 2000) is left before `deadline`
+    (time.perf_counter() value), so the cross-encoder cannot eat the refine budget."""
+    if get_reranker() is None or not pool:
+        return pool, None
+    if deadline is not None and (deadline - time.perf_counter()) * 1000.0 < env_float("RERANK_MIN_REMAINING_MS", 2000.0):
+        RERANKS.inc("skipped_deadline")
+        return pool, None
+    ranked = rerank(text, pool)
+    keep = max(int(env_float("RERANK_KEEP", 8)), top_k)
+    min_score = env_float("RERANK_MIN_SCORE", 0.0)
+    cut = [c for c in ranked if c["score"] >= min_score][:keep] or ranked[:top_k]
+    RERANKS.inc("reranked")
+    annotate(reranked=len(cut))
+    accept = env_float("RERANK_ACCEPT", float("nan"))  # NaN: unset or malformed
+    if accept == accept:
+        top = cut[:max(1, top_k)]
+        if top and all(c["score"] >= accept for c in top):
+            RERANKS.inc("llm_skipped")
+            annotate(rerank_skipped_llm=True)
+            return cut, [{**c, "reason": "Selected by cross-encoder re-ranking against the clinical note."} for c in top]
+    return cut, None
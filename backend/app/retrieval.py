@@ -1,45 +1,387 @@
 # app/retrieval.py
 import os
+import re
+import json
+import threading
 import numpy as np
-import faiss
-from typing import List, Dict, Any
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple, Optional, Iterable
 from .embeddings import embed_texts
+from .metrics import timed, CACHE_HITS, CACHE_MISSES
+from .meta_store import load_meta, meta_exists, SYSTEM_IDS
+
+SYSTEMS = ("ICD-10", "CPT")
+
+def system_index_path(index_path: str, system: str) -> str:
+    """Per-system sub-index next to the main one, e.g. data/faiss.index -> data/faiss.icd10.index."""
+    root, ext = os.path.splitext(index_path)
+    slug = "".join(ch for ch in system.lower() if ch.isalnum())
+    return f"{root}.{slug}{ext or '.index'}"
+
+def projection_path(index_path: str) -> str:
+    """Dimension-reduction projection stored with the index, e.g. data/faiss.projection.npz."""
+    root, _ = os.path.splitext(index_path)
+    return f"{root}.projection.npz"
+
+def load_projection(index_path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """(mean (D,), matrix (D, d)) when the index was built reduced, else None."""
+    p = projection_path(index_path)
+    if not os.path.exists(p):
+        return None
+    with np.load(p) as z:
+        return z["mean"].astype(np.float32), z["matrix"].astype(np.float32)
+
+def apply_projection(x: np.ndarray, projection: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """Project full-dim embeddings to the index dimension and re-normalize (cosine == IP)."""
+    mean, matrix = projection
+    y = (np.asarray(x, dtype=np.float32) - mean) @ matrix
+    y /= np.clip(np.linalg.norm(y, axis=1, keepdims=True), 1e-12, None)
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+def index_stamp(index_path: str) -> Tuple[int, int]:
+    """(index mtime, manifest mtime) in ns; changes whenever build_index rewrites either."""
+    def _mtime(p: str) -> int:
+        try:
+            return os.stat(p).st_mtime_ns
+        except OSError:
+            return 0
+    return _mtime(index_path), _mtime(os.path.join(os.path.dirname(index_path) or ".", "manifest.json"))
+
+_WS_RE = re.compile(r"\s+")
+
+def normalize_query(text: str) -> str:
+    return _WS_RE.sub(" ", str(text or "")).strip()
+
+class SearchCache:
+    """Bounded LRU of search results: (normalized query, top_k, quotas) -> (scores, ids)
+    rows as small arrays. One per loaded index, so a rebuilt index starts empty.
+    SEARCH_CACHE_SIZE entries (default 4096, 0 disables); hits/misses are counted as
+    claimpilot_cache_{hits,misses}_total{cache="search"}."""
+
+    def __init__(self, maxsize: Optional[int] = None):
+        if maxsize is None:
+            try:
+                maxsize = int(os.environ.get("SEARCH_CACHE_SIZE", "4096"))
+            except ValueError:
+                maxsize = 4096
+        self.maxsize = max(0, maxsize)
+        self._data: "OrderedDict[tuple, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        if not self.maxsize:
+            return None
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        (CACHE_HITS if hit is not None else CACHE_MISSES).inc("search")
+        return hit
+
+    def put(self, key: tuple, scores: np.ndarray, ids: np.ndarray) -> None:
+        if not self.maxsize:
+            return
+        # Own copies (not views into the batch result), ids narrowed when they fit
+        ids = ids.astype(np.int32) if ids.size and ids.max() < 2 ** 31 else ids.copy()
+        with self._lock:
+            self._data[key] = (scores.astype(np.float32), ids)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else None}
+
+def _normalize_system(system: str) -> str:
+    return "CPT" if str(system or "").upper().startswith("CPT") else "ICD-10"
 
 class FaissIndexWrapper:
     def __init__(self, index_path: str, desc_path: str, meta_path: str):
         if not os.path.exists(index_path):
             raise FileNotFoundError(f"FAISS index not found: {index_path}")
-        if not os.path.exists(meta_path):
+        if not meta_exists(meta_path):
             raise FileNotFoundError(f"Meta file not found: {meta_path}")
 
+        import faiss  # deferred: only needed once retrieval is actually used
         self.index = faiss.read_index(index_path)
         # desc_path (embeddings) is optional at runtime; we don't need to load it to query
-        self.meta = np.load(meta_path, allow_pickle=True)  # array of tuples (code, system, description)
+        self.meta = load_meta(meta_path)  # columnar; self.meta[i] -> (code, system, description)
+        # Optional per-system sub-indexes (same global ids) written by build_index.py
+        self.sub_indexes: Dict[str, Any] = {}
+        for system in SYSTEMS:
+            p = system_index_path(index_path, system)
+            if os.path.exists(p):
+                self.sub_indexes[system] = faiss.read_index(p)
+        # Query-side projection when the index holds reduced-dimension vectors
+        self.projection = load_projection(index_path)
+        # Row id -> id of the first row with the same (code, system); built on first use
+        self._key_ids: Optional[np.ndarray] = None
+        # Files this wrapper was loaded from (get_index reloads when they change)
+        self.stamp = index_stamp(index_path)
+        try:
+            with open(os.path.join(os.path.dirname(index_path) or ".", "manifest.json")) as f:
+                self.generation = json.load(f).get("generation")
+        except Exception:
+            self.generation = None
+        self.cache = SearchCache()
 
-    def search(self, query_embeddings: np.ndarray, top_k: int = 5) -> List[Dict[str, Any]]:
-        """
-        query_embeddings: np.ndarray of shape (B, D), normalized float32
-        returns flattened list of candidates across batch:
-        [{code, system, description, score}, ...]
-        """
+    def key_ids(self) -> np.ndarray:
+        """Canonical row id per row, so duplicate (code, system) rows dedupe as one id."""
+        if self._key_ids is None:
+            first: Dict[Tuple[str, str], int] = {}
+            keys = np.empty(len(self.meta), dtype=np.int64)
+            for i, key in enumerate(self.meta.iter_code_system()):
+                keys[i] = first.setdefault(key, i)
+            self._key_ids = keys
+        return self._key_ids
+
+    def rows(self, ids, scores) -> List[Dict[str, Any]]:
+        """Materialize meta rows for FAISS/lexical ids (negative ids are skipped)."""
+        out: List[Dict[str, Any]] = []
+        for score, idx in zip(scores, ids):
+            if idx < 0:
+                # fewer than top_k live vectors in the index
+                continue
+            code, system, desc = self.meta[idx]
+            out.append({
+                "code": str(code),
+                "system": str(system),
+                "description": str(desc),
+                "score": float(score)
+            })
+        return out
+
+    def _search_system(self, q: np.ndarray, system: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k within one system. Uses its sub-index when present (scan cost proportional
+        to that system's size); otherwise over-fetches from the main index and filters,
+        doubling the fetch until every query row has k matches (or the whole index was
+        searched), so a quota for the smaller system is still filled."""
+        sub = self.sub_indexes.get(system)
+        if sub is not None:
+            return sub.search(q, k)
+        ntotal = int(self.index.ntotal)
+        # Never more matches than the system has rows
+        need = min(k, int(np.count_nonzero(self.meta.system_ids == SYSTEM_IDS[system])))
+        k_fetch = min(ntotal, max(k * 8, k))
+        while True:
+            D, I = self.index.search(q, k_fetch)
+            match = (I >= 0) & (self.meta.system_ids[np.maximum(I, 0)] == SYSTEM_IDS[system])
+            if k_fetch >= ntotal or match.sum(axis=1).min(initial=need) >= need:
+                break
+            k_fetch = min(ntotal, k_fetch * 4)
+        outD = np.full((len(q), k), -np.inf, dtype=np.float32)
+        outI = np.full((len(q), k), -1, dtype=np.int64)
+        for r in range(len(q)):
+            keep = np.flatnonzero(match[r])[:k]
+            outD[r, :len(keep)] = D[r, keep]
+            outI[r, :len(keep)] = I[r, keep]
+        return outD, outI
+
+    def search_ids(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        systems: Optional[Iterable[str]] = None,
+        quotas: Optional[Dict[str, int]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Like search_batches, but returns the raw (scores, ids) arrays of shape (B, k),
+        ranked per row; ids of -1 pad rows with fewer hits. No metadata is touched."""
         if not isinstance(query_embeddings, np.ndarray):
             query_embeddings = np.asarray(query_embeddings, dtype="float32")
         if query_embeddings.ndim == 1:
             query_embeddings = query_embeddings.reshape(1, -1)
+        if self.projection is not None and query_embeddings.shape[1] != self.index.d:
+            query_embeddings = apply_projection(query_embeddings, self.projection)
+
+        if not systems and not quotas:
+            with timed("faiss_search"):
+                return self.index.search(query_embeddings, top_k)
+
+        # Per-system searches, merged by score. With quotas each system contributes
+        # exactly its k (a guaranteed mix); otherwise the best top_k across `systems`.
+        if quotas:
+            plan = {_normalize_system(s): int(k) for s, k in quotas.items() if int(k) > 0}
+        else:
+            plan = {_normalize_system(s): top_k for s in systems}
+        with timed("faiss_search"):
+            parts = [self._search_system(query_embeddings, s, k) for s, k in plan.items()]
+        D = np.concatenate([p[0] for p in parts], axis=1)
+        I = np.concatenate([p[1] for p in parts], axis=1)
+        order = np.argsort(-D, axis=1, kind="stable")
+        if not quotas:
+            order = order[:, :top_k]
+        return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
 
-        D, I = self.index.search(query_embeddings, top_k)
+    def search_batches(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        systems: Optional[Iterable[str]] = None,
+        quotas: Optional[Dict[str, int]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Like search, but keeps one ranked candidate list per query row."""
+        D, I = self.search_ids(query_embeddings, top_k=top_k, systems=systems, quotas=quotas)
+        return [self.rows(row_ids, row_scores) for row_scores, row_ids in zip(D, I)]
+
+    def search_texts(
+        self,
+        texts: List[str],
+        top_k: int = 5,
+        quotas: Optional[Dict[str, int]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """search_ids for raw query texts, one row per text, through the search cache:
+        only texts not cached are encoded (in one batch) and searched."""
+        quota_key = tuple(sorted(quotas.items())) if quotas else None
+        keys = [(normalize_query(t), int(top_k), quota_key) for t in texts]
+        rows: List[Optional[Tuple[np.ndarray, np.ndarray]]] = [self.cache.get(k) for k in keys]
+        todo = [i for i, r in enumerate(rows) if r is None]
+        if todo:
+            D, I = self.search_ids(embed_texts([keys[i][0] for i in todo]), top_k=top_k, quotas=quotas)
+            for j, i in enumerate(todo):
+                rows[i] = (D[j], I[j])
+                self.cache.put(keys[i], D[j], I[j])
+        if not rows:
+            return np.empty((0, 0), dtype=np.float32), np.empty((0, 0), dtype=np.int64)
+        return np.stack([r[0] for r in rows]), np.stack([r[1] for r in rows]).astype(np.int64)
+
+    def aggregate(self, scores: np.ndarray, ids: np.ndarray, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Hits from any number of queries -> candidates deduplicated by (code, system),
+        keeping each one's max score, best first. Dedupe and top-k run on the arrays;
+        only the returned rows are materialized."""
+        ids, scores = top_unique(self.key_ids(), ids, scores, top_k)
+        return self.rows(ids, scores)
+
+    def search(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        systems: Optional[Iterable[str]] = None,
+        quotas: Optional[Dict[str, int]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        query_embeddings: np.ndarray of shape (B, D), normalized float32
+        systems: optional filter, e.g. ["CPT"]; quotas: optional per-system k,
+        e.g. {"ICD-10": 6, "CPT": 4} (overrides top_k)
+        returns flattened list of candidates across batch:
+        [{code, system, description, score}, ...]
+        """
         out: List[Dict[str, Any]] = []
-        for row_scores, row_ids in zip(D, I):
-            for score, idx in zip(row_scores, row_ids):
-                code, system, desc = self.meta[idx]
-                out.append({
-                    "code": str(code),
-                    "system": str(system),
-                    "description": str(desc),
-                    "score": float(score)
-                })
+        for hits in self.search_batches(query_embeddings, top_k=top_k, systems=systems, quotas=quotas):
+            out.extend(hits)
         return out
 
+def top_unique(key_ids: np.ndarray, ids: np.ndarray, scores: np.ndarray,
+               top_k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Flatten (ids, scores), map ids through key_ids, keep the max score per key and
+    return the top_k (all when None) as (ids, scores) sorted by descending score."""
+    ids = np.asarray(ids).ravel()
+    scores = np.asarray(scores, dtype=np.float32).ravel()
+    live = ids >= 0
+    ids, scores = key_ids[ids[live]], scores[live]
+    if ids.size == 0:
+        return ids, scores
+    # Sort by (id, -score): the first entry of each id run is its max
+    order = np.lexsort((-scores, ids))
+    ids, scores = ids[order], scores[order]
+    first = np.ones(ids.size, dtype=bool)
+    first[1:] = ids[1:] != ids[:-1]
+    ids, scores = ids[first], scores[first]
+    if top_k is not None and 0 < top_k < ids.size:
+        part = np.argpartition(-scores, top_k - 1)[:top_k]
+        ids, scores = ids[part], scores[part]
+    order = np.argsort(-scores, kind="stable")
+    return ids[order], scores[order]
+
+# Lazy, shared wrappers keyed by index path (loaded once per process, e.g. at warm-up)
+_wrappers: Dict[str, FaissIndexWrapper] = {}
+# One load at a time per index path; stamp of the last failed reload per path
+_load_locks: Dict[str, threading.Lock] = {}
+_load_locks_guard = threading.Lock()
+_failed_stamps: Dict[str, Tuple[int, int]] = {}
+
+def _load_lock(index_path: str) -> threading.Lock:
+    with _load_locks_guard:
+        return _load_locks.setdefault(index_path, threading.Lock())
+
+def get_index(
+    index_path: str = "data/faiss.index",
+    desc_path: str = "data/descriptions.npy",
+    meta_path: str = "data/meta.npy",
+) -> FaissIndexWrapper:
+    """Returns a cached FaissIndexWrapper (raises FileNotFoundError if files are missing).
+    Reloaded (with an empty search cache) when the index or its manifest changed on disk.
+    Only one thread loads; requests arriving meanwhile keep using the loaded wrapper.
+    If the reload fails, e.g. mid-rebuild, the loaded one keeps serving and the reload is
+    not retried until the files change again."""
+    idx = _wrappers.get(index_path)
+    if idx is not None:
+        stamp = index_stamp(index_path)
+        if stamp == idx.stamp or stamp == _failed_stamps.get(index_path):
+            return idx
+        lock = _load_lock(index_path)
+        if not lock.acquire(blocking=False):
+            return idx  # another request is reloading
+        try:
+            idx = _wrappers[index_path]
+            if idx.stamp != stamp:
+                try:
+                    idx = _wrappers[index_path] = FaissIndexWrapper(index_path=index_path, desc_path=desc_path, meta_path=meta_path)
+                    _failed_stamps.pop(index_path, None)
+                except Exception:
+                    _failed_stamps[index_path] = stamp
+        finally:
+            lock.release()
+        return idx
+    with _load_lock(index_path):
+        idx = _wrappers.get(index_path)
+        if idx is None:
+            idx = _wrappers[index_path] = FaissIndexWrapper(index_path=index_path, desc_path=desc_path, meta_path=meta_path)
+        return idx
+
+def search_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Search-cache size and hit ratio per loaded index (for /config)."""
+    return {path: {"generation": w.generation, **w.cache.stats()} for path, w in _wrappers.items()}
+
+def parse_quotas(spec: str) -> Optional[Dict[str, int]]:
+    """Parse 'ICD-10:6,CPT:4' into {'ICD-10': 6, 'CPT': 4}; empty/invalid -> None."""
+    out: Dict[str, int] = {}
+    for part in (spec or "").split(","):
+        name, _, k = part.partition(":")
+        try:
+            if name.strip() and int(k) > 0:
+                out[_normalize_system(name.strip())] = int(k)
+        except ValueError:
+            continue
+    return out or None
+
+def reciprocal_rank_fusion(ranked_lists: List[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
+    """
+    Merge ranked candidate lists (dense and/or lexical) by reciprocal rank fusion:
+    rrf(c) = sum over lists of 1 / (k + rank). Candidates are keyed by (code, system).
+    Returned scores are rrf normalized so the best candidate scores 1.0.
+    """
+    fused: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for hits in ranked_lists:
+        seen = set()
+        for rank, c in enumerate(hits, start=1):
+            key = (str(c.get("code", "")), str(c.get("system", "")))
+            if key in seen:
+                continue
+            seen.add(key)
+            if key not in fused:
+                fused[key] = {"code": key[0], "system": key[1], "description": str(c.get("description", "")), "rrf": 0.0}
+            fused[key]["rrf"] += 1.0 / (k + rank)
+    out = sorted(fused.values(), key=lambda x: x["rrf"], reverse=True)
+    top = out[0]["rrf"] if out else 1.0
+    return [{"code": c["code"], "system": c["system"], "description": c["description"], "score": c["rrf"] / top} for c in out]
+
 def search_text(index_path: str, meta_path: str, text: str, top_k: int = 5):
     """Utility: embed a raw text and search."""
     q = embed_texts([text])  # normalized (1,D)
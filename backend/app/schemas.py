@@ -29,6 +29,8 @@ class SuggestRequest(BaseModel):
 class SuggestResponse(BaseModel):
     entities: List[Entity]
     suggestions: List[CodeSuggestion]
+    # Pipeline details (mode, per-stage timings); never contains PHI
+    metadata: Optional[dict] = None
 
 
 class ClaimRequest(BaseModel):
@@ -59,3 +61,9 @@ class CMS1500Request(BaseModel):
     referring_npi: Optional[str] = None
     # Optional diagnosis pointers per procedure row (indices starting at 1)
     diag_pointers: Optional[List[List[int]]] = None
+
+
+class CMS1500BulkRequest(BaseModel):
+    forms: List[CMS1500Request]
+    # 'zip' (one PDF per form + report.json) or 'pdf' (single concatenated PDF)
+    format: str = "zip"
@@ -0,0 +1,83 @@
+# app/singleflight.py
+import os
+import re
+import json
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from .metrics import COALESCED
+from .tracing import annotate
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace-insensitive form of a request's clinical text (for coalescing keys)."""
+    return _WS_RE.sub(" ", str(text or "")).strip()
+
+
+def request_key(*parts: Any) -> str:
+    """Stable hash of the parts that determine a response (normalized body, mode, ...)."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _enabled() -> bool:
+    return os.environ.get("SINGLEFLIGHT", "1").lower() not in ("0", "false", "no")
+
+
+def _grace_seconds() -> float:
+    try:
+        return max(0.0, float(os.environ.get("SINGLEFLIGHT_GRACE_MS", "2000")) / 1000.0)
+    except ValueError:
+        return 2.0
+
+
+class SingleFlight:
+    """Coalesce identical in-flight requests (per process).
+
+    The first caller for a key runs `fn`; callers arriving while it runs await the same
+    result, and so do callers within SINGLEFLIGHT_GRACE_MS after it finished (retries,
+    double-clicks). Errors are shared with the waiting callers but never kept for the
+    grace window. The computation runs as its own task, so a leader whose client
+    disconnects does not cancel it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # key -> (task, finished)
+        self._flights: Dict[str, Tuple[asyncio.Task, bool]] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not _enabled():
+            return await fn()
+        entry = self._flights.get(key)
+        if entry is None:
+            outcome = "leader"
+            task = asyncio.ensure_future(fn())
+            self._flights[key] = (task, False)
+            task.add_done_callback(lambda t, k=key: self._finished(k, t))
+        else:
+            task, finished = entry
+            outcome = "grace" if finished else "joined"
+        COALESCED.inc(f"{self.name}:{outcome}")
+        annotate(coalesced=outcome)
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._flights.get(key, (None,))[0] is not task:
+            return
+        grace = _grace_seconds()
+        if task.cancelled() or task.exception() is not None or grace <= 0:
+            self._flights.pop(key, None)
+            return
+        self._flights[key] = (task, True)
+        asyncio.get_running_loop().call_later(grace, self._expire, key, task)
+
+    def _expire(self, key: str, task: asyncio.Task) -> None:
+        if self._flights.get(key, (None,))[0] is task:
+            self._flights.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._flights)
@@ -0,0 +1,118 @@
+# app/tracing.py
+import os
+import json
+import time
+import threading
+from contextvars import ContextVar
+from typing import List, Dict, Tuple, Optional, Union
+
+# Per-request trace shared by the endpoint and the threads it spawns (contextvars are
+# copied into asyncio.to_thread / threadpool calls; the trace object itself is shared).
+_current: ContextVar[Optional["RequestTrace"]] = ContextVar("claimpilot_trace", default=None)
+_log_lock = threading.Lock()
+
+# Only sizes/counters and enum-like mode flags are recorded: never text, entities or patient fields
+Scalar = Union[int, float, bool, str]
+_MAX_STR = 32
+
+
+class RequestTrace:
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.t0 = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []  # (stage, start_ms, dur_ms)
+        self.sizes: Dict[str, float] = {}
+        self.mode: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, stage: str, start: float, seconds: float) -> None:
+        with self._lock:
+            self.spans.append((stage, (start - self.t0) * 1000.0, seconds * 1000.0))
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000.0
+
+    def stage_totals(self) -> Dict[str, Tuple[float, int]]:
+        """stage -> (total ms, count), in first-seen order."""
+        out: Dict[str, Tuple[float, int]] = {}
+        with self._lock:
+            for stage, _, dur in self.spans:
+                tot, n = out.get(stage, (0.0, 0))
+                out[stage] = (tot + dur, n + 1)
+        return out
+
+
+def start_trace(request_id: str) -> RequestTrace:
+    trace = RequestTrace(request_id)
+    _current.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+def record_span(stage: str, start: float, seconds: float) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.add_span(stage, start, seconds)
+
+
+def annotate(**fields: Scalar) -> None:
+    """Set mode flags (short strings/bools) or sizes (numbers) on the current request trace."""
+    trace = _current.get()
+    if trace is None:
+        return
+    for k, v in fields.items():
+        if isinstance(v, str):
+            trace.mode[k] = v[:_MAX_STR]
+        elif isinstance(v, bool):
+            trace.mode[k] = "true" if v else "false"
+        elif isinstance(v, (int, float)):
+            trace.sizes[k] = v
+
+
+def add_size(key: str, n: float) -> None:
+    """Accumulate a size counter on the current trace (e.g. prompt_chars over several LLM calls)."""
+    trace = _current.get()
+    if trace is not None:
+        with trace._lock:
+            trace.sizes[key] = trace.sizes.get(key, 0) + n
+
+
+def server_timing_header(trace: RequestTrace, total_ms: float) -> str:
+    parts = []
+    for stage, (ms, n) in trace.stage_totals().items():
+        desc = f';desc="x{n}"' if n > 1 else ""
+        parts.append(f"{stage};dur={ms:.1f}{desc}")
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+def slow_threshold_ms() -> float:
+    try:
+        return float(os.environ.get("SLOW_REQUEST_MS", "2000"))
+    except ValueError:
+        return 2000.0
+
+
+def write_slow_log(trace: RequestTrace, method: str, path: str, status: int, total_ms: float) -> None:
+    """Append one JSON line per slow request to SLOW_LOG_PATH (default data/slow_requests.jsonl)."""
+    entry = {
+        "ts": int(time.time()),
+        "request_id": trace.request_id,
+        "method": method,
+        "path": path,  # route path only; query strings are not logged
+        "status": status,
+        "total_ms": round(total_ms, 1),
+        "spans": [{"stage": s, "start_ms": round(st, 1), "dur_ms": round(d, 1)} for s, st, d in list(trace.spans)],
+        "sizes": dict(trace.sizes),
+        "mode": dict(trace.mode),
+    }
+    path_out = os.environ.get("SLOW_LOG_PATH", os.path.join("data", "slow_requests.jsonl"))
+    try:
+        os.makedirs(os.path.dirname(path_out) or ".", exist_ok=True)
+        with _log_lock, open(path_out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    except Exception:
+        pass
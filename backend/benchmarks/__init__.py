@@ -0,0 +1 @@
+# package marker for the offline benchmark/load-test tools
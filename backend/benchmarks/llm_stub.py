@@ -0,0 +1,215 @@
+# benchmarks/llm_stub.py
+"""Local stand-in for the Gemini generate_content / generate_content_stream REST
+endpoints (no network, no key).
+
+Point the backend at it with GEMINI_BASE_URL=http://127.0.0.1:<port> and any GEMINI_API_KEY.
+Latency, error rate and malformed-output rate are configurable so load tests can
+reproduce slow, flaky or badly formatted model responses:
+
+  python -m benchmarks.llm_stub --port 8089 --latency lognormal:800,0.5 --error_rate 0.02 --malformed_rate 0.1
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+from benchmarks.synthetic import SAMPLE_CODES
+
+# Candidate rows in the refine prompt: "code | system | description"
+_CODE_RE = re.compile(r"^([A-Z0-9][A-Z0-9.~-]*) \| (ICD-10|CPT) \| (.*)$", re.MULTILINE)
+_ERRORS = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE"}
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Latency distribution in ms -> sampler returning seconds.
+    fixed:MS | uniform:LO,HI | normal:MEAN,SD | lognormal:MEDIAN,SIGMA"""
+    kind, _, args = spec.partition(":")
+    vals = [float(v) for v in args.split(",") if v.strip()] if args else []
+    kind = kind.strip().lower()
+    if kind == "fixed" and len(vals) == 1:
+        return lambda rnd: vals[0] / 1000.0
+    if kind == "uniform" and len(vals) == 2:
+        return lambda rnd: rnd.uniform(vals[0], vals[1]) / 1000.0
+    if kind == "normal" and len(vals) == 2:
+        return lambda rnd: max(0.0, rnd.gauss(vals[0], vals[1])) / 1000.0
+    if kind == "lognormal" and len(vals) == 2:
+        import math
+        mu = math.log(max(vals[0], 1e-3))
+        return lambda rnd: rnd.lognormvariate(mu, vals[1]) / 1000.0
+    raise ValueError(f"bad latency spec: {spec!r} (fixed:MS, uniform:LO,HI, normal:MEAN,SD, lognormal:MEDIAN,SIGMA)")
+
+
+class StubConfig:
+    def __init__(self, latency: str = "lognormal:600,0.4", error_rate: float = 0.0,
+                 malformed_rate: float = 0.0, error_statuses: Tuple[int, ...] = (429, 500, 503),
+                 seed: int = 0, stream_chunk_chars: int = 48, stream_interval_ms: float = 30.0):
+        self.latency = parse_latency(latency)
+        self.latency_spec = latency
+        self.error_rate = float(error_rate)
+        self.malformed_rate = float(malformed_rate)
+        self.error_statuses = tuple(error_statuses)
+        self.rnd = random.Random(seed)
+        # streamGenerateContent: text is sent in chunks of this size, this far apart
+        self.stream_chunk_chars = int(stream_chunk_chars)
+        self.stream_interval = float(stream_interval_ms) / 1000.0
+        self.lock = threading.Lock()
+        self.stats: Dict[str, int] = {"requests": 0, "errors": 0, "malformed": 0}
+
+    def draw(self) -> Tuple[float, Optional[int], Optional[str]]:
+        """(delay seconds, error status or None, malformed kind or None) for one request."""
+        with self.lock:
+            self.stats["requests"] += 1
+            delay = self.latency(self.rnd)
+            if self.rnd.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return delay, self.rnd.choice(self.error_statuses), None
+            if self.rnd.random() < self.malformed_rate:
+                self.stats["malformed"] += 1
+                return delay, None, self.rnd.choice(("prose", "fenced", "truncated", "not_json"))
+            return delay, None, None
+
+
+def _prompt_text(body: Dict) -> str:
+    parts = []
+    for content in body.get("contents") or []:
+        if isinstance(content, dict):
+            for part in content.get("parts") or []:
+                if isinstance(part, dict) and part.get("text"):
+                    parts.append(part["text"])
+        elif isinstance(content, str):
+            parts.append(content)
+    return "\n".join(parts)
+
+
+def model_output(prompt: str, rnd: random.Random, malformed: Optional[str] = None) -> str:
+    """A JSON array of codes: picked from the prompt's Candidates when present (refine),
+    otherwise from SAMPLE_CODES (direct generation); optionally mangled."""
+    pool = [(c, s, d) for c, s, d in _CODE_RE.findall(prompt)] or list(SAMPLE_CODES)
+    picked = rnd.sample(pool, k=min(len(pool), rnd.randint(3, 6)))
+    items = [
+        {"code": c, "system": s, "description": d, "score": round(0.95 - 0.1 * i, 2),
+         "reason": "Supported by the clinical text."}
+        for i, (c, s, d) in enumerate(picked)
+    ]
+    text = json.dumps(items)
+    if malformed == "prose":
+        return f"Sure! Based on the note, these codes apply:\n{text}\nLet me know if you need anything else."
+    if malformed == "fenced":
+        return f"```json\n{text}\n```"
+    if malformed == "truncated":
+        return text[: max(1, int(len(text) * rnd.uniform(0.3, 0.9)))]
+    if malformed == "not_json":
+        return "I'm unable to determine the codes for this note."
+    return text
+
+
+def _response_body(text: str) -> Dict:
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": 0, "candidatesTokenCount": len(text) // 4},
+    }
+
+
+def make_handler(cfg: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):  # keep load-test output clean
+            pass
+
+        def _send_json(self, status: int, payload: Dict) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                with cfg.lock:
+                    self._send_json(200, dict(cfg.stats))
+                return
+            self._send_json(404, {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b"{}"
+            stream = ":streamGenerateContent" in self.path
+            if not stream and ":generateContent" not in self.path:
+                self._send_json(404, {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}})
+                return
+            try:
+                body = json.loads(raw or b"{}")
+            except Exception:
+                self._send_json(400, {"error": {"code": 400, "message": "invalid JSON", "status": "INVALID_ARGUMENT"}})
+                return
+            delay, status, malformed = cfg.draw()
+            time.sleep(delay)
+            if status is not None:
+                self._send_json(status, {"error": {"code": status, "message": "stub error", "status": _ERRORS.get(status, "UNKNOWN")}})
+                return
+            with cfg.lock:
+                seed = cfg.rnd.random()
+            text = model_output(_prompt_text(body), random.Random(seed), malformed)
+            if stream:
+                self._send_stream(text)
+            else:
+                self._send_json(200, _response_body(text))
+
+        def _send_stream(self, text: str) -> None:
+            """SSE chunks (alt=sse) of ~stream_chunk_chars each; the sampled latency
+            was spent before the first chunk, and chunks follow every stream_interval_ms."""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            step = max(1, cfg.stream_chunk_chars)
+            try:
+                for i in range(0, len(text), step):
+                    if i:
+                        time.sleep(cfg.stream_interval)
+                    self.wfile.write(b"data: " + json.dumps(_response_body(text[i:i + step])).encode("utf-8") + b"\r\n\r\n")
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # client stopped reading early (enough items)
+
+    return Handler
+
+
+def start_stub(cfg: StubConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Serve in a daemon thread; the bound port is server.server_address[1]. Stop with server.shutdown()."""
+    server = ThreadingHTTPServer((host, port), make_handler(cfg))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Local Gemini generate_content stub")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", default="lognormal:600,0.4", help="fixed:MS | uniform:LO,HI | normal:MEAN,SD | lognormal:MEDIAN,SIGMA")
+    ap.add_argument("--error_rate", type=float, default=0.0)
+    ap.add_argument("--error_statuses", default="429,500,503")
+    ap.add_argument("--malformed_rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--stream_chunk_chars", type=int, default=48)
+    ap.add_argument("--stream_interval_ms", type=float, default=30.0)
+    args = ap.parse_args()
+
+    cfg = StubConfig(args.latency, args.error_rate, args.malformed_rate,
+                     tuple(int(s) for s in args.error_statuses.split(",") if s.strip()), args.seed,
+                     args.stream_chunk_chars, args.stream_interval_ms)
+    srv = ThreadingHTTPServer((args.host, args.port), make_handler(cfg))
+    print(f"LLM stub on http://{args.host}:{args.port} (GEMINI_BASE_URL); latency={args.latency} "
+          f"error_rate={args.error_rate} malformed_rate={args.malformed_rate}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,259 @@
+# benchmarks/loadtest.py
+"""End-to-end load test on one machine: uvicorn backend + local Gemini stub, no network.
+
+For every (workers, concurrency) point of the sweep it starts `uvicorn app.main:app`
+with that many worker processes, drives a weighted mix of /upload, /suggest,
+/generate_claim and /cms1500 from `concurrency` concurrent clients for --duration
+seconds, and reports per-endpoint throughput, error rate and p50/p95/p99 latency.
+
+The payload set is small (16 notes, 4 PDFs), so under concurrency many requests are
+identical: by default the server runs with SINGLEFLIGHT=0 and LOAD_CONTROL=0, so every
+request is computed in full and none is shed. --singleflight / --load_control turn them
+back on; coalesced (X-Coalesced: joined/grace) and shed (503) responses are then counted
+separately from errors.
+
+Run from backend/:
+  python -m benchmarks.loadtest --workers 1,2,4 --concurrency 1,8,32 --duration 20 \
+      --llm_latency lognormal:800,0.5 --llm_error_rate 0.02 --llm_malformed_rate 0.05 --out loadtest.json
+
+The server runs in a scratch directory (its data/ holds only what --data_dir provides),
+so claim audit lines and slow logs from the run do not land in backend/data.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from typing import Dict, List, Tuple
+
+import httpx
+
+from benchmarks import synthetic
+from benchmarks.llm_stub import StubConfig, start_stub
+
+ENDPOINTS = ("suggest", "upload", "generate_claim", "cms1500")
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _parse_mix(spec: str) -> List[str]:
+    """'suggest=4,upload=2' -> weighted round-robin schedule of endpoint names."""
+    schedule: List[str] = []
+    for part in spec.split(","):
+        name, _, w = part.strip().partition("=")
+        if not name:
+            continue
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint in --mix: {name} (choose from {', '.join(ENDPOINTS)})")
+        schedule.extend([name] * max(1, int(w or 1)))
+    return schedule
+
+
+class Payloads:
+    """Pre-built request bodies so the client spends its time waiting, not serializing PDFs."""
+
+    def __init__(self, n_notes: int = 16):
+        self.notes = [synthetic.clinical_note(seed=i, paragraphs=3) for i in range(n_notes)]
+        self.pdfs = [synthetic.note_pdf(n) for n in self.notes[:4]]
+        approved = [{"code": c, "system": s, "description": d, "score": 0.9, "reason": "load test"}
+                    for c, s, d in synthetic.SAMPLE_CODES[:6]]
+        self.claim = {"approved": approved, "patient_id": "P100000", "amount": 125.0, "signed_by": "loadtest"}
+        self.cms1500 = {"approved": approved, "text": self.notes[0]}
+
+    def request(self, endpoint: str, i: int) -> Dict:
+        if endpoint == "suggest":
+            return {"url": "/suggest", "json": {"text": self.notes[i % len(self.notes)], "top_k": 5}}
+        if endpoint == "upload":
+            pdf = self.pdfs[i % len(self.pdfs)]
+            return {"url": "/upload", "files": {"file": ("note.pdf", pdf, "application/pdf")},
+                    "data": {"clinical_only": "true"}}
+        if endpoint == "generate_claim":
+            return {"url": "/generate_claim", "json": self.claim}
+        return {"url": "/cms1500", "json": self.cms1500}
+
+
+def start_server(workers: int, port: int, stub_url: str, mode: str, data_dir: str, workdir: str,
+                 singleflight: bool = False, load_control: bool = False) -> subprocess.Popen:
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    if data_dir:
+        for name in os.listdir(data_dir):
+            dst = os.path.join(workdir, "data", name)
+            if not os.path.exists(dst):
+                os.symlink(os.path.abspath(os.path.join(data_dir, name)), dst)
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(p for p in (_BACKEND_DIR, env.get("PYTHONPATH", "")) if p),
+        "GEMINI_BASE_URL": stub_url,
+        "GEMINI_API_KEY": "stub-key",
+        "SUGGEST_MODE": mode,
+        "SINGLEFLIGHT": "1" if singleflight else "0",
+        "LOAD_CONTROL": "1" if load_control else "0",
+        "SLOW_LOG_PATH": os.path.join(workdir, "slow_requests.jsonl"),
+        "HF_HUB_OFFLINE": "1",
+        "TRANSFORMERS_OFFLINE": "1",
+    })
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+           "--workers", str(workers), "--log-level", "warning", "--no-access-log"]
+    return subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def wait_ready(base_url: str, proc: subprocess.Popen, timeout: float = 180.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            err = proc.stderr.read().decode("utf-8", "replace") if proc.stderr else ""
+            raise RuntimeError(f"server exited with {proc.returncode}: {err[-2000:]}")
+        try:
+            if httpx.get(base_url + "/ready", timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError("server did not become ready in time")
+
+
+def stop_server(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+async def drive(base_url: str, schedule: List[str], payloads: Payloads, concurrency: int,
+                duration: float, timeout: float) -> Tuple[Dict[str, List[Tuple]], float]:
+    """Closed-loop clients: each sends its next request as soon as the previous one returns.
+    Returns endpoint -> [(latency s, ok, empty suggestions, shed, coalesced)], and the
+    measured wall time. A 503 from load shedding is `shed`, not an error; `coalesced` means
+    the response was shared with an identical request (joined or grace)."""
+    samples: Dict[str, List[Tuple]] = {e: [] for e in set(schedule)}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        t_start = time.perf_counter()
+        deadline = t_start + duration
+
+        async def worker(wid: int) -> None:
+            i = wid
+            while time.perf_counter() < deadline:
+                endpoint = schedule[i % len(schedule)]
+                req = payloads.request(endpoint, i)
+                i += concurrency
+                t0 = time.perf_counter()
+                empty = shed = coalesced = False
+                try:
+                    resp = await client.post(req.pop("url"), **req)
+                    shed = resp.status_code == 503 and "retry-after" in resp.headers
+                    ok = resp.status_code < 400 or shed
+                    coalesced = resp.headers.get("x-coalesced", "") in ("joined", "grace")
+                    if resp.status_code < 400 and endpoint == "suggest":
+                        empty = not resp.json().get("suggestions")
+                except httpx.HTTPError:
+                    ok = False
+                samples[endpoint].append((time.perf_counter() - t0, ok, empty, shed, coalesced))
+
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        return samples, time.perf_counter() - t_start
+
+
+def summarize(samples: Dict[str, List[Tuple]], wall: float) -> Dict[str, Dict]:
+    out: Dict[str, Dict] = {}
+    for endpoint, rows in sorted(samples.items()):
+        if not rows:
+            continue
+        lat = np.asarray([r[0] for r in rows]) * 1000.0
+        errors = sum(1 for r in rows if not r[1])
+        out[endpoint] = {
+            "requests": len(rows),
+            "errors": errors,
+            "error_rate": errors / len(rows),
+            "empty_suggestions": sum(1 for r in rows if r[2]),
+            "shed": sum(1 for r in rows if r[3]),
+            "coalesced": sum(1 for r in rows if r[4]),
+            "rps": len(rows) / wall if wall > 0 else 0.0,
+            "p50_ms": float(np.percentile(lat, 50)),
+            "p95_ms": float(np.percentile(lat, 95)),
+            "p99_ms": float(np.percentile(lat, 99)),
+        }
+    return out
+
+
+def _ints(spec: str) -> List[int]:
+    return [int(x) for x in spec.split(",") if x.strip()]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Local end-to-end load test with a Gemini stub")
+    ap.add_argument("--workers", default="1,2", help="Comma-separated uvicorn worker counts to sweep")
+    ap.add_argument("--concurrency", default="1,8,32", help="Comma-separated client concurrency levels to sweep")
+    ap.add_argument("--duration", type=float, default=15.0, help="Seconds per sweep point")
+    ap.add_argument("--mix", default="suggest=4,upload=2,generate_claim=1,cms1500=1", help="Weighted endpoint mix")
+    ap.add_argument("--mode", default="llm", choices=["llm", "hybrid"], help="SUGGEST_MODE for the server")
+    ap.add_argument("--data_dir", default="", help="Index/catalogue files for the server (needed for hybrid)")
+    ap.add_argument("--timeout", type=float, default=60.0, help="Client timeout per request (s)")
+    ap.add_argument("--llm_latency", default="lognormal:600,0.4")
+    ap.add_argument("--llm_error_rate", type=float, default=0.0)
+    ap.add_argument("--llm_malformed_rate", type=float, default=0.0)
+    ap.add_argument("--singleflight", action="store_true",
+                    help="Keep request coalescing on in the server (SINGLEFLIGHT=1; off by default)")
+    ap.add_argument("--load_control", action="store_true",
+                    help="Keep load-adaptive degradation/shedding on in the server (LOAD_CONTROL=1; off by default)")
+    ap.add_argument("--out", default="", help="Write results JSON here")
+    args = ap.parse_args()
+
+    schedule = _parse_mix(args.mix)
+    payloads = Payloads()
+    cfg = StubConfig(args.llm_latency, args.llm_error_rate, args.llm_malformed_rate)
+    stub = start_stub(cfg)
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+    results = []
+    print(f"{'workers':>7} {'conc':>5} {'endpoint':<15} {'reqs':>6} {'err%':>6} {'shed':>5} {'coal':>5} {'rps':>8} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    try:
+        for workers in _ints(args.workers):
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            with tempfile.TemporaryDirectory(prefix="claimpilot-load-") as workdir:
+                proc = start_server(workers, port, stub_url, args.mode, args.data_dir, workdir,
+                                    args.singleflight, args.load_control)
+                try:
+                    wait_ready(base_url, proc)
+                    # One untimed pass over every endpoint so lazy paths are warm in at least one worker
+                    with httpx.Client(base_url=base_url, timeout=args.timeout) as warm:
+                        for i, ep in enumerate(sorted(set(schedule))):
+                            req = payloads.request(ep, i)
+                            warm.post(req.pop("url"), **req)
+                    for conc in _ints(args.concurrency):
+                        samples, wall = asyncio.run(drive(base_url, schedule, payloads, conc, args.duration, args.timeout))
+                        point = {"workers": workers, "concurrency": conc, "wall_s": wall,
+                                 "endpoints": summarize(samples, wall)}
+                        results.append(point)
+                        for ep, s in point["endpoints"].items():
+                            print(f"{workers:>7} {conc:>5} {ep:<15} {s['requests']:>6} {s['error_rate'] * 100:>5.1f}% "
+                                  f"{s['shed']:>5} {s['coalesced']:>5} {s['rps']:>8.2f} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f}")
+                finally:
+                    stop_server(proc)
+    finally:
+        stub.shutdown()
+
+    report = {
+        "config": {k: getattr(args, k) for k in ("workers", "concurrency", "duration", "mix", "mode",
+                                                 "llm_latency", "llm_error_rate", "llm_malformed_rate",
+                                                 "singleflight", "load_control")},
+        "stub": dict(cfg.stats),
+        "points": results,
+    }
+    print(f"stub: {report['stub']}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved: {args.out}")
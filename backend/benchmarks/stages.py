@@ -0,0 +1,260 @@
+# benchmarks/stages.py
+"""Stage-level micro-benchmarks for the coding pipeline, fully offline.
+
+Each stage times one pipeline function on synthetic inputs (benchmarks/synthetic.py).
+Results are per-call latencies (median/p95) written as JSON; --compare checks them
+against a saved baseline and exits 1 when a stage regressed beyond --tolerance.
+
+Run from backend/:
+  python -m benchmarks.stages --save benchmarks/baseline.json
+  python -m benchmarks.stages --compare benchmarks/baseline.json --tolerance 0.25
+
+Stages whose optional dependency is missing (tesseract, a locally cached encoder,
+faiss) are reported as skipped rather than failing the run.
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Never reach out to the model hub: the encoder stage uses a locally cached model or is skipped
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+from benchmarks import synthetic  # noqa: E402
+
+
+class Skip(Exception):
+    """Raised by a stage's setup when it cannot run in this environment."""
+
+
+def measure(fn: Callable[[], object], min_time: float = 0.5, min_samples: int = 5) -> Dict[str, float]:
+    """Per-call latency of fn(). Fast functions are looped `number` times per sample
+    (calibrated so one sample takes >= ~2 ms) so timer resolution does not dominate."""
+    fn()  # warm-up (lazy imports, caches)
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        dt = time.perf_counter() - t0
+        if dt >= 0.002 or number >= 1 << 16:
+            break
+        number *= 4
+    samples = [dt / number]
+    deadline = time.perf_counter() + min_time
+    while len(samples) < min_samples or time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - t0) / number)
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "median_ms": float(np.median(ms)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "min_ms": float(ms.min()),
+        "samples": len(samples),
+        "calls_per_sample": number,
+    }
+
+
+def _stages(workdir: str) -> Dict[str, Callable[[], Callable[[], object]]]:
+    """stage name -> setup(); setup builds the inputs and returns the timed callable."""
+    note = synthetic.clinical_note(seed=7, paragraphs=6)
+
+    def pdf_text():
+        from app.ocr import extract_text_from_pdf_bytes
+        pdf = synthetic.note_pdf(synthetic.clinical_note(seed=3, paragraphs=40))
+        if not extract_text_from_pdf_bytes(pdf).strip():
+            raise Skip("pdfminer.six not installed")
+        return lambda: extract_text_from_pdf_bytes(pdf)
+
+    def image_ocr():
+        from app.ocr import extract_text_from_image_bytes, _pytesseract
+        tess = _pytesseract()
+        if tess is None:
+            raise Skip("pytesseract not installed")
+        try:
+            tess.get_tesseract_version()
+        except Exception:
+            raise Skip("tesseract binary not found")
+        img = synthetic.note_image(note)
+        return lambda: extract_text_from_image_bytes(img)
+
+    def section():
+        from app.ocr import extract_clinical_note_section
+        return lambda: extract_clinical_note_section(note)
+
+    def ner():
+        from app.ner import extract_entities
+        return lambda: extract_entities(note)
+
+    def encode():
+        from app.embeddings import embed_texts
+        try:
+            embed_texts(["warm-up"])
+        except Exception as e:
+            raise Skip(f"encoder unavailable offline ({type(e).__name__})")
+        phrases = [synthetic.clinical_note(seed=i, paragraphs=1).splitlines()[9] for i in range(8)]
+        return lambda: embed_texts(phrases, batch_size=64)
+
+    def faiss_search():
+        try:
+            import faiss  # noqa: F401
+        except Exception:
+            raise Skip("faiss not installed")
+        from app.retrieval import FaissIndexWrapper
+        paths = synthetic.build_index(os.path.join(workdir, "index"), rows=5000, dim=768)
+        wrapper = FaissIndexWrapper(paths["index_path"], paths["desc_path"], paths["meta_path"])
+        q = synthetic.query_vectors(3, dim=768)
+        return lambda: wrapper.search(q, top_k=10)
+
+    def aggregate():
+        from app.retrieval import top_unique
+        # Dedupe/top-k on the id/score arrays only (aggregate_arrays adds the row lookups)
+        key_ids, ids, scores = synthetic.search_hits(queries=4, k=200)
+        return lambda: top_unique(key_ids, ids, scores, 20)
+
+    def aggregate_arrays():
+        try:
+            import faiss  # noqa: F401
+        except Exception:
+            raise Skip("faiss not installed")
+        from app.retrieval import FaissIndexWrapper
+        paths = synthetic.build_index(os.path.join(workdir, "index"), rows=5000, dim=768)
+        wrapper = FaissIndexWrapper(paths["index_path"], paths["desc_path"], paths["meta_path"])
+        # Full text + 3 entity phrases at a large k, as /suggest searches them
+        D, I = wrapper.search_ids(synthetic.query_vectors(4, dim=768), top_k=200)
+        wrapper.key_ids()
+        return lambda: wrapper.aggregate(D, I, top_k=20)
+
+    def extract_json():
+        from app.llm_refine import _extract_json
+        responses = synthetic.llm_responses()
+        return lambda: [_extract_json(r) for r in responses]
+
+    def header():
+        from app.cms1500 import parse_header_info
+        return lambda: parse_header_info(note)
+
+    def cms1500_pdf():
+        from app.cms1500 import generate_cms1500_pdf
+        dx = [{"code": c, "description": d} for c, s, d in synthetic.SAMPLE_CODES if s == "ICD-10"][:4]
+        px = [{"code": c, "description": d} for c, s, d in synthetic.SAMPLE_CODES if s == "CPT"][:3]
+        kw = dict(patient_name="Test Patient", patient_id="P100007", provider_name="Dr. Alex Rivera",
+                  date_of_service="2024-03-15", patient_dob="1980-04-12", patient_sex="F",
+                  diagnoses=dx, procedures=px, diag_pointers=[[1, 2], [1], [3, 4]])
+        return lambda: generate_cms1500_pdf(**kw)
+
+    def claim_hash():
+        from app.blockchain import compute_claim_hash
+        payload = {
+            "claim_id": "CLM-0001",
+            "approved": [{"code": c, "system": s, "description": d} for c, s, d in synthetic.SAMPLE_CODES[:6]],
+            "timestamp": 1710460800,
+        }
+        return lambda: compute_claim_hash(payload)
+
+    return {
+        "extract_text_from_pdf_bytes": pdf_text,
+        "extract_text_from_image_bytes": image_ocr,
+        "extract_clinical_note_section": section,
+        "extract_entities": ner,
+        "embed_texts": encode,
+        "faiss_search": faiss_search,
+        "aggregate": aggregate,
+        "aggregate_arrays": aggregate_arrays,
+        "extract_json": extract_json,
+        "parse_header_info": header,
+        "generate_cms1500_pdf": cms1500_pdf,
+        "compute_claim_hash": claim_hash,
+    }
+
+
+def run(only: Optional[List[str]] = None, min_time: float = 0.5) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="claimpilot-bench-")
+    results: Dict[str, Dict] = {}
+    try:
+        for name, setup in _stages(workdir).items():
+            if only and name not in only:
+                continue
+            # Pipeline functions print debug lines; keep them out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                try:
+                    res = measure(setup(), min_time=min_time)
+                except Skip as e:
+                    res = {"skipped": str(e)}
+                except Exception as e:
+                    res = {"skipped": f"error: {type(e).__name__}: {e}"}
+            results[name] = res
+            if "skipped" in res:
+                print(f"{name:<32} skipped ({res['skipped']})")
+            else:
+                print(f"{name:<32} median={res['median_ms']:9.3f} ms  p95={res['p95_ms']:9.3f} ms  n={res['samples']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "meta": {
+            "ts": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "min_time": min_time,
+        },
+        "stages": results,
+    }
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float, min_delta_ms: float) -> Tuple[List[str], List[str]]:
+    """Returns (report lines, regressed stage names). A stage regresses when its median
+    exceeds the baseline median by more than `tolerance` (relative) AND `min_delta_ms`."""
+    lines, regressed = [], []
+    for name, cur in current["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base or "skipped" in base or "skipped" in cur:
+            lines.append(f"{name:<32} n/a (skipped or not in baseline)")
+            continue
+        b, c = base["median_ms"], cur["median_ms"]
+        ratio = c / b if b > 0 else float("inf")
+        bad = c > b * (1.0 + tolerance) and (c - b) > min_delta_ms
+        if bad:
+            regressed.append(name)
+        lines.append(f"{name:<32} {b:9.3f} -> {c:9.3f} ms  ({ratio:5.2f}x){'  REGRESSION' if bad else ''}")
+    return lines, regressed
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Offline stage benchmarks for the ClaimPilot pipeline")
+    ap.add_argument("--save", help="Write results JSON here (e.g. a new baseline)")
+    ap.add_argument("--compare", help="Baseline JSON to compare against; exit 1 on regression")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown of the median (0.25 = 25%%)")
+    ap.add_argument("--min_delta_ms", type=float, default=0.05, help="Ignore slowdowns smaller than this (timer noise)")
+    ap.add_argument("--min_time", type=float, default=0.5, help="Seconds of sampling per stage")
+    ap.add_argument("--only", default="", help="Comma-separated stage names")
+    args = ap.parse_args()
+
+    only = [s.strip() for s in args.only.split(",") if s.strip()] or None
+    current = run(only=only, min_time=args.min_time)
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"saved: {args.save}")
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressed = compare(baseline, current, args.tolerance, args.min_delta_ms)
+        print("\n".join(lines))
+        if regressed:
+            print(f"regressed (> {args.tolerance:.0%}): {', '.join(regressed)}")
+            status = 1
+    sys.exit(status)
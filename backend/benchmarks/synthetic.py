@@ -0,0 +1,198 @@
+# benchmarks/synthetic.py
+"""Deterministic synthetic inputs for the offline benchmarks and load tests:
+clinical notes, text PDFs, note images and a small FAISS code index. No PHI, no network."""
+import io
+import os
+import random
+import numpy as np
+from typing import List, Dict, Tuple
+
+_COMPLAINTS = [
+    "right knee pain after a twisting injury while playing soccer",
+    "persistent cough and low grade fever for two weeks",
+    "chest pain on exertion radiating to the left arm",
+    "lower back pain with intermittent numbness in the left leg",
+    "poorly controlled type 2 diabetes with elevated fasting glucose",
+    "elevated blood pressure readings at home over the last month",
+]
+_FINDINGS = [
+    "MRI of the right knee without contrast shows a medial meniscal tear.",
+    "Chest x-ray shows no focal consolidation or effusion.",
+    "ECG shows normal sinus rhythm without acute ST changes.",
+    "Lumbar spine MRI demonstrates a small L4-L5 disc protrusion.",
+    "HbA1c is 8.4 percent, up from 7.6 percent three months ago.",
+    "Blood pressure 152/94 on two separate readings in clinic.",
+]
+_PLANS = [
+    "Refer for arthroscopy with possible meniscectomy.",
+    "Start a course of therapeutic exercises twice weekly.",
+    "Continue metformin and add a GLP-1 receptor agonist.",
+    "Start lisinopril 10 mg daily and recheck in four weeks.",
+    "Order a stress test and lipid panel.",
+]
+
+# (code, system, description) rows used for the synthetic index and candidate lists
+SAMPLE_CODES: List[Tuple[str, str, str]] = [
+    ("M23.21", "ICD-10", "Derangement of medial meniscus due to old tear, right knee"),
+    ("M25.561", "ICD-10", "Pain in right knee"),
+    ("S83.211A", "ICD-10", "Bucket-handle tear of medial meniscus, right knee, initial encounter"),
+    ("E11.9", "ICD-10", "Type 2 diabetes mellitus without complications"),
+    ("E11.65", "ICD-10", "Type 2 diabetes mellitus with hyperglycemia"),
+    ("I10", "ICD-10", "Essential (primary) hypertension"),
+    ("R05.9", "ICD-10", "Cough, unspecified"),
+    ("R07.9", "ICD-10", "Chest pain, unspecified"),
+    ("M54.50", "ICD-10", "Low back pain, unspecified"),
+    ("73721", "CPT", "MRI any joint of lower extremity without contrast material"),
+    ("29881", "CPT", "Arthroscopy, knee, surgical; with meniscectomy"),
+    ("97110", "CPT", "Therapeutic exercises"),
+    ("99213", "CPT", "Office visit, established patient, low complexity"),
+    ("71046", "CPT", "Radiologic examination, chest; 2 views"),
+    ("93000", "CPT", "Electrocardiogram, routine ECG with interpretation and report"),
+]
+
+
+def clinical_note(seed: int = 0, paragraphs: int = 3) -> str:
+    """A header block plus a 'Clinical Note' section and trailing sections, like the uploads."""
+    rnd = random.Random(seed)
+    body = []
+    for _ in range(max(1, paragraphs)):
+        body.append(
+            f"Patient presents with {rnd.choice(_COMPLAINTS)}. {rnd.choice(_FINDINGS)} "
+            f"{rnd.choice(_FINDINGS)} {rnd.choice(_PLANS)}"
+        )
+    return "\n".join([
+        "Doctor: Dr. Alex Rivera",
+        f"Patient Name: Test Patient {seed}",
+        f"Patient ID: P{100000 + seed}",
+        "DOB: 1980-04-12",
+        "Sex: F",
+        "Address: 1 Example Street, Springfield",
+        "Date of Service: 2024-03-15",
+        "",
+        "Clinical Note",
+        *body,
+        "",
+        "Assessment",
+        rnd.choice(_FINDINGS),
+        "Plan",
+        rnd.choice(_PLANS),
+    ])
+
+
+def note_pdf(text: str) -> bytes:
+    """Render note text into a text-layer PDF (one line per row, new page when full)."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=letter)
+    _, height = letter
+    y = height - 54
+    c.setFont("Helvetica", 10)
+    for para in text.splitlines():
+        words, line = para.split(), ""
+        for w in words + [None]:
+            if w is not None and len(line) + len(w) < 95:
+                line = f"{line} {w}".strip()
+                continue
+            c.drawString(54, y, line)
+            y -= 14
+            if y < 54:
+                c.showPage()
+                c.setFont("Helvetica", 10)
+                y = height - 54
+            line = w or ""
+    c.save()
+    return buf.getvalue()
+
+
+def note_image(text: str, width: int = 1275) -> bytes:
+    """Render note text into a PNG (a phone photo / scan stand-in for the OCR path)."""
+    from PIL import Image, ImageDraw
+
+    lines: List[str] = []
+    for para in text.splitlines():
+        while len(para) > 90:
+            cut = para.rfind(" ", 0, 90)
+            cut = cut if cut > 0 else 90
+            lines.append(para[:cut])
+            para = para[cut:].lstrip()
+        lines.append(para)
+    img = Image.new("L", (width, 60 + 22 * len(lines)), color=255)
+    draw = ImageDraw.Draw(img)
+    for i, ln in enumerate(lines):
+        draw.text((40, 30 + 22 * i), ln, fill=0)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def llm_responses() -> List[str]:
+    """Model outputs in the shapes _extract_json has to cope with: clean, fenced, prose-wrapped."""
+    items = (
+        '[{"code": "M23.21", "system": "ICD-10", "description": "Derangement of medial meniscus", '
+        '"confidence": 0.82, "rationale": "MRI shows medial meniscal tear"}, '
+        '{"code": "73721", "system": "CPT", "description": "MRI lower extremity joint without contrast", '
+        '"confidence": 0.9, "rationale": "MRI of the knee without contrast"}]'
+    )
+    return [
+        items,
+        f"```json\n{items}\n```",
+        f"Here are the suggested codes based on the note:\n{items}\nLet me know if you need more detail.",
+    ]
+
+
+def search_hits(queries: int = 4, k: int = 200, rows: int = 5000, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(key_ids, ids, scores) shaped like /suggest's dense hits before aggregation: one ranked
+    row per query (full text + entity phrases) with ids overlapping across rows, and ~2% of
+    index rows sharing a (code, system) key with an earlier row."""
+    rng = np.random.default_rng(seed)
+    key_ids = np.arange(rows, dtype=np.int64)
+    dup = rng.choice(np.arange(1, rows), size=rows // 50, replace=False)
+    key_ids[dup] = rng.integers(0, dup)
+    pool = rng.choice(rows, size=min(rows, k * 3), replace=False)
+    ids = np.stack([rng.choice(pool, size=k, replace=False) for _ in range(queries)]).astype(np.int64)
+    scores = -np.sort(-rng.random((queries, k), dtype=np.float32), axis=1)
+    return key_ids, ids, scores
+
+
+def build_index(out_dir: str, rows: int = 5000, dim: int = 768, seed: int = 0) -> Dict[str, str]:
+    """Write faiss.index, faiss.{icd10,cpt}.index and columnar meta_*.npy with random unit vectors.
+    Returns the paths in the layout FaissIndexWrapper/get_index expect."""
+    import faiss
+    from app.retrieval import SYSTEMS, system_index_path
+    from app.meta_store import MetaStore
+
+    rng = np.random.default_rng(seed)
+    embs = rng.standard_normal((rows, dim), dtype=np.float32)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    meta = np.empty(rows, dtype=object)
+    for i in range(rows):
+        code, system, desc = SAMPLE_CODES[i % len(SAMPLE_CODES)]
+        meta[i] = (f"{code}.{i}" if system == "ICD-10" else f"{code}{i}", system, f"{desc} ({i})")
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {
+        "index_path": os.path.join(out_dir, "faiss.index"),
+        "desc_path": os.path.join(out_dir, "descriptions.npy"),
+        "meta_path": os.path.join(out_dir, "meta.npy"),
+    }
+    MetaStore.from_rows(meta).save(paths["meta_path"])
+    ids = np.arange(rows, dtype=np.int64)
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    index.add_with_ids(embs, ids)
+    faiss.write_index(index, paths["index_path"])
+    systems = np.array([row[1] for row in meta], dtype=object)
+    for system in SYSTEMS:
+        sel = ids[systems == system]
+        sub = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        sub.add_with_ids(embs[sel], sel)
+        faiss.write_index(sub, system_index_path(paths["index_path"], system))
+    return paths
+
+
+def query_vectors(n: int, dim: int = 768, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    q = rng.standard_normal((n, dim), dtype=np.float32)
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    return q
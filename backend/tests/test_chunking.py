@@ -0,0 +1,65 @@
+# tests/test_chunking.py
+# Run from backend/: python -m pytest tests
+import re
+
+import pytest
+
+from app import chunking
+from app.tracing import start_trace
+
+_HEADER = "Patient ID: P100042\nDOB: 1980-04-12\nDate of Service: 2024-03-15\n\n"
+
+
+def _note(n_paragraphs: int = 40) -> str:
+    sections = []
+    for s in range(4):
+        paras = []
+        for p in range(n_paragraphs // 4):
+            i = s * 100 + p
+            paras.append(f"Finding {i} shows a medial meniscal tear in segment {i}. "
+                         f"Plan {i} is arthroscopy with follow up in {i} days. "
+                         f"Patient {i} tolerated the exam without distress.")
+        sections.append(f"SECTION {s}:\n" + "\n".join(paras))
+    return _HEADER + "\n\n".join(sections)
+
+
+def _sentences(text: str):
+    return [s for s in re.split(r"(?<=[.;!?])\s+", re.sub(r"\s+", " ", text)) if s.startswith(("Finding", "Plan", "Patient"))]
+
+
+@pytest.fixture(autouse=True)
+def _small_windows(monkeypatch):
+    monkeypatch.setenv("LLM_CHUNK_TOKENS", "200")
+    monkeypatch.setenv("LLM_CHUNK_MAX_TOKENS", "200")
+    monkeypatch.setenv("LLM_CHUNK_OVERLAP", "30")
+    monkeypatch.setenv("EMBED_WINDOW_TOKENS", "120")
+    monkeypatch.setenv("EMBED_WINDOW_OVERLAP", "20")
+
+
+@pytest.mark.parametrize("split", [chunking.llm_chunks, chunking.embedding_windows])
+def test_every_paragraph_lands_in_a_chunk(split):
+    # Default LLM_MAX_CHUNKS / EMBED_MAX_WINDOWS: nothing is dropped or sampled
+    text = _note()
+    trace = start_trace("test")
+    chunks = split(text)
+    assert len(chunks) > 6
+    for sentence in _sentences(text):
+        assert any(sentence in c for c in chunks), sentence
+    assert "partial" not in trace.mode
+
+
+def test_short_header_block_shares_the_first_window():
+    chunks = chunking.split_windows(_note(), 120, 20)
+    assert chunks[0].startswith("Patient ID:")
+    assert "SECTION 0:" in chunks[0]
+
+
+def test_cap_keeps_leading_chunks_and_flags_partial(monkeypatch):
+    monkeypatch.setenv("LLM_MAX_CHUNKS", "3")
+    text = _note()
+    trace = start_trace("test")
+    chunks = chunking.llm_chunks(text)
+    assert len(chunks) == 3
+    assert chunks == chunking.split_windows(text, 200, 30)[:3]
+    assert trace.mode.get("partial") == "true"
+    assert trace.sizes.get("chunks_dropped", 0) > 0